@@ -1,9 +1,15 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import os
-import base64
-from smart_reconciliation_system import SmartReconciliationSystem
+import math
+import tempfile
+import importlib.util
+from datetime import datetime
+from smart_reconciliation_system import SmartReconciliationSystem, RowSelection, materialize
+from results_store import ReconciliationResultsStore
+from result_cache import ResultCache
 from PIL import Image
 # این تابع را در بالای فایل app.py (بعد از imports) اضافه کنید
 
@@ -16,8 +22,8 @@ def fix_dataframe_for_streamlit(df):
     if df is None or df.empty:
         return pd.DataFrame()
         
-    # کپی از دیتافریم
-    df_fixed = df.copy()
+    # نتایج ممکن است انتخابی از ردیف‌های دیتافریم منبع باشند؛ بدون کپی اضافه ساخته می‌شوند
+    df_fixed = materialize(df)
     
     # تبدیل تمام نام‌های ستون به رشته
     columns = [str(col) for col in df_fixed.columns]
@@ -40,10 +46,506 @@ def fix_dataframe_for_streamlit(df):
                 new_columns.append(col)
                 seen.add(col)
         
-        # اعمال نام‌های جدید
-        df_fixed.columns = new_columns
+        # اعمال نام‌های جدید (بدون تغییر دیتافریم منبع)
+        df_fixed = df_fixed.set_axis(new_columns, axis=1)
     
     return df_fixed
+
+def filter_sort_rows(df, search=None, sort_column=None, descending=False):
+    """
+    فیلتر و مرتب‌سازی سمت سرور؛ خروجی انتخابی از ردیف‌های جدول است و داده‌ای کپی نمی‌شود
+    """
+    if isinstance(df, RowSelection):
+        source, positions = df.source, df.positions
+    else:
+        source, positions = df, np.arange(len(df))
+    
+    if search:
+        mask = np.zeros(len(positions), dtype=bool)
+        for j in range(source.shape[1]):
+            values = source.iloc[positions, j].astype(str)
+            mask |= values.str.contains(search, case=False, regex=False, na=False).to_numpy()
+        positions = positions[mask]
+    
+    column_names = [str(col) for col in source.columns]
+    if sort_column in column_names:
+        values = source.iloc[positions, column_names.index(sort_column)].reset_index(drop=True)
+        try:
+            order = values.sort_values(ascending=not descending, kind='stable').index.to_numpy()
+        except TypeError:
+            # ستون‌های با نوع داده مخلوط به‌صورت متنی مرتب می‌شوند
+            order = values.astype(str).sort_values(ascending=not descending, kind='stable').index.to_numpy()
+        positions = positions[order]
+    
+    return RowSelection(source, positions)
+
+def table_to_csv(view, decorate=None):
+    """
+    ساخت فایل CSV فقط هنگام کلیک روی دکمه دانلود
+    """
+    df = materialize(view)
+    if decorate is not None:
+        df = decorate(df)
+    return fix_dataframe_for_streamlit(df).to_csv(index=False).encode('utf-8')
+
+def build_report_bytes(results, output_file):
+    """
+    ساخت گزارش اکسل فقط هنگام کلیک روی دکمه دانلود
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        report_path = os.path.join(temp_dir, output_file)
+        system.generate_report(results, report_path)
+        with open(report_path, "rb") as f:
+            return f.read()
+
+def build_bundle_bytes(results, output_file):
+    """
+    ساخت بسته zip گزارش (CSV فشرده هر شیت و خلاصه JSON) با کارگرهای هم‌زمان، فقط هنگام کلیک روی دکمه دانلود
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        bundle_path = os.path.join(temp_dir, output_file)
+        system.generate_report_bundle(results, bundle_path)
+        with open(bundle_path, "rb") as f:
+            return f.read()
+
+@st.fragment
+def render_paginated_table(df, table_key, tab_name, decorate=None):
+    """
+    نمایش صفحه‌بندی‌شده جدول با جستجو و مرتب‌سازی سمت سرور؛ فقط ردیف‌های صفحه جاری به مرورگر فرستاده می‌شوند
+    """
+    search_col, sort_col, order_col, size_col = st.columns([3, 2, 1, 1])
+    with search_col:
+        search = st.text_input("جستجو", key=f"{table_key}_search", placeholder="جستجو در تمام ستون‌ها...")
+    with sort_col:
+        sort_column = st.selectbox("مرتب‌سازی بر اساس", ["بدون مرتب‌سازی"] + [str(col) for col in df.columns], key=f"{table_key}_sort")
+    with order_col:
+        descending = st.checkbox("نزولی", key=f"{table_key}_desc")
+    with size_col:
+        page_size = st.selectbox("ردیف در صفحه", [50, 100, 250, 500], key=f"{table_key}_size")
+    
+    # نتیجه فیلتر و مرتب‌سازی تا تغییر پارامترها نگه داشته می‌شود تا ورق زدن صفحه‌ها سریع بماند
+    params = (search, sort_column, descending)
+    cached = st.session_state.get(f"{table_key}_view")
+    if cached is None or cached[0] != params:
+        cached = (params, filter_sort_rows(df, search, sort_column, descending))
+        st.session_state[f"{table_key}_view"] = cached
+    view = cached[1]
+    
+    total_pages = max(1, math.ceil(len(view) / page_size))
+    if st.session_state.get(f"{table_key}_page", 1) > total_pages:
+        st.session_state[f"{table_key}_page"] = total_pages
+    page = st.number_input("صفحه", min_value=1, max_value=total_pages, step=1, key=f"{table_key}_page")
+    
+    start = (page - 1) * page_size
+    page_df = view.page(start, start + page_size)
+    if decorate is not None:
+        page_df = decorate(page_df)
+    
+    st.dataframe(
+        fix_dataframe_for_streamlit(page_df),
+        use_container_width=True,
+        height=450,
+        column_config={
+            "_index": st.column_config.Column(
+                label="ردیف",
+                width="small"
+            )
+        }
+    )
+    st.caption(f"نمایش ردیف {min(start + 1, len(view))} تا {min(start + page_size, len(view))} از {len(view)} (صفحه {page} از {total_pages})")
+    
+    st.download_button(
+        label=f"دانلود {tab_name}",
+        data=lambda: table_to_csv(view, decorate),
+        file_name=f"{tab_name.replace(' ', '_')}.csv",
+        mime='text/csv',
+        key=f"{table_key}_download",
+        on_click="ignore",
+        help=f"دریافت داده‌های {tab_name} (با فیلتر و مرتب‌سازی فعلی) در قالب CSV"
+    )
+
+@st.cache_data(show_spinner=False)
+def build_match_charts(match_count, non_match_count, selected_gateway):
+    """
+    ساخت نمودارهای تطابق از روی اعداد خلاصه اجرا (با کش، بدون شمارش دوباره جدول‌ها)
+    """
+    fig = px.pie(
+        names=["تطابق‌ها", "عدم تطابق‌ها"],
+        values=[match_count, non_match_count],
+        color_discrete_sequence=["#27ae60", "#e74c3c"],
+        hole=0.5,
+        title=f"تحلیل تطابق برای {selected_gateway}"
+    )
+    fig.update_traces(
+        textposition='inside',
+        textinfo='percent+label',
+        marker=dict(line=dict(color='white', width=3)),
+        pull=[0.1, 0]
+    )
+    fig.update_layout(
+        font=dict(family='Vazir', size=16, color="#2c3e50"),
+        legend=dict(orientation="h", y=-0.1, x=0.5, font=dict(color="#2c3e50")),
+        margin=dict(t=60, b=60, l=20, r=20),
+        paper_bgcolor='rgba(255, 255, 255, 0.9)',
+        plot_bgcolor='rgba(255, 255, 255, 0.9)',
+        title_font=dict(color="#2c3e50", size=18)
+    )
+    bar_fig = px.bar(
+        x=["تطابق‌ها", "عدم تطابق‌ها"],
+        y=[match_count, non_match_count],
+        color=["تطابق‌ها", "عدم تطابق‌ها"],
+        color_discrete_map={"تطابق‌ها": "#27ae60", "عدم تطابق‌ها": "#e74c3c"},
+        title="مقایسه آماری"
+    )
+    bar_fig.update_layout(
+        font=dict(family='Vazir', size=16, color="#2c3e50"),
+        showlegend=False,
+        margin=dict(t=60, b=40, l=40, r=20),
+        paper_bgcolor='rgba(255, 255, 255, 0.9)',
+        plot_bgcolor='rgba(255, 255, 255, 0.9)',
+        title_font=dict(color="#2c3e50", size=18),
+        yaxis=dict(tickfont=dict(color="#2c3e50")),
+        xaxis=dict(tickfont=dict(color="#2c3e50"))
+    )
+    return fig, bar_fig
+
+@st.cache_data(show_spinner=False)
+def build_breakdown_chart(breakdown, title):
+    """
+    نمودار تفکیکی تطابق/عدم تطابق از روی یک بخش خلاصه (ستون، الگو، بازه مبلغ یا ساعت)
+    """
+    labels = [label for label, _, _ in breakdown]
+    fig = px.bar(
+        x=labels + labels,
+        y=[matched for _, matched, _ in breakdown] + [unmatched for _, _, unmatched in breakdown],
+        color=["تطابق‌ها"] * len(labels) + ["عدم تطابق‌ها"] * len(labels),
+        color_discrete_map={"تطابق‌ها": "#27ae60", "عدم تطابق‌ها": "#e74c3c"},
+        barmode="stack",
+        title=title
+    )
+    fig.update_layout(
+        font=dict(family='Vazir', size=14, color="#2c3e50"),
+        legend=dict(orientation="h", y=-0.2, x=0.5, title=None),
+        margin=dict(t=60, b=40, l=40, r=20),
+        paper_bgcolor='rgba(255, 255, 255, 0.9)',
+        plot_bgcolor='rgba(255, 255, 255, 0.9)',
+        title_font=dict(color="#2c3e50", size=16),
+        xaxis=dict(title=None, type="category", tickfont=dict(color="#2c3e50")),
+        yaxis=dict(title=None, tickfont=dict(color="#2c3e50"))
+    )
+    return fig
+
+def render_results(results, selected_gateway):
+    """
+    نمایش نتایج مغایرت‌گیری ذخیره‌شده در Session State
+    """
+    # پیام موفقیت با افکت کنفتی
+    st.markdown("""
+    <div class="success-message">
+        <div class="success-icon">✓</div>
+        <h3 style="color: #27ae60; margin-bottom: 15px; font-size: 1.5rem;">عملیات با موفقیت انجام شد</h3>
+        <p style="color: #2c3e50; margin: 0; font-size: 1.1rem;">نتایج تحلیل آماده نمایش است</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    st.markdown('<div class="card animated"><h2 class="section-header rtl">نتایج تحلیل مغایرت‌گیری</h2>', unsafe_allow_html=True)
+    
+    if results.get('cache_hit'):
+        st.info("♻️ این فایل‌ها با همین تنظیمات قبلاً مغایرت‌گیری شده‌اند؛ نتیجه و گزارش از کش خوانده شد.")
+    
+    st.markdown("""
+    <div class="success rtl">
+        <h4>✅ عملیات کامل شد</h4>
+        <p>داده‌ها با دقت بالا مقایسه شدند. نتایج را بررسی کنید.</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    col1, col2, col3 = st.columns(3)
+    
+    # همه اعداد و نمودارها از خلاصه‌ای که موتور در پایان اجرا ساخته خوانده می‌شوند
+    summary = results.get('summary') or system.build_summary(results)
+    
+    if 'matches' in results and 'non_matches' in results:
+        total_matches = summary['matches']
+        total_non_matches = summary['non_matches']
+        match_percent = summary['match_percent']
+        
+        if match_percent >= 90:
+            match_color = "#27ae60"
+        elif match_percent >= 70:
+            match_color = "#f1c40f"
+        else:
+            match_color = "#e74c3c"
+    
+    with col1:
+        if 'platform_codes' in results:
+            st.markdown(f"""
+            <div class="metric-card animated">
+                <div class="metric-value">{summary['platform_codes']}</div>
+                <div class="metric-label">کدهای پلتفرم</div>
+            </div>
+            """, unsafe_allow_html=True)
+    
+    with col2:
+        if 'filtered_platform' in results:
+            st.markdown(f"""
+            <div class="metric-card animated">
+                <div class="metric-value">{summary['platform_records']}</div>
+                <div class="metric-label">رکوردهای {selected_gateway}</div>
+            </div>
+            """, unsafe_allow_html=True)
+    
+    with col3:
+        if 'matches' in results and 'non_matches' in results:
+            st.markdown(f"""
+            <div class="metric-card animated" style="border-right: 6px solid {match_color};">
+                <div class="metric-value" style="color: {match_color} !important;">{match_percent}%</div>
+                <div class="metric-label">تطابق</div>
+            </div>
+            """, unsafe_allow_html=True)
+    
+    if 'matches' in results and 'non_matches' in results:
+        st.markdown(f"""
+<div style="margin-top: 25px; margin-bottom: 30px;">
+    <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
+        <div style="color: #2c3e50;">0%</div>
+        <div style="color: #2c3e50;">50%</div>
+        <div style="color: #2c3e50;">100%</div>
+    </div>
+    <div style="width: 100%; height: 15px; background: rgba(255, 255, 255, 0.5); border-radius: 15px; overflow: hidden; box-shadow: 0 2px 8px rgba(0, 0, 0, 0.1);">
+        <div style="width: {match_percent}%; height: 100%; background: linear-gradient(90deg, {match_color}, {match_color}); border-radius: 15px; animation: slide 2s infinite ease-in-out;"></div>
+    </div>
+    <div style="text-align: center; margin-top: 10px; font-weight: bold; color: {match_color} !important; font-size: 1.1rem;">
+        {match_percent}% تطابق ({total_matches} از {total_matches + total_non_matches})
+    </div>
+</div>
+<style>
+    @keyframes slide {{
+        0% {{ transform: translateX(0); }}
+        50% {{ transform: translateX(20px); }}
+        100% {{ transform: translateX(0); }}
+    }}
+</style>
+""", unsafe_allow_html=True)
+    
+    st.markdown('<h3 class="section-header rtl">نمودارهای تحلیلی</h3>', unsafe_allow_html=True)
+    
+    if 'matches' in results and 'non_matches' in results:
+        fig, bar_fig = build_match_charts(summary['matches'], summary['non_matches'], selected_gateway)
+        
+        col1, col2 = st.columns([1, 1])
+        
+        with col1:
+            st.plotly_chart(fig, use_container_width=True)
+        
+        with col2:
+            st.plotly_chart(bar_fig, use_container_width=True)
+        
+        breakdowns = [
+            ("by_column", "تفکیک بر اساس ستون"),
+            ("by_pattern", "تفکیک بر اساس الگو"),
+            ("by_amount_bucket", "تفکیک بر اساس بازه مبلغ"),
+            ("by_hour", "تفکیک بر اساس ساعت")
+        ]
+        breakdowns = [(key, title) for key, title in breakdowns if summary.get(key)]
+        if breakdowns:
+            with st.expander("📊 تفکیک تطابق‌های ارائه‌دهنده"):
+                breakdown_cols = st.columns(2)
+                for j, (key, title) in enumerate(breakdowns):
+                    breakdown = tuple((label, counts['matched'], counts['unmatched']) for label, counts in summary[key].items())
+                    with breakdown_cols[j % 2]:
+                        st.plotly_chart(build_breakdown_chart(breakdown, title), use_container_width=True)
+        
+        if summary.get('candidate_matches', 0) > summary['matches']:
+            st.caption(f"از {summary['candidate_matches']} تطابق نامزد، بهترین تطابق هر ردیف ارائه‌دهنده بر اساس امتیاز اطمینان "
+                       f"({summary['matches']} تطابق) نگه داشته شد؛ همه نامزدها در شیت candidate_matches گزارش هستند.")
+        
+        if summary.get('by_verification'):
+            with st.expander("🔍 بررسی مبلغ، وضعیت و زمان جفت‌های منطبق"):
+                verification = pd.DataFrame(list(summary['by_verification'].items()), columns=['نتیجه بررسی', 'تعداد'])
+                st.dataframe(verification, use_container_width=True, hide_index=True)
+        
+        if results.get('pattern_profile') is not None:
+            with st.expander("⏱️ پروفایل الگوهای استخراج"):
+                st.caption("الگوهایی که زمان زیادی می‌گیرند ولی کدی از آن‌ها به تطابق نمی‌رسد کاندید حذف از پروفایل gateway هستند.")
+                st.dataframe(results['pattern_profile'], use_container_width=True, hide_index=True)
+    
+    st.markdown('<h3 class="section-header rtl">جداول تعاملی</h3>', unsafe_allow_html=True)
+    
+    tab_icons = {
+        "رکوردهای": '<i class="fas fa-search"></i>',
+        "کدهای استخراج شده": '<i class="fas fa-key"></i>',
+        "تطابق‌ها": '<i class="fas fa-check-circle"></i>',
+        "عدم تطابق‌ها": '<i class="fas fa-times-circle"></i>'
+    }
+    
+    tab_titles = []
+    tab_dataframes = []
+    # متن اصلی کدها فقط برای ردیف‌های صفحه جاری (یا هنگام دانلود) از دیتافریم منبع ساخته می‌شود
+    tab_decorators = []
+    
+    if 'filtered_platform' in results:
+        tab_titles.append(f"{tab_icons['رکوردهای']} رکوردهای {selected_gateway}")
+        tab_dataframes.append(results['filtered_platform'])
+        tab_decorators.append(None)
+    
+    if 'platform_codes' in results:
+        tab_titles.append(f"{tab_icons['کدهای استخراج شده']} کدهای استخراج شده")
+        tab_dataframes.append(results['platform_codes'])
+        tab_decorators.append(lambda page: system.resolve_original_text(page, results.get('platform')))
+    
+    if 'matches' in results:
+        tab_titles.append(f"{tab_icons['تطابق‌ها']} تطابق‌ها")
+        tab_dataframes.append(results['matches'])
+        tab_decorators.append(lambda page: system.matches_with_original_text(results, page))
+    
+    if 'non_matches' in results:
+        tab_titles.append(f"{tab_icons['عدم تطابق‌ها']} عدم تطابق‌ها")
+        tab_dataframes.append(results['non_matches'])
+        tab_decorators.append(None)
+    
+    st.markdown("""
+    <style>
+    .dataframe-container {
+        border-radius: 20px;
+        box-shadow: 0 8px 25px rgba(0, 0, 0, 0.1);
+        padding: 15px;
+        background: rgba(255, 255, 255, 0.9);
+        margin-top: 15px;
+        backdrop-filter: blur(5px);
+    }
+    .dataframe-header {
+        display: flex;
+        justify-content: space-between;
+        align-items: center;
+        padding: 15px;
+        border-bottom: 2px solid #e9ecef;
+        margin-bottom: 15px;
+        background: linear-gradient(90deg, #3498db, #2c3e50);
+        border-radius: 15px 15px 0 0;
+    }
+    .dataframe-title {
+        font-weight: bold;
+        color: white;
+    }
+    .dataframe-count {
+        background: rgba(255, 255, 255, 0.8);
+        color: #2c3e50 !important;
+        border-radius: 25px;
+        padding: 5px 15px;
+        font-weight: bold;
+    }
+    </style>
+    """, unsafe_allow_html=True)
+    
+    tabs = st.tabs(tab_titles)
+    
+    for i, tab in enumerate(tabs):
+        with tab:
+            tab_name = tab_titles[i].replace('<i class="fas fa-', '').replace('"></i>', '').split(" ", 1)[1]
+            st.markdown(f"""
+            <div class="dataframe-header rtl">
+                <div class="dataframe-title">{tab_name}</div>
+                <div class="dataframe-count">{len(tab_dataframes[i])} رکورد</div>
+            </div>
+            """, unsafe_allow_html=True)
+            
+            render_paginated_table(
+                tab_dataframes[i],
+                f"grid_{st.session_state.get('run_id')}_{i}",
+                tab_name,
+                decorate=tab_decorators[i]
+            )
+    
+    st.markdown('<h3 class="section-header rtl">گزارش نهایی</h3>', unsafe_allow_html=True)
+    
+    st.markdown("""
+    <div class="card" style="text-align: center; padding: 40px; background: rgba(255, 255, 255, 0.9);">
+        <h4 style="margin-bottom: 25px; color: #2c3e50; font-size: 1.5rem;">گزارش تحلیلی مغایرت‌گیری</h4>
+        <p style="color: #7f8c8d; font-size: 1.1rem;">گزارش کامل را با دکمه زیر دانلود کنید.</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    output_file = f"reconciliation_report_{selected_gateway}_{datetime.now():%Y%m%d_%H%M}.xlsx"
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        download_button_style = """
+        <style>
+        .download-excel-button {
+            background: linear-gradient(90deg, #e74c3c, #f1c40f);
+            color: white !important;
+            padding: 16px 32px;
+            border-radius: 30px;
+            font-weight: bold;
+            font-size: 1.2rem;
+            box-shadow: 0 8px 25px rgba(241, 196, 15, 0.4);
+            transition: all 0.4s ease;
+            display: inline-block;
+            position: relative;
+            overflow: hidden;
+        }
+        .download-excel-button:hover {
+            transform: scale(1.07);
+            box-shadow: 0 10px 30px rgba(241, 196, 15, 0.5);
+        }
+        .download-excel-button::after {
+            content: '';
+            position: absolute;
+            top: 0;
+            left: 0;
+            width: 100%;
+            height: 100%;
+            background: rgba(255, 255, 255, 0.3);
+            border-radius: 30px;
+            transform: scale(0);
+            transition: transform 0.4s ease;
+        }
+        .download-excel-button:hover::after {
+            transform: scale(1);
+        }
+        </style>
+        """
+        
+        st.markdown(download_button_style, unsafe_allow_html=True)
+        
+        st.download_button(
+            label="📊 دانلود گزارش اکسل",
+            data=lambda: build_report_bytes(results, output_file),
+            file_name=output_file,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            key="download_report",
+            on_click="ignore",
+            help="دریافت گزارش کامل در قالب اکسل"
+        )
+        
+        st.download_button(
+            label="📦 دانلود بسته کامل گزارش (zip)",
+            data=lambda: build_bundle_bytes(results, output_file.replace('.xlsx', '.zip')),
+            file_name=output_file.replace('.xlsx', '.zip'),
+            mime="application/zip",
+            key="download_bundle",
+            on_click="ignore",
+            help="دریافت CSV فشرده (gzip) همه جدول‌ها و خلاصه اجرا در یک فایل zip؛ گزارش اکسل با دکمه بالا جداگانه دانلود می‌شود"
+        )
+        
+        # ایندکس صفحه «جستجوی کد» فقط به درخواست کاربر ساخته می‌شود تا هزینه‌اش به هر مغایرت‌گیری اضافه نشود
+        if st.button("🔎 ساخت ایندکس جستجوی کد برای این نتیجه", key="build_code_index",
+                     help="کدهای این اجرا در صفحه «جستجوی کد» قابل جستجو می‌شوند؛ ایندکس قبلی همین gateway جایگزین می‌شود"):
+            with st.spinner("در حال ساخت ایندکس کدها..."):
+                system.build_code_index(results, "code_index")
+            st.success("ایندکس ساخته شد؛ کدها در صفحه «جستجوی کد» قابل جستجو هستند.")
+    
+    st.markdown("""
+    <div class="tip-box rtl" style="margin-top: 25px;">
+        <b style="color: #2c3e50;">💡 نکته کاربردی:</b> 
+        <ul style="margin-top: 10px; padding-right: 25px;">
+            <li style="color: #7f8c8d;">گزارش شامل خلاصه، تطابق‌ها، عدم تطابق‌ها و فیلترهای Gateway است.</li>
+            <li style="color: #7f8c8d;">این گزارش را برای تحلیل‌های بعدی در اختیار تیم مالی قرار دهید.</li>
+        </ul>
+    </div>
+    """, unsafe_allow_html=True)
+    st.markdown('</div>', unsafe_allow_html=True)
 # تنظیم پیکربندی صفحه با لوگوی WALLEX
 st.set_page_config(
     page_title="سیستم مغایرت‌گیری هوشمند ",
@@ -679,10 +1181,28 @@ st.markdown('<div class="main-header animated"><h1>سیستم مغایرت‌گ
 # بارگذاری سیستم مغایرت‌گیری
 @st.cache_resource
 def load_system():
-    return SmartReconciliationSystem()
+    system = SmartReconciliationSystem()
+    # هر اجرا در تاریخچه محلی ثبت می‌شود (صفحه «تاریخچه» از همین انباره می‌خواند)
+    system.results_store = ReconciliationResultsStore()
+    # خروجی مراحل هر اجرا برای ادامه از آخرین مرحله در صورت خطا؛ نقاط بازیابی قدیمی‌تر از یک هفته پاک می‌شوند
+    system.checkpoint_directory = "checkpoints"
+    system.purge_checkpoints(max_age_days=7)
+    # اجرای دوباره با همان فایل‌ها و تنظیمات، نتیجه و گزارش ذخیره‌شده را فوراً برمی‌گرداند
+    system.result_cache = ResultCache("result_cache")
+    # بخش‌های بسته گزارش در نخ‌ها ساخته می‌شوند؛ fork کردن سرور چندنخی Streamlit برای هر دانلود امن نیست
+    system.report_executor = "thread"
+    return system
 
 system = load_system()
 
+with st.sidebar.expander("🛠️ مدیریت کش نتایج"):
+    cache_stats = system.result_cache.stats()
+    st.markdown(f"تعداد نتایج ذخیره‌شده: **{cache_stats['entries']}**")
+    st.markdown(f"حجم: **{cache_stats['bytes'] / 1024 ** 2:.1f}** از **{cache_stats['max_bytes'] / 1024 ** 2:.0f}** مگابایت")
+    if st.button("🗑️ پاک کردن کش نتایج", key="purge_result_cache"):
+        removed = system.result_cache.purge()
+        st.success(f"{removed} نتیجه از کش حذف شد.")
+
 # بخش بارگذاری فایل‌ها با رابط کاربری زیبا
 st.markdown('<div class="card animated"><h2 class="section-header rtl">بارگذاری فایل‌ها</h2>', unsafe_allow_html=True)
 
@@ -762,7 +1282,7 @@ with col2:
     </div>
     """, unsafe_allow_html=True)
     
-    provider_file = st.file_uploader("انتخاب فایل ارائه‌دهنده", type=["csv", "xlsx", "json"], key="provider_file")
+    provider_file = st.file_uploader("انتخاب فایل ارائه‌دهنده", type=["csv", "xlsx", "xls", "json", "ndjson", "jsonl", "gz", "bz2", "zst", "zip"], key="provider_file")
     
     if provider_file is None:
         st.markdown("""
@@ -780,7 +1300,9 @@ with col2:
             file_icon = '<i class="fas fa-table"></i>'
         elif file_ext in ['xlsx', 'xls']:
             file_icon = '<i class="fas fa-file-excel"></i>'
-        elif file_ext == 'json':
+        elif file_ext in ['gz', 'bz2', 'zst', 'zip']:
+            file_icon = '<i class="fas fa-file-archive"></i>'
+        elif file_ext in ['json', 'ndjson', 'jsonl']:
             file_icon = '<i class="fas fa-file-code"></i>'
             
         st.markdown(f"""
@@ -881,6 +1403,28 @@ with col1:
             st.error("⚠️ هشدار: آستانه بیشتر از 95٪ - ممکن است رکوردهای مشابه معتبر را نادیده بگیرد.")
         else:
             st.success("✅ آستانه مناسب - آستانه انتخاب شده در محدوده مناسب قرار دارد.")
+    
+    st.markdown('<p class="rtl" style="font-weight: bold; color: #2c3e50;">موتور پردازش:</p>', unsafe_allow_html=True)
+    engine_labels = {"pandas": "پانداس (در حافظه)", "duckdb": "DuckDB (استخراج و تطبیق روی دیسک)", "polars": "Polars (چندنخی)"}
+    # موتورهای duckdb و polars وابستگی اختیاری هستند و فقط در صورت نصب بودن نمایش داده می‌شوند
+    available_engines = [engine for engine in engine_labels
+                         if engine == "pandas" or importlib.util.find_spec(engine) is not None]
+    selected_engine = st.radio(
+        "موتور پردازش",
+        available_engines,
+        index=0,
+        horizontal=True,
+        key="engine",
+        format_func=lambda engine: engine_labels[engine],
+        label_visibility="collapsed",
+        help="در موتور DuckDB خواندن، استخراج کد و تطبیق روی دیسک انجام می‌شود ولی فایل ارائه‌دهنده برای نمایش و گزارش در پایان به حافظه آورده می‌شود."
+    )
+    system.profile_patterns = st.checkbox("⏱️ پروفایل هزینه و بازده الگوهای استخراج", key="profile_patterns")
+    system.prefilter_provider = st.checkbox(
+        "🧹 پیش‌فیلتر کدهای ارائه‌دهنده با کدهای پلتفرم (Bloom)",
+        key="prefilter_provider",
+        help="کدهایی از ارائه‌دهنده که قطعاً در پلتفرم نیستند ذخیره نمی‌شوند؛ تطابق‌ها تغییر نمی‌کنند ولی فهرست «فقط در فایل 2» خالی‌تر می‌شود."
+    )
 
 with col2:
     st.markdown('<p class="rtl" style="font-weight: bold; color: #2c3e50;">ستون‌های کلیدی پلتفرم:</p>', unsafe_allow_html=True)
@@ -971,7 +1515,8 @@ if start_button and platform_file is not None and provider_file is not None:
         import time
         unique_id = str(uuid.uuid4())[:8]
         temp_platform_file = f"temp_platform_{unique_id}{os.path.splitext(platform_file.name)[1]}"
-        temp_provider_file = f"temp_provider_{unique_id}{os.path.splitext(provider_file.name)[1]}"
+        # نام کامل فایل حفظ می‌شود تا پسوندهای ترکیبی مثل .csv.gz شناسایی شوند
+        temp_provider_file = f"temp_provider_{unique_id}_{os.path.basename(provider_file.name)}"
         
         with open(temp_platform_file, "wb") as f:
             f.write(platform_file.getbuffer())
@@ -980,7 +1525,14 @@ if start_button and platform_file is not None and provider_file is not None:
         
         try:
             time.sleep(0.7)  # تأخیر برای نمایش لودر
-            results = system.gateway_specific_reconciliation(temp_platform_file, temp_provider_file, selected_gateway)
+            results = system.gateway_specific_reconciliation(temp_platform_file, temp_provider_file, selected_gateway, engine=selected_engine)
+            
+            # نتایج در Session State نگه داشته می‌شوند تا صفحه‌بندی و دانلود نیازی به اجرای دوباره نداشته باشند
+            st.session_state.results = results
+            st.session_state.results_gateway = selected_gateway
+            st.session_state.run_id = unique_id
+            for key in [key for key in st.session_state if str(key).startswith("grid_")]:
+                del st.session_state[key]
             
             if results is None:
                 st.markdown("""
@@ -994,328 +1546,16 @@ if start_button and platform_file is not None and provider_file is not None:
                     </ul>
                 </div>
                 """.format(gateway=selected_gateway), unsafe_allow_html=True)
-            else:
-                # پیام موفقیت با افکت کنفتی
-                st.markdown("""
-                <div class="success-message">
-                    <div class="success-icon">✓</div>
-                    <h3 style="color: #27ae60; margin-bottom: 15px; font-size: 1.5rem;">عملیات با موفقیت انجام شد</h3>
-                    <p style="color: #2c3e50; margin: 0; font-size: 1.1rem;">نتایج تحلیل آماده نمایش است</p>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                st.markdown('<div class="card animated"><h2 class="section-header rtl">نتایج تحلیل مغایرت‌گیری</h2>', unsafe_allow_html=True)
-                
-                st.markdown("""
-                <div class="success rtl">
-                    <h4>✅ عملیات کامل شد</h4>
-                    <p>داده‌ها با دقت بالا مقایسه شدند. نتایج را بررسی کنید.</p>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                col1, col2, col3 = st.columns(3)
-                
-                if 'matches' in results and 'non_matches' in results:
-                    total_matches = len(results['matches'])
-                    total_non_matches = len(results['non_matches'])
-                    match_percent = round(total_matches / (total_matches + total_non_matches) * 100, 2) if (total_matches + total_non_matches) > 0 else 0
-                    
-                    if match_percent >= 90:
-                        match_color = "#27ae60"
-                    elif match_percent >= 70:
-                        match_color = "#f1c40f"
-                    else:
-                        match_color = "#e74c3c"
-                
-                with col1:
-                    if 'platform_codes' in results:
-                        st.markdown(f"""
-                        <div class="metric-card animated">
-                            <div class="metric-value">{len(results['platform_codes'])}</div>
-                            <div class="metric-label">کدهای پلتفرم</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                
-                with col2:
-                    if 'filtered_platform' in results:
-                        st.markdown(f"""
-                        <div class="metric-card animated">
-                            <div class="metric-value">{len(results['filtered_platform'])}</div>
-                            <div class="metric-label">رکوردهای {selected_gateway}</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                
-                with col3:
-                    if 'matches' in results and 'non_matches' in results:
-                        st.markdown(f"""
-                        <div class="metric-card animated" style="border-right: 6px solid {match_color};">
-                            <div class="metric-value" style="color: {match_color} !important;">{match_percent}%</div>
-                            <div class="metric-label">تطابق</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                
-                if 'matches' in results and 'non_matches' in results:
-                    st.markdown(f"""
-<div style="margin-top: 25px; margin-bottom: 30px;">
-    <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
-        <div style="color: #2c3e50;">0%</div>
-        <div style="color: #2c3e50;">50%</div>
-        <div style="color: #2c3e50;">100%</div>
-    </div>
-    <div style="width: 100%; height: 15px; background: rgba(255, 255, 255, 0.5); border-radius: 15px; overflow: hidden; box-shadow: 0 2px 8px rgba(0, 0, 0, 0.1);">
-        <div style="width: {match_percent}%; height: 100%; background: linear-gradient(90deg, {match_color}, {match_color}); border-radius: 15px; animation: slide 2s infinite ease-in-out;"></div>
-    </div>
-    <div style="text-align: center; margin-top: 10px; font-weight: bold; color: {match_color} !important; font-size: 1.1rem;">
-        {match_percent}% تطابق ({total_matches} از {total_matches + total_non_matches})
-    </div>
-</div>
-<style>
-    @keyframes slide {{
-        0% {{ transform: translateX(0); }}
-        50% {{ transform: translateX(20px); }}
-        100% {{ transform: translateX(0); }}
-    }}
-</style>
-""", unsafe_allow_html=True)
-                
-                st.markdown('<h3 class="section-header rtl">نمودارهای تحلیلی</h3>', unsafe_allow_html=True)
-                
-                if 'matches' in results and 'non_matches' in results:
-                    match_count = len(results['matches'])
-                    non_match_count = len(results['non_matches'])
-                    
-                    col1, col2 = st.columns([1, 1])
-                    
-                    with col1:
-                        fig = px.pie(
-                            names=["تطابق‌ها", "عدم تطابق‌ها"],
-                            values=[match_count, non_match_count],
-                            color_discrete_sequence=["#27ae60", "#e74c3c"],
-                            hole=0.5,
-                            title=f"تحلیل تطابق برای {selected_gateway}"
-                        )
-                        fig.update_traces(
-                            textposition='inside',
-                            textinfo='percent+label',
-                            marker=dict(line=dict(color='white', width=3)),
-                            pull=[0.1, 0]
-                        )
-                        fig.update_layout(
-                            font=dict(family='Vazir', size=16, color="#2c3e50"),
-                            legend=dict(orientation="h", y=-0.1, x=0.5, font=dict(color="#2c3e50")),
-                            margin=dict(t=60, b=60, l=20, r=20),
-                            paper_bgcolor='rgba(255, 255, 255, 0.9)',
-                            plot_bgcolor='rgba(255, 255, 255, 0.9)',
-                            title_font=dict(color="#2c3e50", size=18)
-                        )
-                        st.plotly_chart(fig, use_container_width=True)
-                    
-                    with col2:
-                        bar_fig = px.bar(
-                            x=["تطابق‌ها", "عدم تطابق‌ها"],
-                            y=[match_count, non_match_count],
-                            color=["تطابق‌ها", "عدم تطابق‌ها"],
-                            color_discrete_map={"تطابق‌ها": "#27ae60", "عدم تطابق‌ها": "#e74c3c"},
-                            title="مقایسه آماری"
-                        )
-                        bar_fig.update_layout(
-                            font=dict(family='Vazir', size=16, color="#2c3e50"),
-                            showlegend=False,
-                            margin=dict(t=60, b=40, l=40, r=20),
-                            paper_bgcolor='rgba(255, 255, 255, 0.9)',
-                            plot_bgcolor='rgba(255, 255, 255, 0.9)',
-                            title_font=dict(color="#2c3e50", size=18),
-                            yaxis=dict(tickfont=dict(color="#2c3e50")),
-                            xaxis=dict(tickfont=dict(color="#2c3e50"))
-                        )
-                        st.plotly_chart(bar_fig, use_container_width=True)
-                
-                st.markdown('<h3 class="section-header rtl">جداول تعاملی</h3>', unsafe_allow_html=True)
-                
-                tab_icons = {
-                    "رکوردهای": '<i class="fas fa-search"></i>',
-                    "کدهای استخراج شده": '<i class="fas fa-key"></i>',
-                    "تطابق‌ها": '<i class="fas fa-check-circle"></i>',
-                    "عدم تطابق‌ها": '<i class="fas fa-times-circle"></i>'
-                }
-                
-                tab_titles = []
-                tab_dataframes = []
-                
-                if 'filtered_platform' in results:
-                    tab_titles.append(f"{tab_icons['رکوردهای']} رکوردهای {selected_gateway}")
-                    tab_dataframes.append(results['filtered_platform'])
-                
-                if 'platform_codes' in results:
-                    tab_titles.append(f"{tab_icons['کدهای استخراج شده']} کدهای استخراج شده")
-                    tab_dataframes.append(results['platform_codes'])
-                
-                if 'matches' in results:
-                    tab_titles.append(f"{tab_icons['تطابق‌ها']} تطابق‌ها")
-                    tab_dataframes.append(results['matches'])
-                
-                if 'non_matches' in results:
-                    tab_titles.append(f"{tab_icons['عدم تطابق‌ها']} عدم تطابق‌ها")
-                    tab_dataframes.append(results['non_matches'])
-                
-                st.markdown("""
-                <style>
-                .dataframe-container {
-                    border-radius: 20px;
-                    box-shadow: 0 8px 25px rgba(0, 0, 0, 0.1);
-                    padding: 15px;
-                    background: rgba(255, 255, 255, 0.9);
-                    margin-top: 15px;
-                    backdrop-filter: blur(5px);
-                }
-                .dataframe-header {
-                    display: flex;
-                    justify-content: space-between;
-                    align-items: center;
-                    padding: 15px;
-                    border-bottom: 2px solid #e9ecef;
-                    margin-bottom: 15px;
-                    background: linear-gradient(90deg, #3498db, #2c3e50);
-                    border-radius: 15px 15px 0 0;
-                }
-                .dataframe-title {
-                    font-weight: bold;
-                    color: white;
-                }
-                .dataframe-count {
-                    background: rgba(255, 255, 255, 0.8);
-                    color: #2c3e50 !important;
-                    border-radius: 25px;
-                    padding: 5px 15px;
-                    font-weight: bold;
-                }
-                </style>
-                """, unsafe_allow_html=True)
-                
-                tabs = st.tabs(tab_titles)
-                
-                for i, tab in enumerate(tabs):
-                    with tab:
-                        tab_name = tab_titles[i].replace('<i class="fas fa-', '').replace('"></i>', '').split(" ", 1)[1]
-                        st.markdown(f"""
-                        <div class="dataframe-header rtl">
-                            <div class="dataframe-title">{tab_name}</div>
-                            <div class="dataframe-count">{len(tab_dataframes[i])} رکورد</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        # اصلاح دیتافریم برای نمایش در Streamlit
-                        fixed_df = fix_dataframe_for_streamlit(tab_dataframes[i])
-                        
-                        st.dataframe(
-                            fixed_df,
-                            use_container_width=True,
-                            height=450,
-                            column_config={
-                                "_index": st.column_config.Column(
-                                    label="ردیف",
-                                    width="small"
-                                )
-                            }
-                        )
-                        
-                        # استفاده از دیتافریم اصلاح شده برای CSV
-                        csv = fixed_df.to_csv(index=False).encode('utf-8')
-                        st.download_button(
-                            label=f"دانلود {tab_name}",
-                            data=csv,
-                            file_name=f"{tab_name.replace(' ', '_')}.csv",
-                            mime='text/csv',
-                            key=f"download_{i}",
-                            help=f"دریافت داده‌های {tab_name} در قالب CSV"
-                        )
-
-                
-                st.markdown('<h3 class="section-header rtl">گزارش نهایی</h3>', unsafe_allow_html=True)
-                
-                st.markdown("""
-                <div class="card" style="text-align: center; padding: 40px; background: rgba(255, 255, 255, 0.9);">
-                    <h4 style="margin-bottom: 25px; color: #2c3e50; font-size: 1.5rem;">گزارش تحلیلی مغایرت‌گیری</h4>
-                    <p style="color: #7f8c8d; font-size: 1.1rem;">گزارش کامل را با دکمه زیر دانلود کنید.</p>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                output_file = f"reconciliation_report_{selected_gateway}.xlsx"
-                system.generate_report(results, output_file)
-                
-                col1, col2, col3 = st.columns([1, 2, 1])
-                with col2:
-                    with open(output_file, "rb") as f:
-                        file_bytes = f.read()
-                        b64 = base64.b64encode(file_bytes).decode()
-                        
-                        download_button_style = """
-                        <style>
-                        .download-excel-button {
-                            background: linear-gradient(90deg, #e74c3c, #f1c40f);
-                            color: white !important;
-                            padding: 16px 32px;
-                            border-radius: 30px;
-                            font-weight: bold;
-                            font-size: 1.2rem;
-                            box-shadow: 0 8px 25px rgba(241, 196, 15, 0.4);
-                            transition: all 0.4s ease;
-                            display: inline-block;
-                            position: relative;
-                            overflow: hidden;
-                        }
-                        .download-excel-button:hover {
-                            transform: scale(1.07);
-                            box-shadow: 0 10px 30px rgba(241, 196, 15, 0.5);
-                        }
-                        .download-excel-button::after {
-                            content: '';
-                            position: absolute;
-                            top: 0;
-                            left: 0;
-                            width: 100%;
-                            height: 100%;
-                            background: rgba(255, 255, 255, 0.3);
-                            border-radius: 30px;
-                            transform: scale(0);
-                            transition: transform 0.4s ease;
-                        }
-                        .download-excel-button:hover::after {
-                            transform: scale(1);
-                        }
-                        </style>
-                        """
-                        
-                        st.markdown(download_button_style, unsafe_allow_html=True)
-                        
-                        st.download_button(
-                            label="📊 دانلود گزارش اکسل",
-                            data=file_bytes,
-                            file_name=output_file,
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            key="download_report",
-                            help="دریافت گزارش کامل در قالب اکسل"
-                        )
-                
-                st.markdown("""
-                <div class="tip-box rtl" style="margin-top: 25px;">
-                    <b style="color: #2c3e50;">💡 نکته کاربردی:</b> 
-                    <ul style="margin-top: 10px; padding-right: 25px;">
-                        <li style="color: #7f8c8d;">گزارش شامل خلاصه، تطابق‌ها، عدم تطابق‌ها و فیلترهای Gateway است.</li>
-                        <li style="color: #7f8c8d;">این گزارش را برای تحلیل‌های بعدی در اختیار تیم مالی قرار دهید.</li>
-                    </ul>
-                </div>
-                """, unsafe_allow_html=True)
             
             try:
                 os.remove(temp_platform_file)
                 os.remove(temp_provider_file)
-                os.remove(output_file)
             except Exception as cleanup_error:
                 print(f"خطا در پاک کردن فایل‌ها: {str(cleanup_error)}")
                 pass
                 
         except Exception as e:
+            st.session_state.results = None
             st.markdown(f"""
             <div class="error rtl">
                 <h4>❌ خطای غیرمنتظره!</h4>
@@ -1336,8 +1576,9 @@ if start_button and platform_file is not None and provider_file is not None:
             except Exception as cleanup_error:
                 print(f"خطا در پاک کردن فایل‌ها پس از خطا: {str(cleanup_error)}")
                 pass
-                
-        st.markdown('</div>', unsafe_allow_html=True)
+
+if st.session_state.get('results') is not None:
+    render_results(st.session_state.results, st.session_state.results_gateway)
 
 # راهنمای استفاده با طراحی حرفه‌ای
 with st.expander("📖 راهنمای کاربری سیستم"):
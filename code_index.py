@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import mmap
+import shutil
+import logging
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# هر ورودی ایندکس: شماره ردیف ذخیره‌شده، شماره ردیف فایل منبع، ستون، الگو و سمت (پلتفرم/ارائه‌دهنده)
+_ENTRY_DTYPE = np.dtype([('row_ref', 'i8'), ('row_index', 'i8'), ('column', 'i2'), ('pattern', 'i2'), ('side', 'i1')])
+
+
+class CodeIndex:
+    # ایندکس فقط‌خواندنی کدهای رهگیری روی دیسک: آرایه مرتب کدها (bytes با طول ثابت) و ورودی‌های هم‌ترتیب آن
+    # با np.load(mmap_mode='r') باز می‌شوند و جستجوی دقیق یا پیشوندی با np.searchsorted انجام می‌شود؛
+    # داده ردیف‌ها به‌صورت JSON خط‌به‌خط با آرایه offset ذخیره می‌شود تا فقط ردیف‌های پاسخ خوانده شوند
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.codes = self._load('codes.npy')
+        self.entries = self._load('entries.npy')
+        self.row_offsets = self._load('row_offsets.npy')
+        self._rows_file = open(os.path.join(directory, 'rows.jsonl'), 'rb')
+        self._rows = mmap.mmap(self._rows_file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if self.row_offsets[-1] > 0 else b''
+
+    def _load(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            return np.load(path, mmap_mode='r')
+        except ValueError:
+            # آرایه خالی قابل mmap نیست
+            return np.load(path)
+
+    def close(self):
+        if isinstance(self._rows, mmap.mmap):
+            self._rows.close()
+        self._rows_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def build(cls, directory, tables, gateway_name=None):
+        # tables فهرستی از (سمت، جدول کد خروجی extract_codes_from_platform/provider، دیتافریم منبع) است
+        sides, columns, patterns = [], [], []
+        code_parts, entry_parts, row_texts = [], [], []
+        row_count = 0
+        for side, codes, source_df in tables:
+            if codes is None or codes.empty:
+                continue
+            side_id = len(sides)
+            sides.append(side)
+            column_names = codes['column'].astype(str).to_numpy()
+            pattern_names = codes['pattern'].astype(str).to_numpy()
+            column_ids = cls._intern(columns, column_names)
+            pattern_ids = cls._intern(patterns, pattern_names)
+
+            row_index = codes['row_index'].to_numpy().astype(np.int64)
+            stored_rows, row_refs = np.unique(row_index, return_inverse=True)
+            if source_df is not None:
+                rows = source_df.reindex(stored_rows)
+                text = rows.to_json(orient='records', lines=True, force_ascii=False, date_format='iso')
+                row_texts.extend(text.rstrip('\n').split('\n'))
+            else:
+                row_texts.extend(['{}'] * len(stored_rows))
+
+            entries = np.empty(len(codes), dtype=_ENTRY_DTYPE)
+            entries['row_ref'] = row_refs + row_count
+            entries['row_index'] = row_index
+            entries['column'] = column_ids
+            entries['pattern'] = pattern_ids
+            entries['side'] = side_id
+            code_parts.append(np.array([str(code).encode('utf-8') for code in codes['code']], dtype=object))
+            entry_parts.append(entries)
+            row_count += len(stored_rows)
+
+        if code_parts:
+            all_codes = np.concatenate(code_parts)
+            width = max(1, max(len(code) for code in all_codes))
+            all_codes = all_codes.astype(f'S{width}')
+            all_entries = np.concatenate(entry_parts)
+            order = np.argsort(all_codes, kind='stable')
+            all_codes, all_entries = all_codes[order], all_entries[order]
+        else:
+            all_codes, all_entries = np.array([], dtype='S1'), np.empty(0, dtype=_ENTRY_DTYPE)
+
+        encoded_rows = [line.encode('utf-8') + b'\n' for line in row_texts]
+        row_offsets = np.zeros(len(encoded_rows) + 1, dtype=np.int64)
+        np.cumsum([len(line) for line in encoded_rows], out=row_offsets[1:])
+
+        # ایندکس در پوشه موقت ساخته و سپس جایگزین نسخه قبلی می‌شود تا خواننده‌ها نسخه نیمه‌کاره نبینند
+        staging = f"{directory.rstrip(os.sep)}.building"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        np.save(os.path.join(staging, 'codes.npy'), all_codes)
+        np.save(os.path.join(staging, 'entries.npy'), all_entries)
+        np.save(os.path.join(staging, 'row_offsets.npy'), row_offsets)
+        with open(os.path.join(staging, 'rows.jsonl'), 'wb') as f:
+            f.writelines(encoded_rows)
+        with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'gateway_name': gateway_name, 'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                       'sides': sides, 'columns': columns, 'patterns': patterns, 'codes': len(all_codes),
+                       'rows': row_count}, f, ensure_ascii=False)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(staging, directory)
+        logging.info(f"Built code index with {len(all_codes)} codes and {row_count} rows at {directory}")
+        return cls(directory)
+
+    @classmethod
+    def build_from_results(cls, results, directory):
+        return cls.build(directory, [
+            ('platform', results.get('platform_codes'), results.get('platform')),
+            ('provider', results.get('provider_codes'), results.get('provider')),
+        ], gateway_name=results.get('gateway_name'))
+
+    @staticmethod
+    def _intern(names, values):
+        labels, ids = np.unique(values, return_inverse=True)
+        mapping = []
+        for label in labels:
+            if label not in names:
+                names.append(label)
+            mapping.append(names.index(label))
+        return np.asarray(mapping, dtype=np.int16)[ids]
+
+    def _range(self, code, prefix=False):
+        key = code.encode('utf-8')
+        width = self.codes.dtype.itemsize
+        if not len(self.codes) or len(key) > width:
+            return 0, 0
+        start = int(np.searchsorted(self.codes, key, side='left'))
+        if not prefix:
+            return start, int(np.searchsorted(self.codes, key, side='right'))
+        # هیچ بایت UTF-8 برابر 0xff نیست، پس همه کدهای با این پیشوند کوچک‌تر از key + 0xff هستند
+        upper = key + b'\xff'
+        if len(upper) > width:
+            return start, int(np.searchsorted(self.codes, key, side='right'))
+        return start, int(np.searchsorted(self.codes, upper, side='left'))
+
+    def _row(self, row_ref):
+        return json.loads(self._rows[self.row_offsets[row_ref]:self.row_offsets[row_ref + 1]])
+
+    def _records(self, start, stop, with_rows=True):
+        records = []
+        for position in range(start, stop):
+            entry = self.entries[position]
+            record = {
+                'code': self.codes[position].decode('utf-8'),
+                'side': self.meta['sides'][entry['side']],
+                'column': self.meta['columns'][entry['column']],
+                'pattern': self.meta['patterns'][entry['pattern']],
+                'row_index': int(entry['row_index']),
+            }
+            if with_rows:
+                record['row'] = self._row(int(entry['row_ref']))
+            records.append(record)
+        return records
+
+    def lookup(self, code, with_rows=True):
+        start, stop = self._range(code)
+        return self._records(start, stop, with_rows=with_rows)
+
+    def prefix_lookup(self, prefix, limit=50, with_rows=True):
+        start, stop = self._range(prefix, prefix=True)
+        return self._records(start, min(stop, start + limit), with_rows=with_rows)
+
+    def to_frame(self, records):
+        if not records:
+            return pd.DataFrame(columns=['code', 'side', 'column', 'pattern', 'row_index'])
+        frame = pd.DataFrame([{key: value for key, value in record.items() if key != 'row'} for record in records])
+        if 'row' in records[0]:
+            frame['row'] = [json.dumps(record['row'], ensure_ascii=False) for record in records]
+        return frame
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ساخت و جستجوی ایندکس کدهای رهگیری")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help="مغایرت‌گیری یک جفت فایل و ساخت ایندکس از کدهای آن")
+    build_parser.add_argument('platform')
+    build_parser.add_argument('provider')
+    build_parser.add_argument('gateway')
+    build_parser.add_argument('directory')
+
+    lookup_parser = commands.add_parser('lookup', help="جستجوی دقیق یا پیشوندی یک کد")
+    lookup_parser.add_argument('directory')
+    lookup_parser.add_argument('code')
+    lookup_parser.add_argument('--prefix', action='store_true')
+    lookup_parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        from smart_reconciliation_system import SmartReconciliationSystem
+        results = SmartReconciliationSystem().gateway_specific_reconciliation(args.platform, args.provider, args.gateway)
+        if results is None:
+            print(f"No records with gateway '{args.gateway}' found.", file=sys.stderr)
+            return 1
+        CodeIndex.build_from_results(results, args.directory).close()
+        return 0
+
+    with CodeIndex(args.directory) as index:
+        if args.prefix:
+            records = index.prefix_lookup(args.code, limit=args.limit)
+        else:
+            records = index.lookup(args.code)
+    for record in records:
+        print(json.dumps(record, ensure_ascii=False))
+    return 0 if records else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
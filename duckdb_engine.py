@@ -0,0 +1,363 @@
+import os
+import re
+import tempfile
+import logging
+
+import numpy as np
+import pandas as pd
+
+from smart_reconciliation_system import RowSelection
+
+
+# کاراکترهای کلمه در re پایتون (یونیکد)؛ \b، \w و \d در RE2 (موتور regex در DuckDB) فقط ASCII هستند
+_WORD_CHARS = r'\p{L}\p{N}_'
+# کاراکترهایی که str.strip پایتون حذف می‌کند
+_SPACE_CHARS = r'\t-\r\x{1c}-\x{1f}\x{85}\p{Z}'
+# برگ‌های JSON که مثل _json_leaves کد حساب می‌شوند (نه شیء و آرایه، نه null و boolean)
+_JSON_LEAF = "j.type NOT IN ('OBJECT', 'ARRAY', 'NULL', 'BOOLEAN')"
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _strip_sql(expr):
+    return f"regexp_replace({expr}, '^[{_SPACE_CHARS}]+|[{_SPACE_CHARS}]+$', '', 'g')"
+
+
+def _json_path(path):
+    # مسیر نقطه‌دار پروفایل (مثل 'payment.ref') به مسیر JSON در DuckDB
+    return '$' + ''.join(f'."{key}"' for key in path.split('.'))
+
+
+def _re2_pattern(pattern):
+    # ترجمه الگوی re پایتون به RE2 با همان معنای یونیکد: \d و \w به کلاس‌های یونیکد تبدیل می‌شوند و \b ابتدا و
+    # انتهای الگو جدا برگردانده می‌شود (RE2 lookaround ندارد). برای الگوهایی مثل کد عمومی که ابتدا و انتهایشان
+    # کاراکتر کلمه است نتیجه با pandas یکی است؛ \b وسط الگو همان معنای ASCII را دارد
+    body, in_class = [], False
+    leading = pattern.startswith(r'\b')
+    trailing = pattern.endswith(r'\b') and not pattern.endswith(r'\\b') and len(pattern) > 2
+    end = len(pattern) - (2 if trailing else 0)
+    i = 2 if leading else 0
+    while i < end:
+        char = pattern[i]
+        if char == '\\' and i + 1 < end:
+            escaped = pattern[i + 1]
+            if escaped == 'd':
+                body.append(r'\p{Nd}')
+            elif escaped == 'w':
+                body.append(_WORD_CHARS if in_class else f'[{_WORD_CHARS}]')
+            else:
+                body.append(char + escaped)
+            i += 2
+            continue
+        if char == '[' and not in_class:
+            in_class = True
+        elif char == ']' and in_class and pattern[i - 1] != '[':
+            in_class = False
+        body.append(char)
+        i += 1
+    return ''.join(body), leading, trailing
+
+
+class DuckDBReconciliationEngine:
+    # همان خط لوله مغایرت‌گیری به‌صورت SQL روی فایل‌های دیسک؛ جدول‌ها در یک پایگاه DuckDB موقت
+    # روی دیسک ساخته می‌شوند و با رسیدن به memory_limit به temp_directory سرریز می‌کنند.
+    # محدودیت: فقط خواندن، استخراج کد و تطبیق خارج از حافظه است؛ خروجی مثل موتورهای دیگر دیتافریم pandas است،
+    # پس ردیف‌های همین gateway از پلتفرم و کل فایل ارائه‌دهنده (برای بررسی جفت‌ها، گزارش و نمایش) در پایان
+    # به حافظه آورده می‌شوند و فایل ارائه‌دهنده باید در حافظه جا شود
+    def __init__(self, system, memory_limit=None, temp_directory=None):
+        self.system = system
+        self.memory_limit = memory_limit or system.duckdb_memory_limit
+        self.temp_directory = temp_directory or system.duckdb_temp_directory
+        self.con = None
+
+    def _source_sql(self, file_path, gateway_name=None):
+        file_type = self.system.detect_file_type(file_path)
+        compression = self.system.detect_compression(file_path)
+        if compression not in (None, 'gzip', 'zstd'):
+            raise ValueError(f"DuckDB engine cannot read {compression} files, use engine='pandas'")
+        if file_type == '.csv':
+            return "read_csv(?, all_varchar=true, header=true)", [file_path]
+        if file_type in ['.ndjson', '.jsonl']:
+            return "read_json_auto(?, format='newline_delimited')", [file_path]
+        if file_type == '.json':
+            return "read_json_auto(?)", [file_path]
+        if file_type == '.xlsx' and compression is None:
+            self.con.execute("INSTALL excel")
+            self.con.execute("LOAD excel")
+            sheet_name = self.system._excel_options(gateway_name)['sheet_name']
+            if isinstance(sheet_name, str):
+                return "read_xlsx(?, sheet=?, all_varchar=true)", [file_path, sheet_name]
+            return "read_xlsx(?, all_varchar=true)", [file_path]
+        raise ValueError(f"DuckDB engine does not support {file_path}, use engine='pandas'")
+
+    def _load_table(self, table, file_path, nrows=None, columns=None, gateway_name=None):
+        source, params = self._source_sql(file_path, gateway_name)
+        available = [row[0] for row in self.con.execute(f"DESCRIBE SELECT * FROM {source}", params).fetchall()]
+        selected = [col for col in available if columns is None or col in columns]
+        limit = f" LIMIT {int(nrows)}" if nrows else ""
+        self.con.execute(
+            f"CREATE TABLE {table} AS SELECT {', '.join(_quote(col) for col in selected)} FROM {source}{limit}",
+            params
+        )
+        return selected
+
+    def _found_sql(self, pattern, normalize):
+        # عبارت SQL فهرست کدهای یک الگو در ستون {column} و پارامترهای آن
+        body, leading, trailing = _re2_pattern(pattern)
+        if not leading and not trailing:
+            found, params = "regexp_extract_all({column}, ?)", [body]
+        else:
+            # مرز ابتدا با مصرف یک کاراکتر غیرکلمه (یا ابتدای متن) و مرز انتها با گرفتن کاراکتر بعدی در یک گروه
+            # بررسی می‌شود؛ تطابق‌هایی که بعدشان کاراکتر کلمه آمده کنار گذاشته می‌شوند
+            regex = (f"(?:^|[^{_WORD_CHARS}])" if leading else '') + f"({body})"
+            if trailing:
+                # شماره گروه کاراکتر بعدی بعد از گروه کل الگو و گروه‌های خود الگو است
+                regex += f"([{_WORD_CHARS}]?)"
+                found = (f"[match[1] FOR match IN list_zip(regexp_extract_all({{column}}, ?, 1), "
+                         f"regexp_extract_all({{column}}, ?, {re.compile(pattern).groups + 2})) IF match[2] = '']")
+                params = [regex, regex]
+            else:
+                found, params = "regexp_extract_all({column}, ?, 1)", [regex]
+        if normalize:
+            found = f"list_transform({found}, code -> {normalize}(code))"
+        return found, params
+
+    def _full_match_sql(self, pattern):
+        # معادل fullmatch پایتون روی {value}؛ \b ابتدا و انتها یعنی اولین و آخرین کاراکتر، کاراکتر کلمه باشد
+        body, leading, trailing = _re2_pattern(pattern)
+        condition, params = "regexp_full_match({value}, ?)", [body]
+        if leading:
+            condition += " AND regexp_matches({value}, ?)"
+            params.append(f"^[{_WORD_CHARS}]")
+        if trailing:
+            condition += " AND regexp_matches({value}, ?)"
+            params.append(f"[{_WORD_CHARS}]$")
+        return condition, params
+
+    def _structural_select(self, rows, column_id, label_id, normalize):
+        # rows ستون‌های row_index، pos، code و occurrence را می‌دهد؛ مقدارهای خالی مثل مسیر pandas حذف می‌شوند
+        code = f"{normalize}(code)" if normalize else "code"
+        return (f"SELECT row_index, pos, {column_id} AS column_id, {label_id} AS pattern_id, {code} AS code, "
+                f"occurrence FROM ({rows}) WHERE code <> ''")
+
+    def _structural_codes(self, source, col, column_id, spec, extractors, table):
+        # همان _structural_codes مسیر pandas به‌صورت SQL؛ خروجی: selectهای کدهای ساختاری، پارامترهایشان و
+        # منبع متنی (row_index، pos، text) که هنوز باید از regex بگذرد (None یعنی چیزی باقی نمانده)
+        value = f"CAST({_quote(col)} AS VARCHAR)"
+        labels, normalize = extractors['labels'], extractors['normalize']
+        if spec['type'] == 'clean':
+            # فقط سلولی که تماماً با یکی از الگوهای gateway جور است خود کد حساب می‌شود
+            conditions, params = [], []
+            for pattern in extractors['patterns']:
+                condition, condition_params = self._full_match_sql(pattern)
+                conditions.append(f"({condition.format(value='code')})")
+                params += condition_params
+            self.con.execute(
+                f"CREATE TABLE {table} AS SELECT row_index, pos, text, code, "
+                f"coalesce({' OR '.join(conditions) or 'false'}, false) AS clean "
+                f"FROM (SELECT row_index, pos, {value} AS text, {_strip_sql(value)} AS code FROM {source})",
+                params
+            )
+            rows = f"SELECT row_index, pos, code, 1 AS occurrence FROM {table} WHERE clean"
+            return ([self._structural_select(rows, column_id, labels.index('clean'), normalize)], [],
+                    f"(SELECT row_index, pos, text FROM {table} WHERE NOT clean)")
+
+        if spec['type'] == 'split':
+            parts = f"SELECT row_index, pos, string_split({value}, ?) AS parts FROM {source}"
+            if spec.get('parts') is not None:
+                # ترتیب وقوع شماره بخش است، پس بخش‌ها به ترتیب شماره انتخاب می‌شوند
+                selected = [f"list_extract(parts, {int(part) + 1})" if int(part) >= 0 else "NULL"
+                            for part in sorted(spec['parts'])]
+                if not selected:
+                    return [], [], None
+                parts = f"SELECT row_index, pos, list_value({', '.join(selected)}) AS parts FROM ({parts})"
+            rows = (f"SELECT row_index, pos, {_strip_sql('part')} AS code, occurrence "
+                    f"FROM (SELECT row_index, pos, unnest(parts) AS part, generate_subscripts(parts, 1) AS occurrence "
+                    f"FROM ({parts}))")
+            label_id = labels.index(self.system._extractor_labels(spec)[0])
+            return [self._structural_select(rows, column_id, label_id, normalize)], [spec.get('delimiter', '|')], None
+
+        # json: فقط سلول‌هایی که با { یا [ شروع می‌شوند و JSON معتبرند در doc می‌آیند؛ بقیه از regex می‌گذرند
+        self.con.execute(
+            f"CREATE TABLE {table} AS SELECT row_index, pos, {value} AS text, "
+            f"CASE WHEN regexp_matches({value}, ?) AND json_valid({value}) THEN {value} END AS doc FROM {source}",
+            [f"^[{_SPACE_CHARS}]*[\\[{{]"]
+        )
+        paths = spec.get('paths')
+        if not paths:
+            # بدون مسیر مشخص مقدارهای برگ با فاصله کنار هم گذاشته می‌شوند و به جای متن سلول از regex می‌گذرند
+            leaves = (f"SELECT d.pos, string_agg(json_extract_string(j.value, '$'), ' ' ORDER BY j.id) AS text "
+                      f"FROM {table} d, json_tree(d.doc) j WHERE {_JSON_LEAF} GROUP BY d.pos")
+            return [], [], (f"(SELECT t.row_index, t.pos, CASE WHEN t.doc IS NULL THEN t.text ELSE l.text END AS text "
+                            f"FROM {table} t LEFT JOIN ({leaves}) l ON l.pos = t.pos)")
+        selects, params = [], []
+        leaf = _strip_sql("json_extract_string(j.value, '$')")
+        for label, path in zip(self.system._extractor_labels(spec), paths):
+            rows = (f"SELECT d.row_index, d.pos, {leaf} AS code, "
+                    f"j.id AS occurrence FROM {table} d, json_tree(d.doc, ?) j WHERE {_JSON_LEAF}")
+            selects.append(self._structural_select(rows, column_id, labels.index(label), normalize))
+            params.append(_json_path(path))
+        return selects, params, f"(SELECT row_index, pos, text FROM {table} WHERE doc IS NULL)"
+
+    def _extract_codes(self, source, code_table, columns, extractors, structural=None):
+        # pos موقعیت ردیف در داده ورودی است تا ترتیب حذف کدهای تکراری مثل مسیر pandas باشد
+        # (تکه‌به‌تکه، سپس ستون، الگو و ردیف)
+        selects, params = [], []
+        for column_id, col in enumerate(columns):
+            text_source = f"(SELECT row_index, pos, CAST({_quote(col)} AS VARCHAR) AS text FROM {source})"
+            if col in (structural or {}):
+                # کدهای ساختاری مستقیم برداشته می‌شوند و فقط متن باقی‌مانده از regex می‌گذرد
+                structured, structured_params, text_source = self._structural_codes(
+                    source, col, column_id, structural[col], extractors, f"{code_table}_{column_id}")
+                selects += structured
+                params += structured_params
+                if text_source is None:
+                    continue
+            for pattern_id, pattern in enumerate(extractors['patterns']):
+                found, pattern_params = self._found_sql(pattern, extractors['normalize'])
+                found = found.format(column='text')
+                selects.append(
+                    f"SELECT row_index, pos, {column_id} AS column_id, {pattern_id} AS pattern_id, "
+                    f"unnest(found) AS code, generate_subscripts(found, 1) AS occurrence "
+                    f"FROM (SELECT row_index, pos, {found} AS found "
+                    f"FROM {text_source})"
+                )
+                params += pattern_params
+
+        if not selects:
+            self.con.execute(f"CREATE TABLE {code_table} (code VARCHAR, column_id INTEGER, row_index BIGINT, "
+                             f"pattern_id INTEGER, seq BIGINT)")
+            return
+
+        order = f"pos // {int(self.system.chunk_size)}, column_id, pattern_id, pos, occurrence"
+        self.con.execute(
+            f"""
+            CREATE TABLE {code_table} AS
+            SELECT code, column_id, row_index, pattern_id, row_number() OVER (ORDER BY {order}) AS seq
+            FROM ({' UNION ALL '.join(selects)})
+            QUALIFY row_number() OVER (PARTITION BY code ORDER BY {order}) = 1
+            """,
+            params
+        )
+
+    def _fetch_filtered(self):
+        # فقط ردیف‌های همین gateway از پلتفرم به حافظه آورده می‌شوند (با همان شماره ردیف فایل)
+        platform_df = self.con.execute(
+            "SELECT * EXCLUDE (row_index, pos) FROM filtered ORDER BY row_index"
+        ).df()
+        platform_df.index = pd.Index(
+            self.con.execute("SELECT row_index FROM filtered ORDER BY row_index").fetchnumpy()['row_index']
+        )
+        return platform_df
+
+    def _fetch_codes(self, code_table, other_table, columns, patterns):
+        df = self.con.execute(
+            f"""
+            SELECT code, column_id, row_index, pattern_id,
+                   EXISTS (SELECT 1 FROM {other_table} o WHERE o.code = c.code) AS matched
+            FROM {code_table} c ORDER BY seq
+            """
+        ).df()
+        codes = self.system._build_code_table(df['code'], df['column_id'], df['row_index'], df['pattern_id'], columns,
+                                              patterns)
+        return codes, df['matched'].to_numpy(dtype=bool)
+
+    def reconcile(self, platform_path, provider_path, gateway_name, nrows=None):
+        with tempfile.TemporaryDirectory(dir=self.temp_directory) as work_dir:
+            import duckdb
+            self.con = duckdb.connect(os.path.join(work_dir, 'reconciliation.duckdb'))
+            try:
+                self.con.execute(f"SET memory_limit = '{self.memory_limit}'")
+                self.con.execute(f"SET temp_directory = '{os.path.join(work_dir, 'spill')}'")
+                self.con.execute("SET preserve_insertion_order = true")
+                return self._reconcile(platform_path, provider_path, gateway_name, nrows)
+            finally:
+                self.con.close()
+                self.con = None
+
+    def _reconcile(self, platform_path, provider_path, gateway_name, nrows=None):
+        system = self.system
+        extractors = system.gateway_extractors(gateway_name)
+        platform_columns = self._load_table('platform', platform_path, nrows=nrows,
+                                            columns=system.platform_columns(gateway_name))
+        if 'gateway' not in platform_columns:
+            raise ValueError("Platform file has no 'gateway' column")
+        tracking_columns = [col for col in extractors['platform_columns'] if col in platform_columns]
+
+        self.con.execute(
+            """
+            CREATE TABLE filtered AS
+            SELECT rowid AS row_index, row_number() OVER (ORDER BY rowid) - 1 AS pos, *
+            FROM platform WHERE lower(CAST(gateway AS VARCHAR)) = lower(?)
+            """,
+            [gateway_name]
+        )
+        filtered_count = self.con.execute("SELECT count(*) FROM filtered").fetchone()[0]
+        if filtered_count == 0:
+            logging.warning(f"No records with gateway '{gateway_name}' found.")
+            return None
+        logging.info(f"DuckDB: filtered platform data for gateway '{gateway_name}' with {filtered_count} records")
+
+        provider_columns = self._load_table('provider', provider_path, nrows=nrows, gateway_name=gateway_name)
+        self.con.execute("CREATE VIEW provider_rows AS SELECT rowid AS row_index, rowid AS pos, * FROM provider")
+
+        code_columns = [col for col in extractors['provider_columns'] or provider_columns if col in provider_columns]
+        patterns = extractors['labels']
+        self._extract_codes('filtered', 'platform_codes', tracking_columns, extractors,
+                            extractors['platform_extractors'])
+        self._extract_codes('provider_rows', 'provider_codes', code_columns, extractors)
+
+        platform_codes, platform_matched = self._fetch_codes('platform_codes', 'provider_codes', tracking_columns,
+                                                             patterns)
+        provider_codes, provider_matched = self._fetch_codes('provider_codes', 'platform_codes', code_columns, patterns)
+        logging.info(f"DuckDB: extracted {len(platform_codes)} platform and {len(provider_codes)} provider codes")
+
+        if platform_codes.empty or provider_codes.empty:
+            matches, non_matches = system.find_exact_matches(platform_codes, provider_codes)
+        else:
+            joined = self.con.execute(
+                """
+                SELECT p.code, p.column_id AS column_id_file1, p.row_index AS row_index_file1,
+                       p.pattern_id AS pattern_id_file1, v.column_id AS column_id_file2,
+                       v.row_index AS row_index_file2, v.pattern_id AS pattern_id_file2
+                FROM platform_codes p JOIN provider_codes v ON p.code = v.code
+                ORDER BY p.seq
+                """
+            ).df()
+            left = system._build_code_table(joined['code'], joined['column_id_file1'], joined['row_index_file1'],
+                                            joined['pattern_id_file1'], tracking_columns, patterns)
+            right = system._build_code_table(joined['code'], joined['column_id_file2'], joined['row_index_file2'],
+                                             joined['pattern_id_file2'], code_columns, patterns)
+            matches = pd.concat([left.add_suffix('_file1').rename(columns={'code_file1': 'code'}),
+                                 right.drop(columns=['code']).add_suffix('_file2')], axis=1)
+            matches['match_type'] = 'دقیق'
+            non_matches = pd.concat([
+                platform_codes[~platform_matched].assign(match_type='فقط در فایل 1'),
+                provider_codes[~provider_matched].assign(match_type='فقط در فایل 2')
+            ])
+            logging.info(f"DuckDB: found {len(matches)} exact matches and {len(non_matches)} non-matches")
+
+        platform_df = self._fetch_filtered()
+        # کل ارائه‌دهنده به حافظه می‌آید (محدودیت توضیح داده‌شده در بالای کلاس)
+        provider_df = self.con.execute("SELECT * FROM provider ORDER BY rowid").df()
+        unmatched_positions = self.con.execute(
+            """
+            SELECT rowid AS position FROM provider
+            WHERE rowid NOT IN (SELECT v.row_index FROM provider_codes v JOIN platform_codes p ON p.code = v.code)
+            ORDER BY rowid
+            """
+        ).fetchnumpy()['position']
+
+        return {
+            'platform': platform_df,
+            'provider': provider_df,
+            'filtered_platform': RowSelection(platform_df, np.arange(len(platform_df))),
+            'platform_codes': platform_codes,
+            'provider_codes': provider_codes,
+            'matches': matches,
+            'non_matches': non_matches,
+            'gateway_name': gateway_name,
+            'unmatched_provider': RowSelection(provider_df, unmatched_positions)
+        }
@@ -0,0 +1,58 @@
+import os
+import time
+import streamlit as st
+from code_index import CodeIndex
+
+INDEX_DIRECTORY = "code_index"
+
+st.set_page_config(
+    page_title="جستجوی کد رهگیری",
+    layout="wide",
+    initial_sidebar_state="expanded",
+    page_icon="🔎"
+)
+
+@st.cache_resource
+def load_index(directory, created_at):
+    # created_at در کلید کش است تا پس از ساخت دوباره ایندکس، نسخه جدید باز شود
+    return CodeIndex(directory)
+
+st.markdown('<h1 style="text-align: center; color: #2c3e50;">جستجوی سریع کد رهگیری</h1>', unsafe_allow_html=True)
+
+gateways = sorted(
+    name for name in os.listdir(INDEX_DIRECTORY)
+    if os.path.isfile(os.path.join(INDEX_DIRECTORY, name, 'meta.json'))
+) if os.path.isdir(INDEX_DIRECTORY) else []
+if not gateways:
+    st.info("هنوز ایندکسی ساخته نشده است. پس از مغایرت‌گیری، ایندکس را با دکمه «ساخت ایندکس جستجوی کد» در بخش گزارش نهایی بسازید.")
+    st.stop()
+
+col1, col2, col3 = st.columns([1, 3, 1])
+with col1:
+    gateway = st.selectbox("ارائه‌دهنده (Gateway)", gateways)
+with col2:
+    code = st.text_input("کد رهگیری", placeholder="مثال: TR-123")
+with col3:
+    prefix = st.checkbox("جستجوی پیشوندی", value=False)
+
+directory = os.path.join(INDEX_DIRECTORY, gateway)
+modified = os.path.getmtime(os.path.join(directory, 'meta.json'))
+index = load_index(directory, modified)
+st.caption(f"ایندکس {index.meta['codes']} کد از اجرای {index.meta['created_at']}")
+
+if code:
+    started = time.perf_counter()
+    records = index.prefix_lookup(code.strip(), limit=200) if prefix else index.lookup(code.strip())
+    elapsed = (time.perf_counter() - started) * 1e6
+    if records:
+        sides = {record['side'] for record in records}
+        if sides == {'platform', 'provider'}:
+            st.success("این کد در هر دو فایل پلتفرم و ارائه‌دهنده وجود دارد.")
+        elif 'provider' in sides:
+            st.warning("این کد فقط در فایل ارائه‌دهنده پیدا شد.")
+        else:
+            st.warning("این کد فقط در فایل پلتفرم پیدا شد.")
+        st.dataframe(index.to_frame(records), use_container_width=True, hide_index=True)
+    else:
+        st.error("کدی پیدا نشد.")
+    st.caption(f"زمان جستجو: {elapsed:.0f} میکروثانیه")
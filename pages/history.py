@@ -0,0 +1,57 @@
+import streamlit as st
+import plotly.express as px
+from results_store import ReconciliationResultsStore
+
+st.set_page_config(
+    page_title="تاریخچه مغایرت‌گیری",
+    layout="wide",
+    initial_sidebar_state="expanded",
+    page_icon="📈"
+)
+
+@st.cache_resource
+def load_store():
+    return ReconciliationResultsStore()
+
+store = load_store()
+
+st.markdown('<h1 style="text-align: center; color: #2c3e50;">تاریخچه و روند مغایرت‌گیری</h1>', unsafe_allow_html=True)
+
+gateways = store.gateways()
+if not gateways:
+    st.info("هنوز هیچ اجرایی در تاریخچه ثبت نشده است. پس از اولین مغایرت‌گیری، روندها اینجا نمایش داده می‌شوند.")
+    st.stop()
+
+selected = st.selectbox("ارائه‌دهنده (Gateway)", ["همه"] + gateways)
+gateway = None if selected == "همه" else selected
+
+chart_layout = dict(
+    font=dict(family='Vazir', size=14, color="#2c3e50"),
+    margin=dict(t=60, b=40, l=40, r=20),
+    paper_bgcolor='rgba(255, 255, 255, 0.9)',
+    plot_bgcolor='rgba(255, 255, 255, 0.9)',
+    title_font=dict(color="#2c3e50", size=18)
+)
+
+col1, col2 = st.columns(2)
+
+with col1:
+    rates = store.match_rate_by_day(gateway)
+    fig = px.line(rates, x='run_date', y='match_percent', color='gateway', markers=True,
+                  title="نرخ تطابق روزانه (%)")
+    fig.update_layout(**chart_layout)
+    st.plotly_chart(fig, use_container_width=True)
+
+with col2:
+    backlog = store.unmatched_backlog(gateway)
+    fig = px.bar(backlog, x='run_date', y='open_unmatched', color='gateway', barmode='group',
+                 title="کدهای بدون تطابق باز در پایان هر روز")
+    fig.update_layout(**chart_layout)
+    st.plotly_chart(fig, use_container_width=True)
+
+st.markdown('<h3 style="color: #2c3e50;">کدهای دیر تسویه‌شده</h3>', unsafe_allow_html=True)
+min_days = st.number_input("حداقل تعداد روز انتظار", min_value=0.0, value=1.0, step=0.5)
+st.dataframe(store.slow_to_settle(gateway, min_days=min_days, limit=500), use_container_width=True, height=400)
+
+st.markdown('<h3 style="color: #2c3e50;">آخرین اجراها</h3>', unsafe_allow_html=True)
+st.dataframe(store.runs(gateway), use_container_width=True, height=300)
@@ -0,0 +1,214 @@
+import sys
+import logging
+
+import numpy as np
+import pandas as pd
+
+from smart_reconciliation_system import RowSelection
+
+
+# کاراکترهایی که str.strip پایتون حذف می‌کند
+_SPACE_CHARS = ''.join(chr(code) for code in range(sys.maxunicode + 1) if chr(code).isspace())
+# مقدارهای رشته‌ای (با : بعدشان یعنی کلید) و عددی در متن JSON
+_JSON_TOKEN = r'"(?:[^"\\]|\\.)*":?|-?[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?'
+
+
+class PolarsReconciliationEngine:
+    # پیاده‌سازی Polars برای خواندن، استخراج و تطبیق: اسکن تنبل فایل‌ها، استخراج regex چندنخی و hash join؛
+    # خروجی‌ها در مرز به دیتافریم‌های pandas با همان ساختار مسیر pandas تبدیل می‌شوند
+    def __init__(self, system):
+        import polars
+        self.pl = polars
+        self.system = system
+
+    def read_file(self, file_path, columns=None, nrows=None, gateway_name=None):
+        pl = self.pl
+        file_type = self.system.detect_file_type(file_path)
+        compression = self.system.detect_compression(file_path)
+        if file_type == '.csv' and compression is None:
+            # همه ستون‌ها متنی خوانده می‌شوند تا کدهای عددی تغییر شکل ندهند
+            lf = pl.scan_csv(file_path, infer_schema_length=0, encoding='utf8-lossy', n_rows=nrows)
+        elif file_type in ['.ndjson', '.jsonl'] and compression is None:
+            lf = pl.scan_ndjson(file_path, n_rows=nrows)
+        else:
+            # سایر قالب‌ها (اکسل، JSON، فایل‌های فشرده و آرشیو) از مسیر خواندن جریانی pandas می‌آیند
+            df = self.system.read_file(file_path, columns=columns, nrows=nrows, gateway_name=gateway_name)
+            lf = pl.from_pandas(df.reset_index(drop=True).astype(str)).lazy()
+        if columns:
+            lf = lf.select([col for col in lf.collect_schema().names() if col in columns])
+        return lf
+
+    def _json_leaves(self, text):
+        # برگ‌های متن JSON (مقدارهای رشته‌ای و عددی به ترتیب سند، بدون کلیدها)؛ مثل _json_leaves مسیر pandas
+        pl = self.pl
+        element = pl.element()
+        return text.str.extract_all(_JSON_TOKEN).list.eval(element.filter(~element.str.ends_with(':'))).list.eval(
+            pl.when(element.str.starts_with('"')).then(element.str.json_decode(pl.String)).otherwise(element)
+        )
+
+    def _structural_codes(self, source, spec, extractors):
+        # همان _structural_codes مسیر pandas با عبارت‌های Polars روی ستون text منبع؛ خروجی: فهرست (برچسب،
+        # کدها با row_index و pos) و منبعی که هنوز باید از regex بگذرد (None یعنی چیزی باقی نمانده)
+        pl = self.pl
+        text = pl.col('text')
+
+        def codes(found):
+            return (source.select('row_index', 'pos', found.alias('code')).explode('code')
+                    .with_columns(pl.col('code').str.strip_chars(_SPACE_CHARS))
+                    .filter(pl.col('code') != ''))
+
+        if spec['type'] == 'clean':
+            # فقط سلولی که تماماً با یکی از الگوهای gateway جور است خود کد حساب می‌شود
+            stripped = text.str.strip_chars(_SPACE_CHARS)
+            clean = pl.any_horizontal([stripped.str.contains(f'^(?:{pattern})$') for pattern in extractors['patterns']]
+                                      or [pl.lit(False)]).fill_null(False)
+            source = source.with_columns(clean.alias('clean'))
+            return ([('clean', source.filter('clean').select('row_index', 'pos', stripped.alias('code')))],
+                    source.filter(~pl.col('clean')).drop('clean'))
+
+        if spec['type'] == 'split':
+            parts = text.str.split(spec.get('delimiter', '|'))
+            if spec.get('parts') is not None:
+                # ترتیب وقوع شماره بخش است، پس بخش‌ها به ترتیب شماره انتخاب می‌شوند
+                selected = [int(part) for part in sorted(spec['parts']) if int(part) >= 0]
+                if not selected:
+                    return [], None
+                parts = pl.concat_list([parts.list.get(part, null_on_oob=True) for part in selected])
+            return [(self.system._extractor_labels(spec)[0], codes(parts))], None
+
+        # json: فقط سلول‌هایی که با { یا [ شروع می‌شوند و JSON معتبرند در doc می‌آیند؛ بقیه از regex می‌گذرند
+        candidate = text.str.strip_chars_start(_SPACE_CHARS).str.slice(0, 1).is_in(['{', '['])
+        source = source.with_columns(pl.when(candidate).then(text.str.json_path_match('$')).alias('doc'))
+        paths = spec.get('paths')
+        if not paths:
+            # بدون مسیر مشخص مقدارهای برگ با فاصله کنار هم گذاشته می‌شوند و به جای متن سلول از regex می‌گذرند
+            leaves = self._json_leaves(pl.col('doc')).list.join(' ')
+            return [], source.select('row_index', 'pos', pl.when(pl.col('doc').is_null()).then(text).otherwise(leaves)
+                                     .alias('text'))
+        structured = []
+        for label, path in zip(self.system._extractor_labels(spec), paths):
+            # json_path_match مقدار ساده را بی‌نقل‌قول و شیء یا آرایه را به‌صورت متن JSON برمی‌گرداند؛
+            # مقدار boolean هم مثل رشته 'true' یا 'false' برگردانده می‌شود
+            found = pl.col('doc').str.json_path_match('$' + ''.join(f"['{key}']" for key in path.split('.')))
+            nested = found.str.slice(0, 1).is_in(['{', '[']) & found.str.json_path_match('$').is_not_null()
+            structured.append((label, codes(pl.when(nested).then(self._json_leaves(found))
+                                            .otherwise(pl.concat_list(found)))))
+        return structured, source.filter(pl.col('doc').is_null()).drop('doc')
+
+    def _code_frame(self, found, column_id, pattern_id, normalize):
+        pl = self.pl
+        code = pl.col('code')
+        if normalize == 'upper':
+            code = code.str.to_uppercase()
+        elif normalize == 'lower':
+            code = code.str.to_lowercase()
+        return found.with_columns(code,
+                                  pl.lit(column_id, pl.Int16).alias('column_id'),
+                                  pl.lit(pattern_id, pl.Int8).alias('pattern_id'))
+
+    def extract_potential_tracking_codes(self, lf, columns, extractors, structural=None):
+        # lf باید ستون‌های row_index (شماره ردیف منبع) و pos (موقعیت در داده ورودی) را داشته باشد
+        pl = self.pl
+        frames = []
+        for column_id, col in enumerate(columns):
+            source = lf.select('row_index', 'pos', pl.col(col).cast(pl.Utf8).alias('text'))
+            if col in (structural or {}):
+                # کدهای ساختاری مستقیم برداشته می‌شوند و فقط متن باقی‌مانده از regex می‌گذرد
+                structured, source = self._structural_codes(source, structural[col], extractors)
+                for label, found in structured:
+                    frames.append(self._code_frame(found, column_id, extractors['labels'].index(label),
+                                                   extractors['normalize']))
+                if source is None:
+                    continue
+            for pattern_id, pattern in enumerate(extractors['patterns']):
+                found = (source.select('row_index', 'pos', pl.col('text').str.extract_all(pattern).alias('code'))
+                         .explode('code')
+                         .drop_nulls('code'))
+                frames.append(self._code_frame(found, column_id, pattern_id, extractors['normalize']))
+        if not frames:
+            return self.system._empty_code_table(columns, extractors['labels'])
+
+        # ترتیب حذف کدهای تکراری مثل مسیر pandas است: تکه، ستون، الگو، ردیف و ترتیب وقوع در سلول
+        codes = (
+            pl.concat(frames)
+            .with_columns((pl.col('pos') // self.system.chunk_size).alias('chunk'))
+            .sort(['chunk', 'column_id', 'pattern_id', 'pos'], maintain_order=True)
+            .unique(subset='code', keep='first', maintain_order=True)
+            .collect()
+        )
+        logging.info(f"Polars: extracted {codes.height} unique codes")
+        return self.system._build_code_table(codes['code'].to_numpy(), codes['column_id'].to_numpy(),
+                                             codes['row_index'].to_numpy(), codes['pattern_id'].to_numpy(), columns,
+                                             extractors['labels'])
+
+    def find_exact_matches(self, codes1, codes2):
+        if codes1.empty or codes2.empty:
+            return self.system.find_exact_matches(codes1, codes2)
+
+        pl = self.pl
+        left = pl.DataFrame({'code': codes1['code'].astype(str).to_numpy(), 'left_position': np.arange(len(codes1))})
+        right = pl.DataFrame({'code': codes2['code'].astype(str).to_numpy(), 'right_position': np.arange(len(codes2))})
+        joined = left.join(right, on='code', how='inner', maintain_order='left')
+        left_positions = joined['left_position'].to_numpy()
+        right_positions = joined['right_position'].to_numpy()
+
+        matches = pd.concat([
+            codes1.iloc[left_positions].reset_index(drop=True).add_suffix('_file1').rename(columns={'code_file1': 'code'}),
+            codes2.iloc[right_positions].drop(columns=['code']).reset_index(drop=True).add_suffix('_file2')
+        ], axis=1)
+        matches['match_type'] = 'دقیق'
+        logging.info(f"Polars: found {len(matches)} exact matches")
+
+        matched1 = np.zeros(len(codes1), dtype=bool)
+        matched1[left_positions] = True
+        matched2 = np.zeros(len(codes2), dtype=bool)
+        matched2[right_positions] = True
+        non_matches = pd.concat([codes1[~matched1].assign(match_type='فقط در فایل 1'),
+                                 codes2[~matched2].assign(match_type='فقط در فایل 2')])
+        logging.info(f"Polars: found {len(non_matches)} non-matches")
+        return matches, non_matches
+
+    def reconcile(self, platform_path, provider_path, gateway_name, nrows=None):
+        pl = self.pl
+        system = self.system
+        extractors = system.gateway_extractors(gateway_name)
+        platform = self.read_file(platform_path, columns=system.platform_columns(gateway_name), nrows=nrows)
+        platform = platform.with_row_index('row_index')
+        filtered = (
+            platform
+            .filter(pl.col('gateway').cast(pl.Utf8).str.to_lowercase() == gateway_name.lower())
+            .with_row_index('pos')
+        )
+        platform_df = platform.collect().to_pandas().set_index('row_index')
+        platform_df.index.name = None
+        filtered_rows = filtered.select('row_index').collect()['row_index'].to_numpy()
+        if len(filtered_rows) == 0:
+            logging.warning(f"No records with gateway '{gateway_name}' found.")
+            return None
+        logging.info(f"Polars: filtered platform data for gateway '{gateway_name}' with {len(filtered_rows)} records")
+
+        tracking_columns = [col for col in extractors['platform_columns'] if col in platform_df.columns]
+        platform_codes = self.extract_potential_tracking_codes(filtered, tracking_columns, extractors,
+                                                               extractors['platform_extractors'])
+
+        provider = self.read_file(provider_path, nrows=nrows, gateway_name=gateway_name)
+        provider_columns = provider.collect_schema().names()
+        provider = provider.with_row_index('row_index').with_columns(pl.col('row_index').alias('pos'))
+        code_columns = [col for col in extractors['provider_columns'] or provider_columns if col in provider_columns]
+        provider_codes = self.extract_potential_tracking_codes(provider, code_columns, extractors)
+        provider_df = provider.drop('row_index', 'pos').collect().to_pandas()
+
+        matches, non_matches = self.find_exact_matches(platform_codes, provider_codes)
+        matched_rows = matches['row_index_file2'] if not matches.empty else []
+
+        return {
+            'platform': platform_df,
+            'provider': provider_df,
+            'filtered_platform': RowSelection(platform_df, platform_df.index.get_indexer(filtered_rows)),
+            'platform_codes': platform_codes,
+            'provider_codes': provider_codes,
+            'matches': matches,
+            'non_matches': non_matches,
+            'gateway_name': gateway_name,
+            'unmatched_provider': RowSelection(provider_df, np.flatnonzero(~provider_df.index.isin(matched_rows)))
+        }
@@ -0,0 +1,108 @@
+import os
+import time
+import shutil
+import pickle
+import logging
+
+# فایل‌های هر ورودی کش
+_RESULTS_FILE = 'results.pkl'
+_REPORT_FILE = 'report.xlsx'
+
+
+class ResultCache:
+    # کش کامل نتایج روی دیسک با کلید run_key (هش فایل پلتفرم، هش فایل ارائه‌دهنده، gateway و تنظیمات)؛
+    # هر ورودی یک پوشه است و زمان تغییر پوشه زمان آخرین استفاده است تا با عبور از max_bytes
+    # ورودی‌هایی که مدت بیشتری استفاده نشده‌اند اول حذف شوند (LRU بر اساس حجم دیسک)
+    def __init__(self, directory='result_cache', max_bytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def _touch(self, key):
+        os.utime(self._entry_dir(key))
+
+    def get(self, key):
+        path = os.path.join(self._entry_dir(key), _RESULTS_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                results = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logging.warning(f"Dropping unreadable cache entry {key}: {e}")
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            return None
+        self._touch(key)
+        logging.info(f"Result cache hit for {key}")
+        return results
+
+    def put(self, key, results):
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = os.path.join(entry_dir, _RESULTS_FILE)
+        with open(f'{path}.tmp', 'wb') as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{path}.tmp', path)
+        self._touch(key)
+        self.evict()
+
+    def report_path(self, key):
+        path = os.path.join(self._entry_dir(key), _REPORT_FILE)
+        if not os.path.exists(path):
+            return None
+        self._touch(key)
+        return path
+
+    def put_report(self, key, report_path):
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return
+        target = os.path.join(entry_dir, _REPORT_FILE)
+        shutil.copyfile(report_path, f'{target}.tmp')
+        os.replace(f'{target}.tmp', target)
+        self._touch(key)
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            entry_dir = os.path.join(self.directory, name)
+            if not os.path.isdir(entry_dir):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+            entries.append((os.path.getmtime(entry_dir), name, size))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for _, _, size in entries)
+        removed = 0
+        # قدیمی‌ترین استفاده اول؛ جدیدترین ورودی حتی اگر به‌تنهایی از سقف بزرگ‌تر باشد حذف نمی‌شود
+        for _, name, size in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry_dir(name), ignore_errors=True)
+            total -= size
+            removed += 1
+        if removed:
+            logging.info(f"Evicted {removed} result cache entries, {total} bytes remain")
+        return removed
+
+    def purge(self):
+        entries = self._entries()
+        for _, name, _ in entries:
+            shutil.rmtree(self._entry_dir(name), ignore_errors=True)
+        logging.info(f"Purged {len(entries)} result cache entries")
+        return len(entries)
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'entries': len(entries),
+            'bytes': sum(size for _, _, size in entries),
+            'max_bytes': self.max_bytes,
+            'oldest_access': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entries[0][0])) if entries else None,
+        }
@@ -0,0 +1,166 @@
+import sqlite3
+import json
+import uuid
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+# فقط کدهای بی‌تطابق پلتفرم ثبت می‌شوند؛ کدهای بی‌تطابق ارائه‌دهنده بیشتر توکن‌های متن آزاد هستند
+_PLATFORM_ONLY = 'فقط در فایل 1'
+
+
+class ReconciliationResultsStore:
+    # انباره محلی نتایج اجراها (SQLite) برای تحلیل روند نرخ تطابق و کدهای معوق؛
+    # جدول runs بر اساس (gateway, run_date) و جدول code_status بر اساس (gateway, code) ایندکس شده‌اند
+    def __init__(self, db_path='reconciliation_history.db'):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    gateway TEXT NOT NULL,
+                    run_date TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    platform_records INTEGER,
+                    provider_records INTEGER,
+                    platform_codes INTEGER,
+                    provider_codes INTEGER,
+                    matches INTEGER,
+                    non_matches INTEGER,
+                    match_percent REAL,
+                    summary_json TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_runs_gateway_date ON runs (gateway, run_date);
+
+                CREATE TABLE IF NOT EXISTS code_status (
+                    gateway TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    side TEXT,
+                    first_seen TEXT NOT NULL,
+                    first_unmatched TEXT,
+                    matched_at TEXT,
+                    last_run_id TEXT,
+                    PRIMARY KEY (gateway, code)
+                );
+                CREATE INDEX IF NOT EXISTS idx_code_status_unmatched ON code_status (gateway, first_unmatched);
+                CREATE INDEX IF NOT EXISTS idx_code_status_matched ON code_status (gateway, matched_at);
+            """)
+
+    @contextmanager
+    def _connect(self):
+        # with روی اتصال sqlite3 فقط commit می‌کند؛ اتصال اینجا بسته می‌شود
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def append_run(self, results, created_at=None):
+        if not results:
+            return None
+
+        created_at = created_at or datetime.now()
+        created = created_at.strftime('%Y-%m-%d %H:%M:%S')
+        gateway = str(results.get('gateway_name')).lower()
+        summary = results.get('summary') or {}
+        run_id = uuid.uuid4().hex
+        matches = results.get('matches', pd.DataFrame())
+        non_matches = results.get('non_matches', pd.DataFrame())
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, gateway, created_at.strftime('%Y-%m-%d'), created,
+                 summary.get('platform_records'), summary.get('provider_records'),
+                 summary.get('platform_codes'), summary.get('provider_codes'),
+                 len(matches), len(non_matches), summary.get('match_percent'),
+                 json.dumps(summary, ensure_ascii=False))
+            )
+            if not non_matches.empty:
+                unmatched = non_matches.loc[non_matches['match_type'] == _PLATFORM_ONLY, 'code'].astype(str).unique()
+                conn.executemany(
+                    """
+                    INSERT INTO code_status (gateway, code, side, first_seen, first_unmatched, last_run_id)
+                    VALUES (?, ?, 'platform', ?, ?, ?)
+                    ON CONFLICT (gateway, code) DO UPDATE SET
+                        first_unmatched = COALESCE(code_status.first_unmatched, excluded.first_unmatched),
+                        last_run_id = excluded.last_run_id
+                    """,
+                    ((gateway, code, created, created, run_id) for code in unmatched)
+                )
+            if not matches.empty:
+                conn.executemany(
+                    """
+                    INSERT INTO code_status (gateway, code, side, first_seen, matched_at, last_run_id)
+                    VALUES (?, ?, 'both', ?, ?, ?)
+                    ON CONFLICT (gateway, code) DO UPDATE SET
+                        matched_at = COALESCE(code_status.matched_at, excluded.matched_at),
+                        last_run_id = excluded.last_run_id
+                    """,
+                    ((gateway, code, created, created, run_id) for code in matches['code'].astype(str).unique())
+                )
+
+        logging.info(f"Stored run {run_id} for gateway '{gateway}' in {self.db_path}")
+        return run_id
+
+    def _query(self, sql, params=()):
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def gateways(self):
+        return self._query("SELECT DISTINCT gateway FROM runs ORDER BY gateway")['gateway'].tolist()
+
+    def runs(self, gateway=None, limit=100):
+        return self._query(
+            """
+            SELECT run_id, gateway, created_at, platform_records, provider_records, matches, non_matches, match_percent
+            FROM runs WHERE (:gateway IS NULL OR gateway = :gateway)
+            ORDER BY created_at DESC LIMIT :limit
+            """,
+            {'gateway': gateway, 'limit': limit}
+        )
+
+    def match_rate_by_day(self, gateway=None):
+        return self._query(
+            """
+            SELECT gateway, run_date, COUNT(*) AS runs, SUM(matches) AS matches, SUM(non_matches) AS non_matches,
+                   ROUND(100.0 * SUM(matches) / NULLIF(SUM(matches) + SUM(non_matches), 0), 2) AS match_percent
+            FROM runs WHERE (:gateway IS NULL OR gateway = :gateway)
+            GROUP BY gateway, run_date ORDER BY gateway, run_date
+            """,
+            {'gateway': gateway}
+        )
+
+    def unmatched_backlog(self, gateway=None):
+        # تعداد کدهای بازِ بدون تطابق در پایان هر روزی که اجرایی ثبت شده است
+        return self._query(
+            """
+            SELECT d.gateway, d.run_date, COUNT(c.code) AS open_unmatched
+            FROM (SELECT DISTINCT gateway, run_date FROM runs WHERE (:gateway IS NULL OR gateway = :gateway)) d
+            LEFT JOIN code_status c
+                ON c.gateway = d.gateway
+                AND c.first_unmatched < date(d.run_date, '+1 day')
+                AND (c.matched_at IS NULL OR c.matched_at >= date(d.run_date, '+1 day'))
+            GROUP BY d.gateway, d.run_date ORDER BY d.gateway, d.run_date
+            """,
+            {'gateway': gateway}
+        )
+
+    def slow_to_settle(self, gateway=None, min_days=1, limit=100):
+        # کدهایی که دیر تطابق پیدا کرده‌اند یا هنوز باز هستند، به ترتیب مدت انتظار
+        return self._query(
+            """
+            SELECT gateway, code, side, first_unmatched, matched_at,
+                   ROUND(julianday(COALESCE(matched_at, datetime('now', 'localtime'))) - julianday(first_unmatched), 2)
+                       AS days_open,
+                   matched_at IS NULL AS still_open
+            FROM code_status
+            WHERE first_unmatched IS NOT NULL AND (:gateway IS NULL OR gateway = :gateway)
+                AND julianday(COALESCE(matched_at, datetime('now', 'localtime'))) - julianday(first_unmatched) >= :min_days
+            ORDER BY days_open DESC LIMIT :limit
+            """,
+            {'gateway': gateway, 'min_days': min_days, 'limit': limit}
+        )
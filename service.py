@@ -0,0 +1,335 @@
+import os
+import re
+import json
+import uuid
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+
+# جدول‌هایی از نتایج که به‌صورت NDJSON قابل دریافت هستند
+_RESULT_TABLES = ['matches', 'non_matches', 'unmatched_provider', 'filtered_platform']
+_STATUS_TEXT = {200: 'OK', 201: 'Created', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found',
+                405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+_BLOCK_SIZE = 1 << 16
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _write_ndjson(df, path, block_rows=100000):
+    # نوشتن تکه‌به‌تکه تا جدول‌های بزرگ یک‌جا به متن تبدیل نشوند
+    with open(path, 'w', encoding='utf-8') as f:
+        for start in range(0, len(df), block_rows):
+            f.write(df.iloc[start:start + block_rows].to_json(orient='records', lines=True, force_ascii=False,
+                                                               date_format='iso'))
+
+
+def run_reconciliation_job(job_dir, platform_path, provider_path, gateway_name, engine=None, nrows=None,
+                           history_db=None):
+    # در پروسه کارگر اجرا می‌شود؛ نتایج روی دیسک نوشته می‌شوند و فقط خلاصه به حلقه رویداد برمی‌گردد
+    from smart_reconciliation_system import SmartReconciliationSystem, materialize
+    system = SmartReconciliationSystem()
+    if history_db:
+        from results_store import ReconciliationResultsStore
+        system.results_store = ReconciliationResultsStore(history_db)
+
+    results = system.gateway_specific_reconciliation(platform_path, provider_path, gateway_name, nrows=nrows,
+                                                     engine=engine)
+    if results is None:
+        raise ValueError(f"No records with gateway '{gateway_name}' found.")
+
+    tables = {
+        'matches': system.matches_with_original_text(results),
+        'non_matches': results.get('non_matches'),
+        'unmatched_provider': results.get('unmatched_provider'),
+        'filtered_platform': results.get('filtered_platform'),
+    }
+    for name, df in tables.items():
+        if df is not None:
+            _write_ndjson(materialize(df), os.path.join(job_dir, f'{name}.ndjson'))
+    system.generate_report(results, os.path.join(job_dir, 'report.xlsx'))
+    return {'summary': results['summary'], 'run_id': results.get('run_id')}
+
+
+class ReconciliationService:
+    # سرویس HTTP محلی روی asyncio: بارگذاری جریانی فایل‌ها، ثبت کار، پیگیری وضعیت، دریافت نتایج به‌صورت NDJSON
+    # و گزارش اکسل؛ مراحل پردازشی در ProcessPoolExecutor اجرا می‌شوند تا حلقه رویداد آزاد بماند
+    def __init__(self, work_dir='service_data', workers=None, history_db=None, max_upload_size=None):
+        self.work_dir = work_dir
+        self.upload_dir = os.path.join(work_dir, 'uploads')
+        self.jobs_dir = os.path.join(work_dir, 'jobs')
+        os.makedirs(self.upload_dir, exist_ok=True)
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self.workers = workers
+        self.history_db = history_db
+        self.max_upload_size = max_upload_size
+        self.uploads = {}
+        self.jobs = {}
+        self.executor = None
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8765):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        logging.info(f"Reconciliation service listening on {host}:{port}")
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    async def serve_forever(self, host='127.0.0.1', port=8765):
+        server = await self.start(host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.close()
+
+    # ---------- HTTP ----------
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            url = urlsplit(target)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            await self.route(method.upper(), url.path.rstrip('/') or '/', query, headers, reader, writer)
+        except HTTPError as e:
+            await self._send_json(writer, e.status, {'error': str(e)})
+        except (ValueError, json.JSONDecodeError) as e:
+            await self._send_json(writer, 400, {'error': str(e)})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logging.exception("Unhandled service error")
+            await self._send_json(writer, 500, {'error': str(e)})
+        finally:
+            writer.close()
+
+    async def route(self, method, path, query, headers, reader, writer):
+        parts = path.strip('/').split('/')
+        if parts == ['health'] and method == 'GET':
+            return await self._send_json(writer, 200, {'status': 'ok', 'jobs': len(self.jobs)})
+        if parts == ['files'] and method == 'POST':
+            return await self._send_json(writer, 201, await self.receive_upload(query, headers, reader))
+        if parts == ['jobs'] and method == 'POST':
+            body = await self._read_body(headers, reader)
+            try:
+                request = json.loads(body or b'{}')
+            except ValueError:
+                raise HTTPError(400, "Request body is not valid JSON")
+            return await self._send_json(writer, 202, self.submit_job(request))
+        if parts == ['jobs'] and method == 'GET':
+            return await self._send_json(writer, 200, [self._job_view(job_id) for job_id in self.jobs])
+        if len(parts) >= 2 and parts[0] == 'jobs' and method == 'GET':
+            job_id = parts[1]
+            if job_id not in self.jobs:
+                raise HTTPError(404, f"Unknown job: {job_id}")
+            if len(parts) == 2:
+                return await self._send_json(writer, 200, self._job_view(job_id))
+            if len(parts) == 4 and parts[2] == 'results':
+                return await self.stream_results(job_id, parts[3], writer)
+            if len(parts) == 3 and parts[2] == 'report':
+                return await self.send_report(job_id, writer)
+        raise HTTPError(404 if method in ('GET', 'POST') else 405, f"No route for {method} {path}")
+
+    async def _read_body(self, headers, reader, limit=10 * 1024 * 1024):
+        length = int(headers.get('content-length', 0))
+        if length > limit:
+            raise HTTPError(413, "Request body too large")
+        return await reader.readexactly(length) if length else b''
+
+    async def _iter_body(self, headers, reader):
+        # بدنه درخواست به‌صورت جریانی (Content-Length یا chunked) خوانده می‌شود
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    await reader.readline()
+                    return
+                remaining = size
+                while remaining:
+                    block = await reader.read(min(remaining, _BLOCK_SIZE))
+                    if not block:
+                        raise ConnectionError("Connection closed during upload")
+                    remaining -= len(block)
+                    yield block
+                await reader.readline()
+        else:
+            remaining = int(headers.get('content-length', 0))
+            while remaining:
+                block = await reader.read(min(remaining, _BLOCK_SIZE))
+                if not block:
+                    raise ConnectionError("Connection closed during upload")
+                remaining -= len(block)
+                yield block
+
+    async def _send_head(self, writer, status, content_type, length=None, extra=None):
+        lines = [f"HTTP/1.1 {status} {_STATUS_TEXT.get(status, '')}", f"Content-Type: {content_type}",
+                 "Connection: close"]
+        lines.append(f"Content-Length: {length}" if length is not None else "Transfer-Encoding: chunked")
+        lines.extend(f"{name}: {value}" for name, value in (extra or {}).items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+    async def _send_json(self, writer, status, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        await self._send_head(writer, status, 'application/json; charset=utf-8', len(body))
+        writer.write(body)
+        await writer.drain()
+
+    async def _send_file(self, writer, path, content_type, chunked=False, extra=None):
+        loop = asyncio.get_running_loop()
+        await self._send_head(writer, 200, content_type, None if chunked else os.path.getsize(path), extra)
+        with open(path, 'rb') as f:
+            while True:
+                block = await loop.run_in_executor(None, f.read, _BLOCK_SIZE)
+                if not block:
+                    break
+                writer.write(b'%x\r\n%s\r\n' % (len(block), block) if chunked else block)
+                await writer.drain()
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+
+    # ---------- عملیات ----------
+
+    async def receive_upload(self, query, headers, reader):
+        name = os.path.basename(query.get('name', ''))
+        if not name:
+            raise HTTPError(400, "Query parameter 'name' (original file name with extension) is required")
+        # پسوندهای ترکیبی مثل .csv.gz حفظ می‌شوند تا نوع فایل درست تشخیص داده شود
+        safe_name = re.sub(r'[^\w.\-]', '_', name)
+        file_id = uuid.uuid4().hex
+        path = os.path.join(self.upload_dir, f'{file_id}_{safe_name}')
+        loop = asyncio.get_running_loop()
+        size = 0
+        try:
+            with open(path, 'wb') as f:
+                async for block in self._iter_body(headers, reader):
+                    size += len(block)
+                    if self.max_upload_size and size > self.max_upload_size:
+                        raise HTTPError(413, "Upload exceeds the configured size limit")
+                    await loop.run_in_executor(None, f.write, block)
+        except BaseException:
+            os.remove(path)
+            raise
+        self.uploads[file_id] = {'path': path, 'name': name, 'size': size}
+        logging.info(f"Received upload {file_id} ({name}, {size} bytes)")
+        return {'file_id': file_id, 'name': name, 'size': size}
+
+    def submit_job(self, request):
+        if not isinstance(request, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        missing = [key for key in ('platform_file', 'provider_file', 'gateway') if not request.get(key)]
+        if missing:
+            raise HTTPError(400, f"Missing fields: {', '.join(missing)}")
+        invalid = [key for key in ('platform_file', 'provider_file', 'gateway') if not isinstance(request[key], str)]
+        if invalid:
+            raise HTTPError(400, f"Fields must be strings: {', '.join(invalid)}")
+        for key in ('platform_file', 'provider_file'):
+            if request[key] not in self.uploads:
+                raise HTTPError(404, f"Unknown file id: {request[key]}")
+        if request.get('engine') not in (None, 'pandas', 'duckdb', 'polars'):
+            raise HTTPError(400, f"Unknown engine: {request['engine']}")
+        nrows = request.get('nrows')
+        if nrows is not None and (not isinstance(nrows, int) or isinstance(nrows, bool) or nrows <= 0):
+            raise HTTPError(400, f"nrows must be a positive integer: {nrows!r}")
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+        job = {
+            'job_id': job_id,
+            'gateway': request['gateway'],
+            'engine': request.get('engine') or 'pandas',
+            'status': 'queued',
+            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': None,
+            'summary': None,
+            'run_id': None,
+            'error': None,
+            'dir': job_dir,
+        }
+        self.jobs[job_id] = job
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, run_reconciliation_job, job_dir,
+            self.uploads[request['platform_file']]['path'], self.uploads[request['provider_file']]['path'],
+            request['gateway'], request.get('engine'), nrows, self.history_db
+        )
+        job['status'] = 'running'
+        asyncio.ensure_future(self._track_job(job, future))
+        logging.info(f"Submitted job {job_id} for gateway '{request['gateway']}'")
+        return self._job_view(job_id)
+
+    async def _track_job(self, job, future):
+        try:
+            output = await future
+            job.update(status='done', summary=output['summary'], run_id=output['run_id'])
+        except Exception as e:
+            logging.error(f"Job {job['job_id']} failed: {e}")
+            job.update(status='failed', error=str(e))
+        job['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def _job_view(self, job_id):
+        return {key: value for key, value in self.jobs[job_id].items() if key != 'dir'}
+
+    def _finished_job(self, job_id):
+        job = self.jobs[job_id]
+        if job['status'] != 'done':
+            raise HTTPError(409, f"Job {job_id} is {job['status']}")
+        return job
+
+    async def stream_results(self, job_id, table, writer):
+        if table not in _RESULT_TABLES:
+            raise HTTPError(404, f"Unknown result table: {table} (available: {', '.join(_RESULT_TABLES)})")
+        path = os.path.join(self._finished_job(job_id)['dir'], f'{table}.ndjson')
+        if not os.path.exists(path):
+            raise HTTPError(404, f"Job {job_id} has no {table} table")
+        await self._send_file(writer, path, 'application/x-ndjson; charset=utf-8', chunked=True)
+
+    async def send_report(self, job_id, writer):
+        job = self._finished_job(job_id)
+        file_name = f"reconciliation_report_{job['gateway']}_{job_id[:8]}.xlsx"
+        await self._send_file(writer, os.path.join(job['dir'], 'report.xlsx'),
+                              'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                              extra={'Content-Disposition': f'attachment; filename="{file_name}"'})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="سرویس HTTP مغایرت‌گیری")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help="تعداد پروسه‌های کارگر (پیش‌فرض: تعداد هسته‌ها)")
+    parser.add_argument('--work-dir', default='service_data')
+    parser.add_argument('--history-db', default=None, help="مسیر پایگاه تاریخچه برای ثبت اجراها")
+    parser.add_argument('--max-upload-mb', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    service = ReconciliationService(args.work_dir, workers=args.workers, history_db=args.history_db,
+                                    max_upload_size=args.max_upload_mb * 1024 * 1024 if args.max_upload_mb else None)
+    asyncio.run(service.serve_forever(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import os
+import sys
+import time
+import queue
+import socket
+import logging
+import argparse
+import ipaddress
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+import pandas as pd
+
+
+def shard_ids(codes, shards):
+    # شماره شارد هر کد از هش پایدار pandas (مستقل از فرایند و میزبان)
+    hashes = pd.util.hash_pandas_object(codes.astype(str), index=False).to_numpy()
+    return (hashes % np.uint64(shards)).astype(np.int64)
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except OSError:
+        return False
+
+
+def run_worker(address, authkey):
+    # کارگر شارد: به هماهنگ‌کننده وصل می‌شود، جدول کدهای هر شارد را تطبیق می‌دهد و نتیجه را برمی‌گرداند
+    from smart_reconciliation_system import SmartReconciliationSystem
+    system = SmartReconciliationSystem()
+    with Client(address, authkey=authkey) as conn:
+        while True:
+            message = conn.recv()
+            if message[0] == 'stop':
+                return
+            _, shard, codes1, codes2 = message
+            try:
+                matches, non_matches = system.find_exact_matches(codes1, codes2)
+                conn.send(('result', shard, matches, non_matches))
+            except Exception as e:
+                conn.send(('error', shard, str(e)))
+
+
+class ShardCoordinator:
+    # تطبیق شاردشده: جدول کدهای پلتفرم و ارائه‌دهنده با هش کد به shards بخش تقسیم می‌شوند، هر بخش در یک کارگر
+    # (فرایند محلی یا کارگری روی میزبان دیگر که با run_worker وصل شده) تطبیق داده می‌شود و نتایج با همان ترتیب
+    # find_exact_matches ادغام می‌شوند؛ چون هر کد فقط در یک شارد است، تطابق دقیق در شاردها همان تطابق کل است.
+    # هر دو طرف pickle دریافت می‌کنند، پس گوش دادن روی آدرس غیر loopback بدون authkey صریح پذیرفته نمی‌شود؛
+    # بدون authkey برای هر اجرا یک کلید تصادفی ساخته و به کارگرهای محلی داده می‌شود
+    def __init__(self, shards, address=('127.0.0.1', 0), authkey=None, local_workers=None, connect_timeout=60):
+        if not authkey and not is_loopback(address[0]):
+            raise ValueError(f"Refusing to listen on non-loopback address {address[0]!r} without an explicit authkey")
+        self.shards = shards
+        self.address = address
+        self.authkey = authkey or os.urandom(32)
+        self.local_workers = shards if local_workers is None else local_workers
+        self.connect_timeout = connect_timeout
+        self._tasks = queue.Queue()
+        self._results = {}
+        self._errors = []
+        self._connected = 0
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def _accept(self, listener):
+        while not self._done.is_set():
+            try:
+                conn = listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._connected += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while not self._done.is_set():
+                try:
+                    task = self._tasks.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                try:
+                    conn.send(('task', *task))
+                    reply = conn.recv()
+                except (EOFError, OSError) as e:
+                    # کارگر قطع شده؛ شارد به صف برمی‌گردد تا کارگر دیگری آن را بگیرد
+                    logging.warning(f"Shard worker disconnected during shard {task[0]}: {e}")
+                    self._tasks.put(task)
+                    with self._lock:
+                        self._connected -= 1
+                    return
+                with self._lock:
+                    if reply[0] == 'error':
+                        self._errors.append(f"shard {reply[1]}: {reply[2]}")
+                        self._done.set()
+                    else:
+                        self._results[reply[1]] = reply[2:]
+                        if len(self._results) == self.shards:
+                            self._done.set()
+            try:
+                conn.send(('stop',))
+            except OSError:
+                pass
+
+    def reconcile(self, codes1, codes2):
+        if codes1.empty or codes2.empty:
+            from smart_reconciliation_system import SmartReconciliationSystem
+            return SmartReconciliationSystem().find_exact_matches(codes1, codes2)
+
+        # موقعیت هر کد در جدول اصلی نگه داشته می‌شود تا ترتیب خروجی مثل حالت بدون شارد باشد
+        codes1 = codes1.assign(_position=np.arange(len(codes1)))
+        codes2 = codes2.assign(_position=np.arange(len(codes2)))
+        ids1 = shard_ids(codes1['code'], self.shards)
+        ids2 = shard_ids(codes2['code'], self.shards)
+        for shard in range(self.shards):
+            self._tasks.put((shard, codes1[ids1 == shard], codes2[ids2 == shard]))
+
+        started = time.perf_counter()
+        processes = []
+        with Listener(self.address, authkey=self.authkey) as listener:
+            logging.info(f"Shard coordinator listening on {listener.address} for {self.shards} shards")
+            threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+            for _ in range(self.local_workers):
+                process = multiprocessing.Process(target=run_worker, args=(listener.address, self.authkey),
+                                                  daemon=True)
+                process.start()
+                processes.append(process)
+            waited = 0
+            while not self._done.wait(1):
+                waited = 0 if self._connected else waited + 1
+                if waited >= self.connect_timeout:
+                    self._done.set()
+                    raise TimeoutError(f"No shard worker connected within {self.connect_timeout}s")
+        for process in processes:
+            process.join()
+        if self._errors:
+            raise RuntimeError(f"Sharded reconciliation failed: {'; '.join(self._errors)}")
+        logging.info(f"Reconciled {self.shards} shards in {time.perf_counter() - started:.2f}s")
+        return self._merge()
+
+    def _merge(self):
+        parts = [self._results[shard] for shard in range(self.shards)]
+        matches = [part[0] for part in parts if not part[0].empty]
+        if matches:
+            matches = pd.concat(matches).sort_values(['_position_file1', '_position_file2'], kind='stable')
+            matches = matches.drop(columns=['_position_file1', '_position_file2']).reset_index(drop=True)
+        else:
+            matches = pd.DataFrame()
+        non_matches = pd.concat([part[1] for part in parts])
+        non_matches = pd.concat([
+            non_matches[non_matches['match_type'] == side].sort_values('_position', kind='stable')
+            for side in ('فقط در فایل 1', 'فقط در فایل 2')
+        ]).drop(columns=['_position'])
+        logging.info(f"Merged {len(matches)} exact matches and {len(non_matches)} non-matches from {self.shards} shards")
+        return matches, non_matches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="کارگر تطبیق شاردشده برای اتصال به هماهنگ‌کننده روی میزبان دیگر")
+    parser.add_argument('address', help="آدرس هماهنگ‌کننده به شکل host:port")
+    parser.add_argument('--authkey', required=True, help="همان shard_authkey تنظیم‌شده در هماهنگ‌کننده")
+    parser.add_argument('--forever', action='store_true', help="پس از هر اجرا دوباره به هماهنگ‌کننده وصل شو")
+    parser.add_argument('--retry', type=float, default=5, help="ثانیه‌های انتظار بین تلاش‌های اتصال")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    address = parse_address(args.address)
+    while True:
+        try:
+            run_worker(address, args.authkey.encode())
+        except ConnectionRefusedError:
+            if not args.forever:
+                logging.error(f"Could not connect to shard coordinator at {args.address}")
+                return 1
+        except KeyboardInterrupt:
+            return 0
+        if not args.forever:
+            return 0
+        time.sleep(args.retry)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,13 +2,153 @@ import pandas as pd
 import numpy as np
 import re
 import os
+import io
+import json
+import gzip
+import bz2
+import zipfile
 import tempfile
+import time
+import shutil
+import pickle
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import streamlit as st
 import logging
 
 # تنظیم لاگ برای دیباگ
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# فاصله‌ها و ویرگول‌های بین عناصر آرایه JSON
+_JSON_SEPARATORS = re.compile(r'[\s,]*')
+
+# پسوندهای فشرده‌سازی که به‌صورت جریانی باز می‌شوند
+_COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zst': 'zstd', '.zstd': 'zstd'}
+_SUPPORTED_FILE_TYPES = ['.csv', '.xlsx', '.xls', '.json', '.ndjson', '.jsonl']
+
+# بیشترین تعداد ردیف داده در یک شیت اکسل (یک ردیف برای سرستون‌ها)
+_EXCEL_MAX_ROWS = 1048575
+# اندازه تکه خواندن وقتی از روی بودجه حافظه محاسبه نمی‌شود
+_DEFAULT_READ_CHUNK_ROWS = 50000
+
+# ارقام فارسی و عربی و ممیز فارسی به معادل لاتین
+_DIGIT_TRANSLATION = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩٫', '01234567890123456789.')
+# جداکننده‌های هزارگان و فاصله در متن مبلغ
+_AMOUNT_SEPARATORS = re.compile(r'[,\u066c\u060c\s]')
+# نام واحد پول در متن مبلغ؛ واحد نوشته‌شده در خود مقدار بر واحد ستون یا پروفایل مقدم است
+_AMOUNT_UNIT_TOKENS = {
+    'toman': re.compile(r'تومان|toman|IRT', re.IGNORECASE),
+    'rial': re.compile(r'ریال|rial|IRR', re.IGNORECASE),
+}
+# ضریب تبدیل هر واحد به ریال (کوچک‌ترین واحد)
+_AMOUNT_UNITS = {'rial': 1, 'toman': 10}
+_DATE_TIME = re.compile(r'^\s*(\d{4})[/\-.](\d{1,2})[/\-.](\d{1,2})(?:[ T]+(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?)?')
+# سال‌های شکست تقویم جلالی (الگوریتم jalaali) و تعداد کبیسه‌های انباشته تا ابتدای هر بازه
+_JALALI_BREAKS = np.array([-61, 9, 38, 199, 426, 686, 756, 818, 1111, 1181, 1210, 1635, 2060, 2097, 2192, 2262,
+                           2324, 2394, 2456, 3178])
+_JALALI_LEAPS = np.concatenate([[-14], -14 + np.cumsum(np.diff(_JALALI_BREAKS) // 33 * 8
+                                                      + np.diff(_JALALI_BREAKS) % 33 // 4)])
+
+class RowSelection:
+    # انتخابی از ردیف‌های یک دیتافریم منبع (فقط موقعیت ردیف‌ها)؛ ردیف‌ها تنها هنگام نیاز ساخته می‌شوند
+    def __init__(self, source, positions):
+        self.source = source
+        self.positions = np.asarray(positions, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def empty(self):
+        return len(self.positions) == 0
+
+    @property
+    def columns(self):
+        return self.source.columns
+
+    @property
+    def shape(self):
+        return (len(self.positions), self.source.shape[1])
+
+    def head(self, n=5):
+        return self.page(0, n)
+
+    def page(self, start, stop):
+        return self.source.iloc[self.positions[start:stop]]
+
+    def materialize(self):
+        return self.source.iloc[self.positions]
+
+
+def materialize(df):
+    return df.materialize() if isinstance(df, RowSelection) else df
+
+
+def _write_workbook(sheets, output_path):
+    with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
+        for sheet_name, df in sheets:
+            if df is not None and not df.empty:
+                # جدول‌های بزرگ‌تر از سقف ردیف اکسل در چند شیت پشت سر هم نوشته می‌شوند
+                df = materialize(df)
+                for part, start in enumerate(range(0, len(df), _EXCEL_MAX_ROWS)):
+                    part_name = sheet_name if part == 0 else f"{sheet_name}_{part + 1}"
+                    df.iloc[start:start + _EXCEL_MAX_ROWS].to_excel(writer, sheet_name=part_name, index=False)
+                logging.info(f"Sheet {sheet_name} with {len(df)} records created")
+            else:
+                pd.DataFrame().to_excel(writer, sheet_name=sheet_name)
+                logging.warning(f"Sheet {sheet_name} is empty or not present")
+    return output_path
+
+
+def _write_report_part(df, output_path, file_format, sheet_name='Sheet1'):
+    # هر بخش بسته گزارش مستقل از بقیه در یک کارگر سریال می‌شود
+    if file_format == 'xlsx':
+        _write_workbook([(sheet_name, df)], output_path)
+    elif file_format == 'csv':
+        # با پسوند .gz فشرده‌سازی هم در همین کارگر انجام می‌شود
+        df.to_csv(output_path, index=False, encoding='utf-8-sig')
+    elif file_format == 'parquet':
+        # ستون‌های متنی با نوع مخلوط برای pyarrow به رشته تبدیل می‌شوند
+        mixed = {col: 'string' for col in df.columns if df[col].dtype == object}
+        df.astype(mixed).to_parquet(output_path, index=False)
+    else:
+        raise ValueError(f"Unsupported report part format: {file_format}")
+    return output_path
+
+
+class CodeBloomFilter:
+    # فیلتر Bloom فشرده روی کدهای پلتفرم؛ پاسخ منفی قطعی است و پاسخ مثبت با احتمال false_positive_rate اشتباه است.
+    # k اندیس هر کد با هش دوگانه (h1 + i * h2) از pd.util.hash_array ساخته می‌شود
+    def __init__(self, codes, false_positive_rate=0.01):
+        codes = np.asarray(codes, dtype=object)
+        count = max(len(codes), 1)
+        self.size = max(64, int(-count * np.log(false_positive_rate) / np.log(2) ** 2))
+        self.hash_count = max(1, int(round(self.size / count * np.log(2))))
+        self.words = np.zeros((self.size + 63) // 64, dtype=np.uint64)
+        if len(codes):
+            positions = self._positions(codes)
+            np.bitwise_or.at(self.words, positions >> np.uint64(6),
+                             np.left_shift(np.uint64(1), positions & np.uint64(63)))
+
+    def _positions(self, codes):
+        first = pd.util.hash_array(codes)
+        second = pd.util.hash_array(codes, hash_key='bloom-filter-h2!') | np.uint64(1)
+        steps = np.arange(self.hash_count, dtype=np.uint64)[:, None]
+        return ((first + steps * second) % np.uint64(self.size)).ravel()
+
+    def might_contain(self, codes):
+        codes = np.asarray(codes, dtype=object)
+        if not len(codes):
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(codes)
+        bits = (self.words[positions >> np.uint64(6)] >> (positions & np.uint64(63))) & np.uint64(1)
+        return bits.reshape(self.hash_count, len(codes)).all(axis=0)
+
+    @property
+    def nbytes(self):
+        return self.words.nbytes
+
+
 class SmartReconciliationSystem:
     def __init__(self):
         self.tracking_patterns = [
@@ -18,60 +158,704 @@ class SmartReconciliationSystem:
             r'wallex-[a-zA-Z0-9]+-[a-zA-Z0-9]+-[a-zA-Z0-9]+-[a-zA-Z0-9]+-[a-zA-Z0-9]+',
         ]
         self.platform_tracking_columns = ['gateway_tracking_code', 'gateway_identifier', 'meta_data_1']
-        self.chunk_size = 500  # اندازه تکه‌ها رو کم کردیم
+        # استخراج ساختاری ستون‌های پلتفرم: 'clean' (مقداری که تماماً با یکی از الگوها جور است خودش کد است و بقیه از regex می‌گذرند)،
+        # 'json' (مقدار مسیرهای نقطه‌دار paths داخل JSON؛ بدون paths فقط مقدارهای برگ با regex، نه کلیدها) و
+        # 'split' (جدا کردن شناسه ترکیبی با delimiter و انتخاب parts)؛ ستون‌های دیگر فقط با regex.
+        # پروفایل gateway با platform_extractors این تنظیم را ستون‌به‌ستون جایگزین می‌کند
+        self.platform_column_extractors = {
+            'gateway_tracking_code': {'type': 'clean'},
+            'meta_data_1': {'type': 'json'},
+        }
+        # واحد ترتیب استخراج: کد تکراری به اولین وقوع در ترتیب (تکه ۵۰۰ ردیفی، ستون، الگو، ردیف) نسبت داده می‌شود
+        self.chunk_size = 500
+        # تکه‌های پردازشی استخراج از روی بودجه حافظه (بایت) و حجم واقعی هر ردیف انتخاب می‌شوند
+        # و در طول اجرا بر اساس افزایش RSS در هر تکه بزرگ یا کوچک می‌شوند
+        self.adaptive_chunks = True
+        self.memory_budget = 512 * 1024 ** 2
+        self.max_chunk_rows = 200000
+        # تعداد ردیف هر تکه هنگام خواندن جریانی فایل؛ None یعنی از همان بودجه حافظه و نمونه ردیف‌های فایل
+        self.read_chunk_size = None
+        self._last_chunk_rows = None
+        self.excel_engine = 'auto'  # 'auto' یعنی calamine در صورت نصب بودن، وگرنه openpyxl
+        # تنظیمات اختصاصی هر gateway، مثلاً {'jibit': {'sheet_name': 'Transactions', 'header_row': 2}}؛
+        # کلیدهای استخراج: patterns (الگوهای همان gateway)، platform_columns، provider_columns و normalize ('upper' یا 'lower')
+        # و header_fingerprint (ستون‌هایی که صورتحساب این gateway را در پوشه پایش‌شده شناسایی می‌کنند)
+        # کلیدهای نرمال‌سازی: amount_column یا debit_column/credit_column، amount_unit ('rial' یا 'toman')،
+        # time_column، calendar ('auto'، 'jalali' یا 'gregorian') و timezone
+        generic_code, tr_code, trk_code, wallex_code = self.tracking_patterns
+        self.gateway_profiles = {
+            'jibit': {'patterns': [generic_code, tr_code, trk_code]},
+            'toman': {'patterns': [generic_code, tr_code, wallex_code]},
+        }
+        # موتور اجرا: 'pandas' (پیش‌فرض)، 'duckdb' برای فایل‌های بزرگ‌تر از حافظه یا 'polars' برای پردازش چندنخی
+        self.engine = 'pandas'
+        self.duckdb_memory_limit = '2GB'
+        self.duckdb_temp_directory = None
+        # بررسی هم‌خوانی موتورها: با مقدار بزرگ‌تر از صفر، پیش از اجرای duckdb یا polars همین تعداد ردیف اول
+        # با آن موتور و pandas اجرا و جدول‌های کد و تطابق مقایسه می‌شوند
+        self.engine_parity_rows = 0
+        # انباره تاریخچه نتایج (مثلاً ReconciliationResultsStore)؛ هر اجرا در صورت تنظیم به آن اضافه می‌شود
+        self.results_store = None
+        # پوشه ایندکس کدها (code_index.CodeIndex)؛ در صورت تنظیم، کدهای آخرین اجرای هر gateway بعد از هر اجرا
+        # ایندکس می‌شوند. ساخت ایندکس هزینه جدایی دارد؛ رابط کاربری آن را با build_code_index و به درخواست کاربر می‌سازد
+        self.code_index_directory = None
+        # نگه‌داشتن فایل پلتفرم پارس‌شده و کدهای هر gateway بین اجراها (تا وقتی فایل روی دیسک تغییر نکرده)
+        self.cache_platform = False
+        self._platform_cache = {}
+        # پوشه نقاط بازیابی؛ خروجی هر مرحله (پلتفرم، ارائه‌دهنده، تطابق‌ها) ذخیره می‌شود و اجرای دوباره
+        # با همان فایل‌ها و تنظیمات از آخرین مرحله کامل‌شده ادامه پیدا می‌کند؛ پس از پایان موفق اجرا پاک می‌شود
+        self.checkpoint_directory = None
+        self._digest_cache = {}
+        # کش کامل نتایج و گزارش (مثلاً result_cache.ResultCache)؛ درخواست تکراری با همان فایل‌ها و تنظیمات
+        # بدون اجرای دوباره پاسخ داده می‌شود
+        self.result_cache = None
+        # بسته گزارش (zip): بخش‌های هر شیت، کارنامه اکسل gateway و summary.json هم‌زمان در 'process' یا 'thread'
+        # ساخته می‌شوند؛ None یعنی به تعداد هسته‌ها
+        self.report_executor = 'process'
+        self.report_workers = None
+        # تطبیق شاردشده (فقط موتور pandas): با shard_count بزرگ‌تر از ۱ جدول‌های کد با هش کد تقسیم و هر شارد در یک
+        # کارگر تطبیق داده می‌شود؛ shard_local_workers=0 یعنی فقط کارگرهای میزبان‌های دیگر روی shard_address.
+        # پیام‌ها pickle هستند؛ shard_address غیر loopback فقط با shard_authkey صریح پذیرفته می‌شود و بدون آن
+        # برای هر اجرا کلید تصادفی ساخته می‌شود
+        self.shard_count = 0
+        self.shard_address = ('127.0.0.1', 0)
+        self.shard_authkey = None
+        self.shard_local_workers = None
+        # افزودن ستون‌های amount_minor (ریال، عدد صحیح) و timestamp_utc (نانوثانیه از ۱۹۷۰ به UTC) به فایل ارائه‌دهنده؛
+        # ستون‌ها، واحد مبلغ، تقویم و منطقه زمانی از پروفایل gateway خوانده یا از نام ستون‌ها حدس زده می‌شوند
+        self.normalize_values = True
+        self.default_timezone = 'Asia/Tehran'
+        # بررسی جفت‌های منطبق: مبلغ، وضعیت و فاصله زمانی پلتفرم و ارائه‌دهنده؛ ستون‌های پلتفرم از میان این نام‌ها
+        # یا کلیدهای platform_amount_column، platform_status_column و platform_time_column پروفایل انتخاب می‌شوند
+        self.verify_pairs = True
+        self.platform_verification_columns = {'amount': ['amount'], 'status': ['status'],
+                                              'time': ['created_at', 'date', 'time']}
+        self.amount_tolerance = 0  # ریال
+        self.settlement_window = 24 * 3600  # ثانیه
+        # امتیاز اطمینان هر تطابق و نگه داشتن بهترین تطابق هر ردیف ارائه‌دهنده؛ بقیه نامزدها در candidate_matches
+        # می‌مانند. وزن الگو برای الگوهای ناشناخته unknown_pattern_weight و وزن ستون از column_weights پروفایل
+        # یا نام ستون (ref، track، id، code و ...) می‌آید
+        self.score_matches = True
+        self.match_score_weights = {'column': 0.25, 'pattern': 0.25, 'uniqueness': 0.2, 'amount': 0.3}
+        self.pattern_weights = {
+            generic_code: 0.3, tr_code: 0.7, trk_code: 0.7, wallex_code: 1.0,
+            'clean': 0.9, 'json': 0.9, 'split': 0.8,
+        }
+        self.unknown_pattern_weight = 0.5
+        self.success_statuses = {'success', 'successful', 'succeeded', 'paid', 'settled', 'completed', 'done', 'ok',
+                                 'موفق', 'پرداخت شده', 'تسویه شده', '1', 'true'}
+        # الگوهای کامپایل‌شده بر اساس فهرست الگوها؛ هر الگو فقط یک بار کامپایل می‌شود
+        self._regex_cache = {}
+        # حالت پروفایل: زمان، ردیف‌های پویش‌شده و کدهای یافته‌شده برای هر (سمت، ستون، الگو)
+        self.profile_patterns = False
+        self._pattern_stats = {}
+        # پیش‌فیلتر: فقط توکن‌هایی از ارائه‌دهنده نگه داشته می‌شوند که از فیلتر Bloom کدهای پلتفرم عبور کنند؛
+        # تطابق‌ها تغییری نمی‌کنند ولی کدهای «فقط در فایل 2» که قطعاً تطابق ندارند ذخیره نمی‌شوند
+        self.prefilter_provider = False
+        self.prefilter_false_positive_rate = 0.01
 
     def detect_file_type(self, file_path):
-        _, ext = os.path.splitext(file_path)
+        base, ext = os.path.splitext(file_path)
+        if ext.lower() in _COMPRESSION_EXTENSIONS:
+            # مثلاً statement.csv.gz از نوع .csv است
+            _, ext = os.path.splitext(base)
         return ext.lower()
 
-    def read_file(self, file_path, columns=None, nrows=None):
+    def detect_compression(self, file_path):
+        _, ext = os.path.splitext(file_path)
+        return _COMPRESSION_EXTENSIONS.get(ext.lower())
+
+    def _decompress(self, source, compression):
+        # source مسیر فایل یا جریان باینری است؛ خروجی جریانی است که در حین خواندن از حالت فشرده خارج می‌شود
+        if compression == 'gzip':
+            return gzip.open(source, 'rb')
+        if compression == 'bz2':
+            return bz2.open(source, 'rb')
+        if isinstance(source, str):
+            source = open(source, 'rb')
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                source.close()
+                raise ValueError("Reading .zst files requires the 'zstandard' package")
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(source, closefd=True))
+        return source
+
+    def _iter_sources(self, file_path):
+        # هر منبع یک (نام، تابع بازکننده جریان باینری، مسیر روی دیسک یا None) است؛
+        # همه اعضای یک zip یک صورتحساب منطقی واحد حساب می‌شوند
+        if self.detect_file_type(file_path) != '.zip':
+            compression = self.detect_compression(file_path)
+            yield file_path, lambda: self._decompress(file_path, compression), None if compression else file_path
+            return
+
+        with zipfile.ZipFile(file_path) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                    continue
+                if self.detect_file_type(name) not in _SUPPORTED_FILE_TYPES:
+                    logging.warning(f"Skipping unsupported archive member: {name}")
+                    continue
+                compression = self.detect_compression(name)
+                yield name, lambda info=info, compression=compression: \
+                    self._decompress(archive.open(info), compression), None
+
+    def _excel_engine(self):
+        if self.excel_engine != 'auto':
+            return self.excel_engine
+        try:
+            import python_calamine  # noqa: F401
+            return 'calamine'
+        except ImportError:
+            return None
+
+    def _gateway_profile(self, gateway_name=None):
+        return self.gateway_profiles.get(str(gateway_name).lower(), {}) if gateway_name else {}
+
+    def gateway_extractors(self, gateway_name=None):
+        # استخراج‌کننده‌های یک gateway؛ هر چیزی که در پروفایل تعریف نشده از تنظیمات عمومی می‌آید
+        profile = self._gateway_profile(gateway_name)
+        patterns = list(profile.get('patterns') or self.tracking_patterns)
+        normalize = profile.get('normalize')
+        if normalize not in (None, 'upper', 'lower'):
+            raise ValueError(f"Unknown code normalization for gateway '{gateway_name}': {normalize}")
+        platform_extractors = {**self.platform_column_extractors, **(profile.get('platform_extractors') or {})}
+        platform_extractors = {col: spec for col, spec in platform_extractors.items()
+                               if spec and spec.get('type', 'regex') != 'regex'}
+        # برچسب الگوی کدهای ساختاری بعد از الگوهای regex در دسته‌های ستون pattern می‌آید
+        labels = list(patterns)
+        for col, spec in platform_extractors.items():
+            if spec['type'] not in ('clean', 'json', 'split'):
+                raise ValueError(f"Unknown extractor type for column '{col}': {spec['type']}")
+            labels += self._extractor_labels(spec)
+        return {
+            'patterns': patterns,
+            'regexes': self._compile_patterns(patterns),
+            'platform_columns': list(profile.get('platform_columns') or self.platform_tracking_columns),
+            'provider_columns': profile.get('provider_columns'),
+            'normalize': normalize,
+            'platform_extractors': platform_extractors,
+            'labels': list(dict.fromkeys(labels)),
+        }
+
+    def _extractor_labels(self, spec):
+        if spec['type'] == 'json':
+            return [f"json:{path}" for path in spec.get('paths') or []]
+        if spec['type'] == 'split':
+            return [f"split:{spec.get('delimiter', '|')}"]
+        return ['clean']
+
+    def platform_columns(self, gateway_name=None):
+        # ستون‌هایی که از فایل پلتفرم خوانده می‌شوند: ستون‌های کد، gateway و ستون‌های بررسی جفت‌ها
+        profile = self._gateway_profile(gateway_name)
+        columns = self.gateway_extractors(gateway_name)['platform_columns'] + ['gateway']
+        if self.verify_pairs:
+            for field, names in self.platform_verification_columns.items():
+                configured = profile.get(f'platform_{field}_column')
+                columns += [configured] if configured else names
+        return list(dict.fromkeys(columns))
+
+    def _compile_patterns(self, patterns):
+        key = tuple(patterns)
+        if key not in self._regex_cache:
+            self._regex_cache[key] = [re.compile(f'({pattern})') for pattern in patterns]
+        return self._regex_cache[key]
+
+    def _excel_options(self, gateway_name=None):
+        profile = self._gateway_profile(gateway_name)
+        return {
+            'sheet_name': profile.get('sheet_name', 0),
+            'header': profile.get('header_row', 0),
+        }
+
+    def _read_csv(self, file_path, **kwargs):
+        try:
+            return pd.read_csv(file_path, encoding='utf-8', **kwargs)
+        except UnicodeDecodeError:
+            return pd.read_csv(file_path, encoding='windows-1256', **kwargs)
+
+    def _usecols(self, columns):
+        # ستون‌های درخواستی که در فایل نیستند (مثلاً ستون‌های اختیاری بررسی مبلغ) نادیده گرفته می‌شوند
+        if not columns:
+            return None
+        wanted = set(columns)
+        return lambda name: name in wanted
+
+    def read_file(self, file_path, columns=None, nrows=None, gateway_name=None):
         file_type = self.detect_file_type(file_path)
         logging.info(f"Reading file: {file_path}, type: {file_type}")
-        if file_type == '.csv':
+        if file_type in ['.zip', '.json', '.ndjson', '.jsonl'] or self.detect_compression(file_path):
+            chunks = list(self.iter_file_chunks(file_path, columns=columns, nrows=nrows, gateway_name=gateway_name))
+            return pd.concat(chunks) if chunks else pd.DataFrame(columns=columns)
+        elif file_type == '.csv':
+            return self._read_csv(file_path, usecols=self._usecols(columns), nrows=nrows)
+        elif file_type in ['.xlsx', '.xls']:
+            options = self._excel_options(gateway_name)
+            return pd.read_excel(file_path, engine=self._excel_engine(), sheet_name=options['sheet_name'],
+                                 header=options['header'], usecols=self._usecols(columns), nrows=nrows)
+        else:
+            raise ValueError(f"Unsupported file format: {file_type}")
+
+    def _iter_csv_chunks(self, opener, columns=None, nrows=None, chunksize=None):
+        start = 0
+        for encoding in ['utf-8', 'windows-1256']:
             try:
-                return pd.read_csv(file_path, encoding='utf-8', usecols=columns if columns else None, nrows=nrows)
+                # اگر خطای encoding وسط فایل رخ دهد، جریان را دوباره باز کرده و ردیف‌های خوانده‌شده را رد می‌کنیم
+                with opener() as handle:
+                    reader = pd.read_csv(handle, encoding=encoding, usecols=self._usecols(columns),
+                                         nrows=nrows, chunksize=chunksize, skiprows=range(1, start + 1))
+                    for chunk in reader:
+                        chunk.index = pd.RangeIndex(start, start + len(chunk))
+                        start += len(chunk)
+                        yield chunk
+                return
             except UnicodeDecodeError:
-                return pd.read_csv(file_path, encoding='windows-1256', usecols=columns if columns else None, nrows=nrows)
+                if encoding == 'windows-1256':
+                    raise
+                if nrows is not None:
+                    nrows -= start
+
+    def _iter_excel_rows(self, source, sheet_name=0):
+        if self._excel_engine() == 'calamine':
+            from python_calamine import CalamineWorkbook
+            if isinstance(source, str):
+                workbook = CalamineWorkbook.from_path(source)
+            else:
+                workbook = CalamineWorkbook.from_filelike(source)
+            try:
+                if isinstance(sheet_name, int):
+                    sheet = workbook.get_sheet_by_index(sheet_name)
+                else:
+                    sheet = workbook.get_sheet_by_name(sheet_name)
+                yield from sheet.iter_rows()
+            finally:
+                workbook.close()
+        else:
+            from openpyxl import load_workbook
+            workbook = load_workbook(source, read_only=True, data_only=True)
+            try:
+                sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+                yield from sheet.iter_rows(values_only=True)
+            finally:
+                workbook.close()
+
+    def _iter_excel_chunks(self, source, file_type, columns=None, nrows=None, chunksize=None, sheet_name=0, header=0):
+        if file_type == '.xls' and self._excel_engine() != 'calamine':
+            # openpyxl فایل‌های xls قدیمی را پشتیبانی نمی‌کند؛ کل شیت را می‌خوانیم و تکه‌تکه برمی‌گردانیم
+            df = pd.read_excel(source, sheet_name=sheet_name, header=header,
+                               usecols=self._usecols(columns), nrows=nrows)
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+            return
+
+        rows = self._iter_excel_rows(source, sheet_name)
+        for _ in range(header):
+            next(rows, None)
+        header_cells = next(rows, None)
+        if header_cells is None:
+            return
+        names = [str(name) if name not in (None, '') else f'Unnamed: {i}' for i, name in enumerate(header_cells)]
+        positions = [i for i, name in enumerate(names) if not columns or name in columns]
+        selected = [names[i] for i in positions]
+
+        start = 0
+        buffer = []
+        for row in rows:
+            if nrows is not None and start + len(buffer) >= nrows:
+                break
+            # calamine سلول خالی را '' برمی‌گرداند؛ مثل read_file خالی در نظر گرفته می‌شود
+            buffer.append([row[i] if i < len(row) and row[i] != '' else None for i in positions])
+            if len(buffer) >= chunksize:
+                yield pd.DataFrame(buffer, columns=selected, index=pd.RangeIndex(start, start + len(buffer)))
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=selected, index=pd.RangeIndex(start, start + len(buffer)))
+
+    def _iter_json_array(self, handle, buffer_size=1 << 20):
+        # پارس تدریجی آرایه JSON سطح بالا؛ در هر لحظه فقط یک بافر از فایل در حافظه است
+        decoder = json.JSONDecoder()
+        buffer = handle.read(buffer_size)
+        pos = _JSON_SEPARATORS.match(buffer).end()
+        if buffer[pos:pos + 1] != '[':
+            raise ValueError("Expected a top-level JSON array")
+        pos += 1
+        eof = False
+        while True:
+            pos = _JSON_SEPARATORS.match(buffer, pos).end()
+            if buffer[pos:pos + 1] == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                if end == len(buffer) and not eof:
+                    # ممکن است عدد یا مقدار انتهای بافر ناقص باشد
+                    raise ValueError("Record may be truncated")
+            except ValueError:
+                if eof:
+                    raise ValueError("Malformed or truncated JSON array")
+                more = handle.read(buffer_size)
+                eof = not more
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            yield record
+            pos = end
+
+    def _iter_json_records(self, handle, file_type):
+        if file_type in ['.ndjson', '.jsonl']:
+            for line in handle:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        reader = handle if hasattr(handle, 'peek') else io.BufferedReader(handle)
+        head = reader.peek(64)[:64].lstrip(b'\xef\xbb\xbf \t\r\n')
+        if not head.startswith(b'['):
+            # شیء تکی (غیر آرایه) مثل قبل یکجا خوانده می‌شود
+            data = json.load(io.TextIOWrapper(reader, encoding='utf-8-sig'))
+            yield from (data if isinstance(data, list) else [data])
+            return
+
+        try:
+            import ijson
+        except ImportError:
+            yield from self._iter_json_array(io.TextIOWrapper(reader, encoding='utf-8-sig'))
+            return
+        yield from ijson.items(reader, 'item', use_float=True)
+
+    def _select_json_fields(self, record, fields):
+        selected = {}
+        for field in fields:
+            value = record
+            for key in field.split('.'):
+                value = value.get(key) if isinstance(value, dict) else None
+            selected[field] = value
+        return selected
+
+    def _iter_json_chunks(self, opener, file_type, columns=None, nrows=None, chunksize=None, gateway_name=None):
+        profile = self._gateway_profile(gateway_name)
+        # فقط فیلدهای مرتبط با کد رهگیری (مسیرهای نقطه‌دار مثل 'payment.ref') صاف می‌شوند
+        fields = columns or profile.get('json_fields')
+
+        def build_chunk(records, start):
+            if fields:
+                df = pd.DataFrame([self._select_json_fields(record, fields) for record in records], columns=fields)
+            else:
+                df = pd.json_normalize(records)
+            df.index = pd.RangeIndex(start, start + len(df))
+            return df
+
+        start = 0
+        records = []
+        with opener() as handle:
+            for record in self._iter_json_records(handle, file_type):
+                if nrows is not None and start + len(records) >= nrows:
+                    break
+                records.append(record)
+                if len(records) >= chunksize:
+                    yield build_chunk(records, start)
+                    start += len(records)
+                    records = []
+        if records:
+            yield build_chunk(records, start)
+
+    def _iter_source_chunks(self, name, opener, path, columns=None, nrows=None, chunksize=None, gateway_name=None):
+        file_type = self.detect_file_type(name)
+        if file_type == '.csv':
+            yield from self._iter_csv_chunks(opener, columns=columns, nrows=nrows, chunksize=chunksize)
         elif file_type in ['.xlsx', '.xls']:
-            return pd.read_excel(file_path, usecols=columns if columns else None, nrows=nrows)
-        elif file_type == '.json':
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return pd.DataFrame(data) if isinstance(data, list) else pd.json_normalize(data)
+            options = self._excel_options(gateway_name)
+            if path is None:
+                # فایل اکسل خودش zip است و دسترسی تصادفی لازم دارد؛ فقط همین عضو در حافظه باز می‌شود
+                with opener() as handle:
+                    source = io.BytesIO(handle.read())
+            else:
+                source = path
+            yield from self._iter_excel_chunks(source, file_type, columns=columns, nrows=nrows, chunksize=chunksize,
+                                               sheet_name=options['sheet_name'], header=options['header'])
+        elif file_type in ['.json', '.ndjson', '.jsonl']:
+            yield from self._iter_json_chunks(opener, file_type, columns=columns, nrows=nrows, chunksize=chunksize,
+                                              gateway_name=gateway_name)
         else:
             raise ValueError(f"Unsupported file format: {file_type}")
 
-    def extract_potential_tracking_codes(self, df, is_platform=False):
-        tracking_codes = []
-        columns_to_check = self.platform_tracking_columns if is_platform else df.columns
+    def _read_chunk_rows(self, file_path, columns=None, gateway_name=None):
+        # اندازه تکه خواندن از بودجه حافظه و حجم ۱۰۰۰ ردیف اول فایل؛ xls قدیمی برای نمونه هم کامل خوانده می‌شد
+        if not self.adaptive_chunks or self.detect_file_type(file_path) == '.xls':
+            return _DEFAULT_READ_CHUNK_ROWS
+        sample = next(self.iter_file_chunks(file_path, columns=columns, nrows=1000, chunksize=1000,
+                                            gateway_name=gateway_name), None)
+        return _DEFAULT_READ_CHUNK_ROWS if sample is None else self._initial_chunk_rows(sample)
+
+    def iter_file_chunks(self, file_path, columns=None, nrows=None, chunksize=None, gateway_name=None):
+        chunksize = chunksize or self.read_chunk_size or self._read_chunk_rows(file_path, columns, gateway_name)
+        logging.info(f"Streaming file: {file_path}, type: {self.detect_file_type(file_path)}, chunk size: {chunksize}")
+        start = 0
+        for name, opener, path in self._iter_sources(file_path):
+            remaining = None if nrows is None else nrows - start
+            if remaining is not None and remaining <= 0:
+                break
+            for chunk in self._iter_source_chunks(name, opener, path, columns=columns, nrows=remaining,
+                                                  chunksize=chunksize, gateway_name=gateway_name):
+                # شماره ردیف‌ها در کل منبع (همه اعضای آرشیو) پیوسته است
+                chunk.index = pd.RangeIndex(start, start + len(chunk))
+                start += len(chunk)
+                yield chunk
+
+    def extract_codes_from_file(self, file_path, is_platform=False, columns=None, nrows=None, gateway_name=None,
+                                code_filter=None):
+        # استخراج کدها همزمان با خواندن هر تکه شروع می‌شود و منتظر پارس کامل فایل نمی‌ماند
+        frames = []
+        code_tables = []
+        scanned = 0
+        chunk_rows = None
+        for chunk in self.iter_file_chunks(file_path, columns=columns, nrows=nrows, gateway_name=gateway_name):
+            # اندازه تکه پردازشی تطبیق‌یافته از تکه قبلی ادامه پیدا می‌کند و برای هر تکه خوانده‌شده از نو شروع نمی‌شود
+            table = self.extract_potential_tracking_codes(chunk, is_platform=is_platform, gateway_name=gateway_name,
+                                                          chunk_rows=chunk_rows)
+            chunk_rows = self._last_chunk_rows
+            if not is_platform:
+                # ستون‌های نرمال‌شده بعد از استخراج کد اضافه می‌شوند تا خودشان کد حساب نشوند
+                chunk = self.normalize_provider_columns(chunk, gateway_name)
+            frames.append(chunk)
+            scanned += len(table)
+            if code_filter is not None and not table.empty:
+                table = table[code_filter.might_contain(table['code'])]
+            code_tables.append(table)
+
+        df = pd.concat(frames) if frames else pd.DataFrame()
+        codes = pd.concat(code_tables, ignore_index=True) if code_tables \
+            else self._empty_code_table(patterns=self.gateway_extractors(gateway_name)['labels'])
+        if not codes.empty:
+            codes = codes.drop_duplicates(subset=['code']).reset_index(drop=True)
+            codes['column'] = codes['column'].astype('category')
+            codes['pattern'] = codes['pattern'].astype('category')
+        if code_filter is not None:
+            logging.info(f"Prefilter kept {sum(len(table) for table in code_tables)} of {scanned} candidate codes")
+        logging.info(f"Streamed {len(df)} rows and extracted {len(codes)} unique codes from {file_path}")
+        return df, codes
+
+    def _code_dtype(self):
+        try:
+            import pyarrow  # noqa: F401
+            return 'string[pyarrow]'
+        except ImportError:
+            return object
+
+    def _empty_code_table(self, columns=(), patterns=None):
+        return pd.DataFrame({
+            'code': pd.array([], dtype=self._code_dtype()),
+            'column': pd.Categorical([], categories=list(columns)),
+            'row_index': np.array([], dtype=np.int32),
+            'pattern': pd.Categorical([], categories=list(patterns or self.tracking_patterns)),
+        })
+
+    def _build_code_table(self, codes, column_ids, row_ids, pattern_ids, columns, patterns=None):
+        return pd.DataFrame({
+            'code': pd.array(np.asarray(codes, dtype=object), dtype=self._code_dtype()),
+            'column': pd.Categorical.from_codes(np.asarray(column_ids), categories=list(columns)),
+            'row_index': np.asarray(row_ids).astype(np.int32),
+            'pattern': pd.Categorical.from_codes(np.asarray(pattern_ids),
+                                                 categories=list(patterns or self.tracking_patterns)),
+        })
+
+    def _memory_usage(self):
+        # RSS فعلی با psutil، وگرنه از /proc در لینوکس؛ در غیر این صورت None و تطبیق اندازه تکه‌ها غیرفعال است.
+        # بیشینه RSS (ru_maxrss) کاهش پیدا نمی‌کند و بعد از یک تکه بزرگ همه تکه‌های بعدی را کوچک نگه می‌داشت
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss
+        except ImportError:
+            pass
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError, AttributeError):
+            return None
+
+    def _clamp_chunk_rows(self, rows):
+        return int(max(self.chunk_size, min(self.max_chunk_rows, rows)))
+
+    def _initial_chunk_rows(self, df):
+        if not self.adaptive_chunks or df.empty:
+            return self.chunk_size
+        sample = df.iloc[:1000]
+        bytes_per_row = sample.memory_usage(deep=True, index=False).sum() / len(sample)
+        # متن هر ستون و خروجی extractall کنار داده اصلی ساخته می‌شوند؛ ضریب ۴ حاشیه این نسخه‌های موقت است
+        return self._clamp_chunk_rows(self.memory_budget / max(bytes_per_row * 4, 1))
+
+    def _adapt_chunk_rows(self, rows, before):
+        # before همان RSS درست پیش از تکه است؛ کدهای نگه‌داشته‌شده تکه‌های قبلی و حافظه‌ای که malloc به سیستم
+        # برنگردانده در آن هست و در افزایش همین تکه حساب نمی‌شود
+        if not self.adaptive_chunks or before is None:
+            return rows
+        used = self._memory_usage() - before
+        if used > self.memory_budget:
+            logging.info(f"Chunk of {rows} rows grew memory by {used} bytes, over budget; shrinking")
+            return self._clamp_chunk_rows(rows // 2)
+        if used < self.memory_budget / 2:
+            return self._clamp_chunk_rows(rows * 2)
+        return rows
+
+    def extract_potential_tracking_codes(self, df, is_platform=False, gateway_name=None, chunk_rows=None):
+        # فقط الگوها و ستون‌های پروفایل همین gateway اجرا می‌شوند
+        extractors = self.gateway_extractors(gateway_name)
+        labels = extractors['labels']
+        structural = extractors['platform_extractors'] if is_platform else {}
+        if is_platform:
+            columns_to_check = extractors['platform_columns']
+        else:
+            columns_to_check = extractors['provider_columns'] or df.columns
         columns_to_check = [col for col in columns_to_check if col in df.columns]
-        logging.info(f"Extracting codes from {len(df)} rows, columns: {columns_to_check}")
-
-        for start in range(0, len(df), self.chunk_size):
-            chunk = df.iloc[start:start + self.chunk_size]
-            for col in columns_to_check:
-                chunk[col] = chunk[col].astype(str).fillna('')
-                for pattern in self.tracking_patterns:
-                    matches = chunk[col].str.extractall(f'({pattern})')[0].unique()
-                    for match in matches:
-                        rows = chunk[chunk[col].str.contains(match, regex=False, na=False)].index
-                        for idx in rows:
-                            tracking_codes.append({
-                                'code': match,
-                                'column': col,
-                                'row_index': idx,
-                                'original_text': chunk.loc[idx, col]
-                            })
-
-        result = pd.DataFrame(tracking_codes).drop_duplicates(subset=['code'])
-        logging.info(f"Extracted {len(result)} unique codes")
+        logging.info(f"Extracting codes from {len(df)} rows, columns: {columns_to_check}, "
+                     f"patterns: {len(extractors['patterns'])}")
+
+        # جدول کدها به‌صورت ستونی ساخته می‌شود: کد، شماره ستون (categorical) و اندیس ردیف (int32)؛
+        # متن اصلی سلول ذخیره نمی‌شود و در صورت نیاز با resolve_original_text از دیتافریم منبع خوانده می‌شود
+        codes, column_ids, positions, occurrences, pattern_ids = [], [], [], [], []
+        side = 'platform' if is_platform else 'provider'
+        chunk_rows = chunk_rows or self._initial_chunk_rows(df)
+        start = 0
+        while start < len(df):
+            before = self._memory_usage() if self.adaptive_chunks else None
+            chunk = df.iloc[start:start + chunk_rows]
+            chunk_positions = pd.RangeIndex(start, start + len(chunk))
+            for column_id, col in enumerate(columns_to_check):
+                values = chunk[col].astype(str).fillna('').set_axis(chunk_positions)
+                found_parts = []
+                if col in structural:
+                    # کدهای ساختاری مستقیم برداشته می‌شوند و فقط مقدارهای باقی‌مانده از regex می‌گذرند
+                    started = time.perf_counter()
+                    structured, values = self._structural_codes(values, chunk[col].notna().to_numpy(),
+                                                                structural[col], extractors['regexes'])
+                    for label, found in structured:
+                        if self.profile_patterns:
+                            stats = self._pattern_stats.setdefault((side, col, label), [0.0, 0, 0])
+                            stats[0] += (time.perf_counter() - started) / len(structured)
+                            stats[1] += len(chunk)
+                            stats[2] += len(found)
+                        found_parts.append((labels.index(label), found))
+                for pattern_id, regex in enumerate(extractors['regexes']):
+                    started = time.perf_counter()
+                    found = values.str.extractall(regex)[0] if len(values) else pd.Series([], dtype=object)
+                    if self.profile_patterns:
+                        stats = self._pattern_stats.setdefault((side, col, extractors['patterns'][pattern_id]), [0.0, 0, 0])
+                        stats[0] += time.perf_counter() - started
+                        stats[1] += len(values)
+                        stats[2] += len(found)
+                    found_parts.append((pattern_id, found))
+                for pattern_id, found in found_parts:
+                    if found.empty:
+                        continue
+                    if extractors['normalize'] == 'upper':
+                        found = found.str.upper()
+                    elif extractors['normalize'] == 'lower':
+                        found = found.str.lower()
+                    codes.append(found.to_numpy(dtype=object))
+                    positions.append(found.index.get_level_values(0).to_numpy())
+                    occurrences.append(found.index.get_level_values(1).to_numpy())
+                    column_ids.append(np.full(len(found), column_id, dtype=np.int16))
+                    pattern_ids.append(np.full(len(found), pattern_id, dtype=np.int8))
+            start += len(chunk)
+            chunk_rows = self._adapt_chunk_rows(chunk_rows, before)
+        self._last_chunk_rows = chunk_rows
+
+        if not codes:
+            result = self._empty_code_table(columns_to_check, labels)
+        else:
+            # اندازه تکه پردازشی روی نتیجه اثری ندارد: کدها به ترتیب واحد chunk_size مرتب و بعد یکتا می‌شوند
+            positions, occurrences = np.concatenate(positions), np.concatenate(occurrences)
+            column_ids, pattern_ids = np.concatenate(column_ids), np.concatenate(pattern_ids)
+            order = np.lexsort((occurrences, positions, pattern_ids, column_ids, positions // self.chunk_size))
+            result = self._build_code_table(np.concatenate(codes)[order], column_ids[order],
+                                            df.index.to_numpy()[positions[order]], pattern_ids[order],
+                                            columns_to_check, labels)
+        result = result.drop_duplicates(subset=['code']).reset_index(drop=True)
+        logging.info(f"Extracted {len(result)} unique codes ({result.memory_usage(deep=True).sum()} bytes)")
         return result
 
-    def extract_codes_from_platform(self, df):
-        return self.extract_potential_tracking_codes(df, is_platform=True)
+    def _json_value(self, text):
+        try:
+            return json.loads(text)
+        except ValueError:
+            return None
+
+    def _json_leaves(self, value):
+        if isinstance(value, dict):
+            for item in value.values():
+                yield from self._json_leaves(item)
+        elif isinstance(value, list):
+            for item in value:
+                yield from self._json_leaves(item)
+        elif value is not None and not isinstance(value, bool):
+            yield str(value)
+
+    def _structural_codes(self, values, present, spec, regexes=()):
+        # خروجی: فهرست (برچسب، کدها با اندیس (موقعیت، ترتیب وقوع)) و مقدارهایی که هنوز باید از regex بگذرند
+        empty = values.iloc[:0]
+        if spec['type'] == 'clean':
+            # فقط سلولی که تماماً با یکی از الگوهای همین gateway جور است خود کد حساب می‌شود؛
+            # مقدارهایی مثل ABC-12345678 یا PAY_987654321 همچنان از مسیر regex می‌گذرند
+            stripped = values.str.strip()
+            clean = np.zeros(len(values), dtype=bool)
+            for regex in regexes:
+                clean |= stripped.str.fullmatch(regex).fillna(False).to_numpy(dtype=bool)
+            clean &= present
+            found = stripped[clean]
+            found.index = pd.MultiIndex.from_arrays([found.index, np.zeros(len(found), dtype=np.int64)])
+            return [('clean', found)], values[~clean]
+
+        if spec['type'] == 'split':
+            parts = values[present].str.split(spec.get('delimiter', '|'), regex=False, expand=True)
+            if spec.get('parts') is not None:
+                parts = parts.reindex(columns=spec['parts'])
+            found = parts.stack().dropna().astype(str).str.strip()
+            found = found[found != '']
+            return [(self._extractor_labels(spec)[0], found)], empty
+
+        # json: فقط سلول‌هایی که با { یا [ شروع می‌شوند پارس می‌شوند؛ بقیه (و JSON نامعتبر) مثل قبل از regex می‌گذرند
+        candidates = values[present & values.str.lstrip().str[:1].isin(['{', '[']).to_numpy(dtype=bool)]
+        parsed = candidates.map(self._json_value).dropna()
+        rest = values[~values.index.isin(parsed.index)]
+        paths = spec.get('paths')
+        if not paths:
+            # بدون مسیر مشخص فقط مقدارهای برگ (نه کلیدها) جست‌وجو می‌شوند
+            leaves = parsed.map(lambda value: ' '.join(self._json_leaves(value)))
+            return [], pd.concat([rest, leaves]).sort_index()
+        structured = []
+        for label, path in zip(self._extractor_labels(spec), paths):
+            selected = parsed.map(lambda value: list(self._json_leaves(
+                self._select_json_fields(value, [path])[path] if isinstance(value, dict) else None)))
+            found = selected.explode().dropna().astype(str).str.strip()
+            found = found[found != '']
+            found.index = pd.MultiIndex.from_arrays([found.index, found.groupby(level=0).cumcount().to_numpy()])
+            structured.append((label, found))
+        return structured, rest
 
-    def extract_codes_from_provider(self, df):
-        return self.extract_potential_tracking_codes(df, is_platform=False)
+    def resolve_original_text(self, codes, source_df, suffix=''):
+        # متن کامل سلول منبع را فقط برای ردیف‌هایی که نمایش یا گزارش می‌شوند می‌سازد
+        column_key, row_key = f'column{suffix}', f'row_index{suffix}'
+        text = np.full(len(codes), None, dtype=object)
+        if codes.empty or source_df is None:
+            return codes.assign(**{f'original_text{suffix}': text})
+
+        positions = source_df.index.get_indexer(codes[row_key].to_numpy())
+        column_names = codes[column_key].astype(object).to_numpy()
+        for name in pd.unique(column_names):
+            if name not in source_df.columns:
+                continue
+            mask = (column_names == name) & (positions >= 0)
+            text[mask] = source_df[name].to_numpy()[positions[mask]]
+        return codes.assign(**{f'original_text{suffix}': text})
+
+    def extract_codes_from_platform(self, df, gateway_name=None):
+        return self.extract_potential_tracking_codes(df, is_platform=True, gateway_name=gateway_name)
+
+    def extract_codes_from_provider(self, df, gateway_name=None):
+        return self.extract_potential_tracking_codes(df, is_platform=False, gateway_name=gateway_name)
 
     def find_exact_matches(self, codes1, codes2):
         if codes1.empty or codes2.empty:
@@ -91,24 +875,246 @@ class SmartReconciliationSystem:
 
         return matches, non_matches
 
-    def gateway_specific_reconciliation(self, platform_path, provider_path, gateway_name, nrows=None):
-        platform_df = self.read_file(platform_path, columns=self.platform_tracking_columns + ['gateway'], nrows=nrows)
-        logging.info(f"Platform data loaded with shape: {platform_df.shape}")
-        provider_df = self.read_file(provider_path, nrows=nrows)
-        logging.info(f"Provider data loaded with shape: {provider_df.shape}")
+    def find_matches(self, codes1, codes2):
+        if self.shard_count > 1:
+            from sharded_reconciliation import ShardCoordinator
+            coordinator = ShardCoordinator(self.shard_count, address=self.shard_address, authkey=self.shard_authkey,
+                                           local_workers=self.shard_local_workers)
+            return coordinator.reconcile(codes1, codes2)
+        return self.find_exact_matches(codes1, codes2)
+
+    def file_digest(self, file_path):
+        # هش محتوای فایل؛ تا وقتی اندازه و زمان تغییر فایل ثابت است دوباره محاسبه نمی‌شود
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        if key not in self._digest_cache:
+            digest = hashlib.blake2b(digest_size=16)
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            self._digest_cache[key] = digest.hexdigest()
+        return self._digest_cache[key]
+
+    def run_config(self, gateway_name, nrows=None, engine=None):
+        # همه تنظیماتی که روی خروجی اثر دارند؛ برای کلید نقاط بازیابی و کش نتایج
+        extractors = self.gateway_extractors(gateway_name)
+        return {
+            'gateway': str(gateway_name).lower(),
+            'nrows': nrows,
+            'engine': engine or self.engine,
+            'patterns': extractors['patterns'],
+            'platform_columns': extractors['platform_columns'],
+            'provider_columns': extractors['provider_columns'],
+            'normalize': extractors['normalize'],
+            'platform_extractors': extractors['platform_extractors'],
+            # کل پروفایل gateway (از جمله column_weights)، تا کلید با افزودن تنظیم تازه به پروفایل از قلم نیفتد
+            'profile': self._gateway_profile(gateway_name),
+            'normalize_values': self.normalize_values,
+            'default_timezone': self.default_timezone,
+            'verification': [self.verify_pairs, self.platform_verification_columns, self.amount_tolerance,
+                             self.settlement_window, sorted(self.success_statuses)],
+            'scoring': [self.score_matches, self.match_score_weights, self.pattern_weights,
+                        self.unknown_pattern_weight],
+            'chunk_size': self.chunk_size,
+            'prefilter_provider': self.prefilter_provider,
+            'prefilter_false_positive_rate': self.prefilter_false_positive_rate,
+            # نتیجه با پروفایل الگوها pattern_profile دارد و نتیجه بدون آن نه
+            'profile_patterns': self.profile_patterns,
+        }
+
+    def run_key(self, platform_path, provider_path, gateway_name, nrows=None, engine=None):
+        payload = json.dumps({
+            'platform': self.file_digest(platform_path),
+            'provider': self.file_digest(provider_path),
+            'config': self.run_config(gateway_name, nrows=nrows, engine=engine),
+        }, sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _load_checkpoint(self, run_dir, stage):
+        path = os.path.join(run_dir, f'{stage}.pkl') if run_dir else None
+        if path is None or not os.path.exists(path):
+            return None
+        logging.info(f"Resuming stage '{stage}' from checkpoint {run_dir}")
+        with open(path, 'rb') as f:
+            return pickle.load(f)
 
-        filtered_platform = platform_df[platform_df['gateway'].astype(str).str.lower() == gateway_name.lower()]
+    def _save_checkpoint(self, run_dir, stage, value):
+        if not run_dir:
+            return
+        os.makedirs(run_dir, exist_ok=True)
+        # نوشتن در فایل موقت و جایگزینی اتمی تا خرابی وسط نوشتن نقطه بازیابی ناقص باقی نگذارد
+        path = os.path.join(run_dir, f'{stage}.pkl')
+        with open(f'{path}.tmp', 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{path}.tmp', path)
+        logging.info(f"Checkpointed stage '{stage}' to {run_dir}")
+
+    def _discard_checkpoints(self, run_dir):
+        # نقاط بازیابی فقط برای ادامه اجرای قطع‌شده لازم‌اند؛ تکرار اجرای کامل‌شده از کش نتایج پاسخ داده می‌شود
+        if run_dir and os.path.isdir(run_dir):
+            shutil.rmtree(run_dir, ignore_errors=True)
+            logging.info(f"Removed checkpoints of finished run {run_dir}")
+
+    def purge_checkpoints(self, max_age_days=7):
+        if not self.checkpoint_directory or not os.path.isdir(self.checkpoint_directory):
+            return 0
+        cutoff = time.time() - max_age_days * 86400
+        removed = 0
+        for name in os.listdir(self.checkpoint_directory):
+            run_dir = os.path.join(self.checkpoint_directory, name)
+            if os.path.isdir(run_dir) and os.path.getmtime(run_dir) < cutoff:
+                shutil.rmtree(run_dir, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def gateway_specific_reconciliation(self, platform_path, provider_path, gateway_name, nrows=None, engine=None):
+        engine = engine or self.engine
+        self._pattern_stats = {}
+        run_key = None
+        if self.checkpoint_directory or self.result_cache is not None:
+            run_key = self.run_key(platform_path, provider_path, gateway_name, nrows=nrows, engine=engine)
+        if self.result_cache is not None:
+            cached = self.result_cache.get(run_key)
+            if cached is not None:
+                cached['cache_hit'] = True
+                return cached
+        run_dir = os.path.join(self.checkpoint_directory, run_key) if self.checkpoint_directory else None
+        if engine == 'pandas':
+            results = self._pandas_reconciliation(platform_path, provider_path, gateway_name, nrows=nrows,
+                                                  run_dir=run_dir)
+        elif engine in ('duckdb', 'polars'):
+            # موتورهای دیگر مراحل جداگانه ندارند؛ کل نتیجه به‌عنوان یک نقطه بازیابی ذخیره می‌شود
+            results = self._load_checkpoint(run_dir, 'results')
+            if results is None:
+                if self.engine_parity_rows:
+                    self.check_engine_parity(platform_path, provider_path, gateway_name, engine=engine,
+                                             nrows=min(nrows or self.engine_parity_rows, self.engine_parity_rows))
+                results = self._engine_reconciliation(engine, platform_path, provider_path, gateway_name, nrows=nrows)
+                if results is not None:
+                    results['provider'] = self.normalize_provider_columns(results['provider'], gateway_name)
+                    self._save_checkpoint(run_dir, 'results', results)
+        else:
+            raise ValueError(f"Unknown reconciliation engine: {engine}")
+
+        if results is None:
+            self._discard_checkpoints(run_dir)
+            return None
+        if self.verify_pairs:
+            results['matches'] = self.verify_matches(results)
+        if self.score_matches:
+            results['matches'], results['candidate_matches'], results['non_matches'] = self.rank_matches(results)
+        results['summary'] = self.build_summary(results)
+        if self.profile_patterns:
+            results['pattern_profile'] = self.build_pattern_profile(results)
+        if self.results_store is not None:
+            results['run_id'] = self.results_store.append_run(results)
+        if self.code_index_directory:
+            self.build_code_index(results)
+        if self.result_cache is not None:
+            results['cache_key'] = run_key
+            results['cache_hit'] = False
+            self.result_cache.put(run_key, results)
+        self._discard_checkpoints(run_dir)
+        return results
+
+    def _engine_reconciliation(self, engine, platform_path, provider_path, gateway_name, nrows=None):
+        if engine == 'duckdb':
+            from duckdb_engine import DuckDBReconciliationEngine
+            return DuckDBReconciliationEngine(self).reconcile(platform_path, provider_path, gateway_name, nrows=nrows)
+        from polars_engine import PolarsReconciliationEngine
+        return PolarsReconciliationEngine(self).reconcile(platform_path, provider_path, gateway_name, nrows=nrows)
+
+    def check_engine_parity(self, platform_path, provider_path, gateway_name, engine=None, nrows=None):
+        # اجرای همان ورودی با موتور duckdb یا polars و با pandas؛ نام جدول‌هایی که خروجی‌شان فرق دارد برگردانده می‌شود
+        engine = engine or self.engine
+        expected = self._pandas_reconciliation(platform_path, provider_path, gateway_name, nrows=nrows)
+        actual = self._engine_reconciliation(engine, platform_path, provider_path, gateway_name, nrows=nrows)
+        if expected is None or actual is None:
+            mismatched = [] if expected is None and actual is None else ['results']
+        else:
+            mismatched = [
+                table for table in ('platform_codes', 'provider_codes', 'matches', 'non_matches')
+                if not expected[table].reset_index(drop=True).astype(str).equals(
+                    actual[table].reset_index(drop=True).astype(str))
+            ]
+            if not np.array_equal(expected['unmatched_provider'].positions, actual['unmatched_provider'].positions):
+                mismatched.append('unmatched_provider')
+        if mismatched:
+            logging.warning(f"Engine '{engine}' differs from pandas on the first {nrows} rows for gateway "
+                            f"'{gateway_name}': {', '.join(mismatched)}")
+        else:
+            logging.info(f"Engine '{engine}' matches pandas on the first {nrows} rows for gateway '{gateway_name}'")
+        return mismatched
+
+    def build_code_index(self, results, directory=None):
+        # ایندکس کدهای یک نتیجه در زیرپوشه gateway؛ ایندکس قبلی همان gateway جایگزین می‌شود
+        from code_index import CodeIndex
+        path = os.path.join(directory or self.code_index_directory, str(results.get('gateway_name')).lower())
+        CodeIndex.build_from_results(results, path).close()
+        return path
+
+    def _load_platform(self, platform_path, gateway_name, nrows=None):
+        # دیتافریم پلتفرم، ردیف‌های همین gateway و کدهای آن‌ها؛ با cache_platform هر فایل فقط یک بار خوانده
+        # و کدهای هر gateway فقط یک بار استخراج می‌شوند
+        extractors = self.gateway_extractors(gateway_name)
+        columns = self.platform_columns(gateway_name)
+        cache = None
+        if self.cache_platform:
+            stat = os.stat(platform_path)
+            file_key = (os.path.abspath(platform_path), stat.st_mtime_ns, stat.st_size, nrows, tuple(columns))
+            if self._platform_cache.get('key') != file_key:
+                self._platform_cache = {'key': file_key, 'df': None, 'gateways': {}}
+            cache = self._platform_cache
+            gateway_key = (gateway_name.lower(), tuple(extractors['patterns']), extractors['normalize'],
+                           json.dumps(extractors['platform_extractors'], sort_keys=True))
+            if gateway_key in cache['gateways']:
+                logging.info(f"Using cached platform data for gateway '{gateway_name}'")
+                return cache['df'], *cache['gateways'][gateway_key]
+
+        if cache is not None and cache['df'] is not None:
+            platform_df = cache['df']
+        else:
+            platform_df = self.read_file(platform_path, columns=columns, nrows=nrows)
+            logging.info(f"Platform data loaded with shape: {platform_df.shape}")
+            if cache is not None:
+                cache['df'] = platform_df
+
+        gateway_mask = (platform_df['gateway'].astype(str).str.lower() == gateway_name.lower()).to_numpy()
+        filtered_platform = RowSelection(platform_df, np.flatnonzero(gateway_mask))
+        platform_codes = None
+        if not filtered_platform.empty:
+            logging.info(f"Filtered platform data for gateway '{gateway_name}' with {len(filtered_platform)} records")
+            platform_codes = self.extract_codes_from_platform(filtered_platform.materialize(), gateway_name=gateway_name)
+        if cache is not None:
+            cache['gateways'][gateway_key] = (filtered_platform, platform_codes)
+        return platform_df, filtered_platform, platform_codes
+
+    def _pandas_reconciliation(self, platform_path, provider_path, gateway_name, nrows=None, run_dir=None):
+        platform = self._load_checkpoint(run_dir, 'platform')
+        if platform is None:
+            platform = self._load_platform(platform_path, gateway_name, nrows=nrows)
+            if not platform[1].empty:
+                self._save_checkpoint(run_dir, 'platform', platform)
+        platform_df, filtered_platform, platform_codes = platform
         if filtered_platform.empty:
             logging.warning(f"No records with gateway '{gateway_name}' found.")
             return None
 
-        logging.info(f"Filtered platform data for gateway '{gateway_name}' with {len(filtered_platform)} records")
-        platform_codes = self.extract_codes_from_platform(filtered_platform)
-        provider_codes = self.extract_codes_from_provider(provider_df)
+        provider = self._load_checkpoint(run_dir, 'provider')
+        if provider is None:
+            provider = self._extract_provider(provider_path, platform_codes, gateway_name, nrows=nrows)
+            self._save_checkpoint(run_dir, 'provider', provider)
+        provider_df, provider_codes = provider
 
-        matches, non_matches = self.find_exact_matches(platform_codes, provider_codes)
-        unmatched_provider = provider_df[~provider_df.index.isin(matches['file2_row'])]
+        matched = self._load_checkpoint(run_dir, 'matches')
+        if matched is None:
+            matched = self.find_matches(platform_codes, provider_codes)
+            self._save_checkpoint(run_dir, 'matches', matched)
+        matches, non_matches = matched
+        matched_rows = matches['row_index_file2'] if not matches.empty else []
+        unmatched_provider = RowSelection(provider_df, np.flatnonzero(~provider_df.index.isin(matched_rows)))
 
+        # دیتافریم‌های منبع فقط یک بار نگه داشته می‌شوند و بقیه نتایج انتخابی از ردیف‌های آن‌ها هستند
         return {
             'platform': platform_df,
             'provider': provider_df,
@@ -121,27 +1127,464 @@ class SmartReconciliationSystem:
             'unmatched_provider': unmatched_provider
         }
 
+    def _extract_provider(self, provider_path, platform_codes, gateway_name, nrows=None):
+        code_filter = None
+        if self.prefilter_provider:
+            code_filter = CodeBloomFilter(platform_codes['code'], self.prefilter_false_positive_rate)
+            logging.info(f"Built prefilter over {len(platform_codes)} platform codes ({code_filter.nbytes} bytes)")
+        provider_df, provider_codes = self.extract_codes_from_file(provider_path, nrows=nrows,
+                                                                   gateway_name=gateway_name, code_filter=code_filter)
+        logging.info(f"Provider data loaded with shape: {provider_df.shape}")
+        return provider_df, provider_codes
+
+    def parse_amounts(self, values, unit='rial'):
+        # مبلغ متنی (ارقام فارسی، جداکننده هزارگان، نام واحد، منفی پرانتزی) به ریال صحیح؛ مقدار نامعتبر <NA>.
+        # unit واحد مقدارهای بدون نام واحد است؛ گرد کردن نیم به دور از صفر است (نه گرد کردن بانکی)
+        factors = np.full(len(values), float(_AMOUNT_UNITS[unit]))
+        if pd.api.types.is_numeric_dtype(values):
+            amounts = values.astype(float)
+        else:
+            text = values.astype(str).str.translate(_DIGIT_TRANSLATION)
+            for name, token in _AMOUNT_UNIT_TOKENS.items():
+                factors[text.str.contains(token).fillna(False).to_numpy(dtype=bool)] = _AMOUNT_UNITS[name]
+                text = text.str.replace(token, '', regex=True)
+            text = text.str.replace(_AMOUNT_SEPARATORS, '', regex=True)
+            negative = (text.str.startswith('(') & text.str.endswith(')')).to_numpy()
+            amounts = pd.to_numeric(text.str.strip('()'), errors='coerce')
+            amounts = amounts.where(~negative, -amounts)
+        # گرد کردن به ۶ رقم اعشار خطای ممیز شناور (مثل 1.05 × 10) را پیش از گرد کردن نیم حذف می‌کند
+        amounts = (amounts * factors).round(6)
+        return (np.sign(amounts) * np.floor(amounts.abs() + 0.5)).astype('Int64')
+
+    def _jalali_to_days(self, year, month, day):
+        # روز جولیانی اول فروردین با جدول سال‌های شکست (الگوریتم jalaali)، به‌علاوه روزهای گذشته از سال؛
+        # خروجی تعداد روز از 1970-01-01 است
+        interval = np.clip(np.searchsorted(_JALALI_BREAKS, year, side='right'), 1, len(_JALALI_BREAKS) - 1)
+        start = _JALALI_BREAKS[interval - 1]
+        jump = _JALALI_BREAKS[interval] - start
+        n = year - start
+        leap_jalali = _JALALI_LEAPS[interval - 1] + n // 33 * 8 + (n % 33 + 3) // 4 + ((jump % 33 == 4) & (jump - n == 4))
+        gregorian_year = year + 621
+        leap_gregorian = gregorian_year // 4 - (gregorian_year // 100 + 1) * 3 // 4 - 150
+        march = 20 + leap_jalali - leap_gregorian
+        julian_day = ((gregorian_year + 100100) * 1461 // 4 + march - 34840408
+                      - (gregorian_year + 100100) // 100 * 3 // 4 + 752)
+        julian_day += (month - 1) * 31 - month // 7 * (month - 7) + day - 1
+        return julian_day - 2440588
+
+    def parse_timestamps(self, values, calendar='auto', timezone=None):
+        # تاریخ/زمان محلی (جلالی یا میلادی، با ارقام فارسی) به نانوثانیه UTC از ۱۹۷۰؛ مقدار نامعتبر <NA>.
+        # در حالت auto سال‌های کوچک‌تر از ۱۷۰۰ جلالی حساب می‌شوند
+        timezone = timezone or self.default_timezone
+        text = values.astype(str).str.translate(_DIGIT_TRANSLATION)
+        parts = text.str.extract(_DATE_TIME)
+        # مقدار دارای منطقه زمانی صریح (Z یا +03:30) با pandas مستقیم به UTC می‌رود
+        explicit = text.str.contains(r'(?:Z|[+-]\d{2}:?\d{2})\s*$', regex=True).fillna(False).to_numpy(dtype=bool)
+        matched = parts[0].notna().to_numpy() & ~explicit
+        year, month, day, hour, minute, second = (
+            pd.to_numeric(parts[i], errors='coerce').fillna(0).astype(np.int64).to_numpy() for i in range(6))
+        if calendar == 'auto':
+            jalali = matched & (year < 1700)
+        else:
+            jalali = matched & (calendar == 'jalali')
+        gregorian = matched & ~jalali
+
+        days = np.zeros(len(text), dtype=np.int64)
+        valid = np.zeros(len(text), dtype=bool)
+        jalali &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= np.where(month <= 6, 31, 30))
+        if jalali.any():
+            days[jalali] = self._jalali_to_days(year[jalali], month[jalali], day[jalali])
+            # ۳۰ اسفند فقط در سال کبیسه معتبر است
+            next_year = self._jalali_to_days(year[jalali] + 1, 1, 1)
+            valid[np.flatnonzero(jalali)[days[jalali] < next_year]] = True
+        if gregorian.any():
+            dates = pd.to_datetime(pd.DataFrame({'year': year[gregorian], 'month': month[gregorian],
+                                                 'day': day[gregorian]}), errors='coerce')
+            dates = dates.to_numpy(dtype='datetime64[D]')
+            ok = ~np.isnat(dates)
+            index = np.flatnonzero(gregorian)[ok]
+            days[index] = dates[ok].astype(np.int64)
+            valid[index] = True
+        valid &= (hour < 24) & (minute < 60) & (second < 60)
+
+        seconds = days * 86400 + hour * 3600 + minute * 60 + second
+        local = pd.Series(np.where(valid, seconds * 10 ** 9, np.iinfo(np.int64).min).view('datetime64[ns]'),
+                          index=values.index)
+        rest = ~matched & ~explicit
+        if rest.any():
+            # سایر قالب‌ها با pandas خوانده می‌شوند
+            naive = pd.to_datetime(text[rest], errors='coerce', format='mixed')
+            local[rest] = naive.astype('datetime64[ns]').to_numpy()
+        utc = local.dt.tz_localize(timezone, ambiguous='NaT', nonexistent='shift_forward').dt.tz_convert('UTC')
+        nanos = utc.dt.tz_localize(None).astype('datetime64[ns]').to_numpy().view(np.int64).copy()
+        if explicit.any():
+            aware = pd.to_datetime(text[explicit], errors='coerce', format='mixed', utc=True)
+            nanos[explicit] = aware.astype('datetime64[ns, UTC]').dt.tz_localize(None).to_numpy().view(np.int64)
+        return pd.Series(nanos, index=values.index).astype('Int64').mask(nanos == np.iinfo(np.int64).min)
+
+    def normalize_provider_columns(self, df, gateway_name=None):
+        if not self.normalize_values or df.empty or 'amount_minor' in df.columns:
+            return df
+        profile = self._gateway_profile(gateway_name)
+        debit_column = profile.get('debit_column') if profile.get('debit_column') in df.columns else None
+        credit_column = profile.get('credit_column') if profile.get('credit_column') in df.columns else None
+        amount_column = self._find_column(df, profile.get('amount_column'), ['amount', 'مبلغ'])
+        new_columns = {}
+        if debit_column or credit_column:
+            # واریز مثبت و برداشت منفی
+            parsed = [self.parse_amounts(df[col], self._amount_unit(profile, col)) for col in (credit_column, debit_column) if col]
+            credit = parsed[0] if credit_column else pd.Series(pd.NA, index=df.index, dtype='Int64')
+            debit = parsed[-1] if debit_column else pd.Series(pd.NA, index=df.index, dtype='Int64')
+            amount = credit.fillna(0) - debit.fillna(0)
+            new_columns['amount_minor'] = amount.mask(credit.isna() & debit.isna())
+        elif amount_column is not None:
+            new_columns['amount_minor'] = self.parse_amounts(df[amount_column], self._amount_unit(profile, amount_column))
+        time_column = self._find_column(df, profile.get('time_column'), ['time', 'date', 'created', 'تاریخ', 'زمان'])
+        if time_column is not None:
+            new_columns['timestamp_utc'] = self.parse_timestamps(df[time_column], profile.get('calendar', 'auto'),
+                                                                 profile.get('timezone'))
+        return df.assign(**new_columns) if new_columns else df
+
+    def _amount_unit(self, profile, column, prefix=''):
+        if profile.get(f'{prefix}amount_unit'):
+            return profile[f'{prefix}amount_unit']
+        return 'toman' if 'تومان' in str(column) or 'toman' in str(column).lower() else 'rial'
+
+    def _verification_values(self, df, profile, prefix=''):
+        # مبلغ (ریال)، موفق بودن وضعیت و زمان (نانوثانیه UTC) ردیف‌ها؛ ستون‌های نرمال‌شده در صورت وجود استفاده می‌شوند
+        amount_column = self._find_column(df, profile.get(f'{prefix}amount_column'), ['amount', 'مبلغ'])
+        if 'amount_minor' in df.columns:
+            amounts = df['amount_minor']
+        elif amount_column is not None:
+            amounts = self.parse_amounts(df[amount_column], self._amount_unit(profile, amount_column, prefix))
+        else:
+            amounts = pd.Series(pd.NA, index=df.index, dtype='Int64')
+
+        status_column = self._find_column(df, profile.get(f'{prefix}status_column'), ['status', 'وضعیت'])
+        if status_column is not None:
+            status = df[status_column].astype(str).str.translate(_DIGIT_TRANSLATION).str.strip().str.lower()
+            successful = status.isin(self.success_statuses).astype('boolean').mask(df[status_column].isna())
+        else:
+            successful = pd.Series(pd.NA, index=df.index, dtype='boolean')
+
+        time_column = self._find_column(df, profile.get(f'{prefix}time_column'),
+                                        ['time', 'date', 'created', 'تاریخ', 'زمان'])
+        if 'timestamp_utc' in df.columns:
+            timestamps = df['timestamp_utc']
+        elif time_column is not None:
+            timestamps = self.parse_timestamps(df[time_column], profile.get(f'{prefix}calendar', 'auto'),
+                                               profile.get(f'{prefix}timezone'))
+        else:
+            timestamps = pd.Series(pd.NA, index=df.index, dtype='Int64')
+        return [values.reset_index(drop=True) for values in (amounts, successful, timestamps)]
+
+    def verify_matches(self, results):
+        # جفت‌های منطبق با کد، ستون‌به‌ستون مقایسه می‌شوند: اختلاف مبلغ بیشتر از amount_tolerance، وضعیت متفاوت
+        # (موفق/ناموفق) یا ثبت در ارائه‌دهنده دیرتر از settlement_window؛ مقدار ناموجود در هر سمت مغایرت حساب نمی‌شود
+        matches = results.get('matches')
+        if matches is None or matches.empty:
+            return matches
+        profile = self._gateway_profile(results.get('gateway_name'))
+        platform_df, provider_df = results['platform'], results['provider']
+        platform_rows = platform_df.iloc[platform_df.index.get_indexer(matches['row_index_file1'])]
+        provider_rows = provider_df.iloc[provider_df.index.get_indexer(matches['row_index_file2'])]
+        platform_amount, platform_ok, platform_time = self._verification_values(platform_rows, profile, 'platform_')
+        provider_amount, provider_ok, provider_time = self._verification_values(provider_rows, profile)
+
+        amount_difference = provider_amount - platform_amount
+        amount_mismatch = (abs(amount_difference) > self.amount_tolerance).fillna(False).to_numpy(dtype=bool)
+        status_mismatch = (platform_ok != provider_ok).fillna(False).to_numpy(dtype=bool)
+        delay = (provider_time - platform_time) // 10 ** 9
+        late = (delay > self.settlement_window).fillna(False).to_numpy(dtype=bool)
+        verification = np.select([amount_mismatch, status_mismatch, late],
+                                 ['مغایرت مبلغ', 'مغایرت وضعیت', 'تسویه با تأخیر'], 'تطابق کامل')
+        counts = pd.Series(verification).value_counts().to_dict()
+        logging.info(f"Verified {len(matches)} matched pairs: {counts}")
+        return matches.assign(verification=verification, amount_difference=amount_difference.array,
+                              settlement_delay_seconds=delay.array)
+
+    def _pattern_weight(self, label):
+        if label in self.pattern_weights:
+            return self.pattern_weights[label]
+        # برچسب کدهای ساختاری مثل json:payment.ref
+        return self.pattern_weights.get(label.split(':')[0], self.unknown_pattern_weight)
+
+    def _column_weight(self, column, configured):
+        if column in configured:
+            return configured[column]
+        name = column.lower()
+        if any(keyword in name for keyword in ('ref', 'track', 'id', 'code', 'شناسه', 'پیگیری', 'کد')):
+            return 1.0
+        return 0.6
+
+    def rank_matches(self, results):
+        # امتیاز هر نامزد: وزن ستون منبع در ارائه‌دهنده، اختصاصی بودن الگو (میانگین دو سمت)، یکتایی (عکس تعداد
+        # نامزدهایی که به همان ردیف پلتفرم رسیده‌اند) و هم‌خوانی مبلغ (۱ برابر، ۰ مغایر، ۰.۵ نامعلوم)؛
+        # برای هر ردیف ارائه‌دهنده نامزد با بیشترین امتیاز (در تساوی، اولین) تطابق نهایی است
+        matches, non_matches = results.get('matches'), results.get('non_matches')
+        if matches is None or matches.empty:
+            return matches, matches, non_matches
+        profile = self._gateway_profile(results.get('gateway_name'))
+        weights = self.match_score_weights
+
+        def mapped(values, weight):
+            values = values.astype(str)
+            return values.map({value: weight(value) for value in values.unique()}).to_numpy(dtype=float)
+
+        column_score = mapped(matches['column_file2'], lambda col: self._column_weight(col, profile.get('column_weights') or {}))
+        pattern_score = (mapped(matches['pattern_file1'], self._pattern_weight)
+                         + mapped(matches['pattern_file2'], self._pattern_weight)) / 2
+        uniqueness = 1 / matches.groupby('row_index_file1')['row_index_file1'].transform('size').to_numpy()
+        if 'amount_difference' in matches.columns:
+            difference = matches['amount_difference'].astype('Float64')
+            amount_score = np.where(difference.isna(), 0.5,
+                                    (difference.abs() <= self.amount_tolerance).fillna(False).to_numpy(dtype=bool))
+        else:
+            amount_score = np.full(len(matches), 0.5)
+        score = (weights['column'] * column_score + weights['pattern'] * pattern_score
+                 + weights['uniqueness'] * uniqueness + weights['amount'] * amount_score)
+        score = np.round(score / sum(weights.values()), 4)
+
+        rows = matches['row_index_file2'].to_numpy()
+        order = np.lexsort((np.arange(len(matches)), -score, rows))
+        rank = np.empty(len(matches), dtype=np.int64)
+        group_start = np.r_[True, rows[order][1:] != rows[order][:-1]]
+        positions = np.arange(len(matches))
+        rank[order] = positions - np.maximum.accumulate(np.where(group_start, positions, 0)) + 1
+        candidates = matches.assign(confidence=score, rank=rank)
+        best = candidates[rank == 1].drop(columns=['rank']).reset_index(drop=True)
+        logging.info(f"Kept {len(best)} best matches out of {len(candidates)} candidates")
+
+        # کد پلتفرم نامزدهای کنار گذاشته‌شده‌ای که ردیف پلتفرمشان دیگر هیچ تطابق نهایی ندارد دوباره «فقط در فایل 1» است
+        released = matches['code'][(rank != 1) & ~matches['row_index_file1'].isin(best['row_index_file1']).to_numpy()]
+        if not released.empty:
+            platform_codes = results['platform_codes']
+            released = platform_codes[platform_codes['code'].isin(released)].assign(match_type='فقط در فایل 1')
+            platform_only = (non_matches['match_type'] == 'فقط در فایل 1').to_numpy()
+            non_matches = pd.concat([non_matches[platform_only], released, non_matches[~platform_only]])
+            logging.info(f"{len(released)} platform codes without a kept match moved back to non-matches")
+        return best, candidates, non_matches
+
+    def _find_column(self, df, configured, keywords):
+        if configured and configured in df.columns:
+            return configured
+        for col in df.columns:
+            if any(keyword in str(col).lower() for keyword in keywords):
+                return col
+        return None
+
+    def _count_by(self, labels, matched):
+        counts = pd.crosstab(pd.Series(labels, name='label'), pd.Series(matched, name='matched'))
+        return {
+            str(label): {'matched': int(row.get(True, 0)), 'unmatched': int(row.get(False, 0))}
+            for label, row in counts.iterrows()
+        }
+
+    def build_summary(self, results):
+        # خلاصه فشرده اجرا؛ نمودارها و کارت‌های داشبورد فقط از روی همین خلاصه ساخته می‌شوند
+        matches = results.get('matches', pd.DataFrame())
+        non_matches = results.get('non_matches', pd.DataFrame())
+        provider_codes = results.get('provider_codes', pd.DataFrame())
+        provider_df = results.get('provider')
+        total = len(matches) + len(non_matches)
+
+        summary = {
+            'gateway_name': results.get('gateway_name'),
+            'platform_records': len(results.get('filtered_platform', [])),
+            'provider_records': len(provider_df) if provider_df is not None else 0,
+            'platform_codes': len(results.get('platform_codes', [])),
+            'provider_codes': len(provider_codes),
+            'matches': len(matches),
+            'non_matches': len(non_matches),
+            'match_percent': round(len(matches) / total * 100, 2) if total > 0 else 0,
+            'by_match_type': {},
+            'by_column': {},
+            'by_pattern': {},
+            'by_amount_bucket': {},
+            'by_hour': {},
+            'by_verification': {},
+        }
+        if 'match_type' in non_matches.columns:
+            summary['by_match_type'] = {str(k): int(v) for k, v in non_matches['match_type'].value_counts().items()}
+        summary['by_match_type']['دقیق'] = len(matches)
+        if results.get('candidate_matches') is not None:
+            summary['candidate_matches'] = len(results['candidate_matches'])
+        if 'verification' in matches.columns:
+            summary['by_verification'] = {str(k): int(v) for k, v in matches['verification'].value_counts().items()}
+
+        if not provider_codes.empty:
+            matched_codes = provider_codes['code'].isin(matches['code']) if not matches.empty \
+                else np.zeros(len(provider_codes), dtype=bool)
+            summary['by_column'] = self._count_by(provider_codes['column'].astype(str), matched_codes)
+            summary['by_pattern'] = self._count_by(provider_codes['pattern'].astype(str), matched_codes)
+
+        if provider_df is not None and not provider_df.empty:
+            profile = self._gateway_profile(results.get('gateway_name'))
+            matched_rows = provider_df.index.isin(matches['row_index_file2']) if not matches.empty \
+                else np.zeros(len(provider_df), dtype=bool)
+
+            amounts = None
+            amount_column = self._find_column(provider_df, profile.get('amount_column'), ['amount', 'مبلغ'])
+            if 'amount_minor' in provider_df.columns:
+                amounts = provider_df['amount_minor'].astype(float)
+            elif amount_column is not None:
+                amounts = pd.to_numeric(provider_df[amount_column], errors='coerce')
+            if amounts is not None:
+                buckets = pd.cut(amounts, bins=[-np.inf, 1e5, 1e6, 1e7, 1e8, np.inf],
+                                 labels=['<100K', '100K-1M', '1M-10M', '10M-100M', '>100M'])
+                summary['by_amount_bucket'] = self._count_by(buckets.astype(str), matched_rows)
+
+            time_column = self._find_column(provider_df, profile.get('time_column'), ['time', 'date', 'created', 'تاریخ', 'زمان'])
+            if 'timestamp_utc' in provider_df.columns:
+                # ساعت محلی از زمان نرمال‌شده
+                hours = pd.to_datetime(provider_df['timestamp_utc'], unit='ns', utc=True) \
+                    .dt.tz_convert(profile.get('timezone') or self.default_timezone).dt.hour
+                summary['by_hour'] = self._count_by(hours.astype('Int64').astype(str), matched_rows)
+            elif time_column is not None:
+                hours = pd.to_datetime(provider_df[time_column], errors='coerce').dt.hour
+                summary['by_hour'] = self._count_by(hours.astype('Int64').astype(str), matched_rows)
+
+        return summary
+
+    def build_pattern_profile(self, results):
+        # هزینه و بازده هر الگو در هر ستون: زمان اجرا (فقط موتور pandas)، کدهای خام، کدهای یکتای منتسب به الگو
+        # (پس از حذف تکراری‌ها) و تعداد آن‌هایی که به تطابق واقعی رسیده‌اند
+        matches = results.get('matches', pd.DataFrame())
+        frames = []
+        for side, key in [('platform', 'platform_codes'), ('provider', 'provider_codes')]:
+            codes = results.get(key)
+            if codes is None or codes.empty:
+                continue
+            matched = codes['code'].isin(matches['code']) if not matches.empty else np.zeros(len(codes), dtype=bool)
+            frames.append(
+                pd.DataFrame({'side': side, 'column': codes['column'].astype(str),
+                              'pattern': codes['pattern'].astype(str), 'matched': matched})
+                .groupby(['side', 'column', 'pattern'])['matched']
+                .agg(unique_codes='size', matched_codes='sum')
+                .reset_index()
+            )
+        hits = pd.concat(frames, ignore_index=True) if frames else \
+            pd.DataFrame(columns=['side', 'column', 'pattern', 'unique_codes', 'matched_codes'])
+
+        timings = pd.DataFrame(
+            [(side, str(col), pattern, seconds, rows, found)
+             for (side, col, pattern), (seconds, rows, found) in self._pattern_stats.items()],
+            columns=['side', 'column', 'pattern', 'seconds', 'rows_scanned', 'codes_found']
+        )
+        profile = timings.merge(hits, how='outer', on=['side', 'column', 'pattern'])
+        profile[['unique_codes', 'matched_codes']] = profile[['unique_codes', 'matched_codes']].fillna(0).astype(int)
+        profile['match_rate'] = (profile['matched_codes'] / profile['unique_codes'].where(profile['unique_codes'] > 0)).round(4)
+        profile = profile.sort_values('seconds', ascending=False, na_position='last').reset_index(drop=True)
+        logging.info(f"Pattern profile built with {len(profile)} (side, column, pattern) entries")
+        return profile
+
+    def matches_with_original_text(self, results, matches=None):
+        if matches is None:
+            matches = results.get('matches')
+        if matches is None or matches.empty:
+            return matches
+        matches = self.resolve_original_text(matches, results.get('platform'), suffix='_file1')
+        return self.resolve_original_text(matches, results.get('provider'), suffix='_file2')
+
+    def _report_sheets(self, results):
+        non_matches = results.get('non_matches', pd.DataFrame())
+        return [
+            ('filtered_platform', results.get('filtered_platform')),
+            ('provider', results.get('provider')),
+            ('matches', self.matches_with_original_text(results)),
+            ('non_match_platform', non_matches[non_matches['match_type'] == 'فقط در فایل 1']
+             if 'match_type' in non_matches.columns else non_matches),
+            ('non_match_provider', results.get('unmatched_provider')),
+            ('candidate_matches', results.get('candidate_matches'))
+        ]
+
     def generate_report(self, results, output_path="reconciliation_report.xlsx"):
         if not results:
             logging.error("Results are empty!")
             return False
 
-        with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-            for sheet_name, df in [
-                ('filtered_platform', results.get('filtered_platform')),
-                ('provider', results.get('provider')),
-                ('matches', results.get('matches')),
-                ('non_match_platform', results.get('non_matches', pd.DataFrame()).query("match_type == 'فقط در پلتفرم'")),
-                ('non_match_provider', results.get('unmatched_provider'))
-            ]:
-                if df is not None and not df.empty:
-                    df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    logging.info(f"Sheet {sheet_name} with {len(df)} records created")
-                else:
-                    pd.DataFrame().to_excel(writer, sheet_name=sheet_name)
-                    logging.warning(f"Sheet {sheet_name} is empty or not present")
+        cache_key = results.get('cache_key') if self.result_cache is not None else None
+        cached_report = self.result_cache.report_path(cache_key) if cache_key else None
+        if cached_report:
+            shutil.copyfile(cached_report, output_path)
+            logging.info(f"Excel file copied from result cache to {output_path}")
+            return True
 
+        _write_workbook(self._report_sheets(results), output_path)
         logging.info(f"Excel file saved at {output_path}")
+        if cache_key:
+            self.result_cache.put_report(cache_key, output_path)
+        return True
+
+    def generate_report_bundle(self, results, output_path="reconciliation_report.zip", formats=('csv',),
+                               include_workbook=False):
+        # بسته zip برای یک یا چند نتیجه (هر نتیجه در پوشه خودش): بخش هر شیت در هر قالب (csv.gz، parquet یا xlsx)
+        # و summary.json؛ بخش‌ها هم‌زمان در کارگرها سریال و فشرده می‌شوند (csv به gzip) و هر بخش به محض آماده شدن
+        # بدون فشرده‌سازی دوباره به zip اضافه می‌شود، پس زمان کل نزدیک به زمان بزرگ‌ترین بخش است. پوشه هر نتیجه
+        # نام gateway است و اگر چند نتیجه از یک gateway باشند run_id (یا شماره نتیجه) به آن اضافه می‌شود.
+        # کارنامه اکسل کامل gateway (include_workbook)
+        # یک کار ترتیبی است و همیشه طولانی‌ترین بخش می‌شود، برای همین پیش‌فرض نیست؛ برای اکسل هر شیت 'xlsx' را
+        # به formats اضافه کنید
+        runs = [results] if isinstance(results, dict) else [run for run in (results or []) if run]
+        if not runs:
+            logging.error("Results are empty!")
+            return False
+        formats = list(formats)
+        if 'parquet' in formats:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                logging.warning("pyarrow is not installed; skipping parquet parts")
+                formats.remove('parquet')
+
+        executor_class = ProcessPoolExecutor if self.report_executor == 'process' else ThreadPoolExecutor
+        started = time.perf_counter()
+        parts = 0
+        with tempfile.TemporaryDirectory() as work_dir, executor_class(max_workers=self.report_workers) as executor, \
+                zipfile.ZipFile(f'{output_path}.tmp', 'w') as bundle:
+            futures = {}
+            gateways = [str(run.get('gateway_name') or 'report') for run in runs]
+            for index, (run, gateway) in enumerate(zip(runs, gateways), 1):
+                if gateways.count(gateway) > 1:
+                    gateway = f"{gateway}_{run.get('run_id') or index}"
+                gateway = re.sub(r'[^\w.\-]', '_', gateway)
+                gateway_dir = os.path.join(work_dir, gateway)
+                os.makedirs(gateway_dir)
+                sheets = [(name, materialize(df)) for name, df in self._report_sheets(run)]
+                bundle.writestr(f"{gateway}/summary.json",
+                                json.dumps(run.get('summary', {}), ensure_ascii=False, indent=2, default=str),
+                                compress_type=zipfile.ZIP_DEFLATED)
+                parts += 1
+
+                if include_workbook:
+                    workbook_name = f"{gateway}/{gateway}_report.xlsx"
+                    cache_key = run.get('cache_key') if self.result_cache is not None else None
+                    cached_report = self.result_cache.report_path(cache_key) if cache_key else None
+                    if cached_report:
+                        bundle.write(cached_report, workbook_name, compress_type=zipfile.ZIP_STORED)
+                        parts += 1
+                    else:
+                        workbook_path = os.path.join(work_dir, workbook_name)
+                        futures[executor.submit(_write_workbook, sheets, workbook_path)] = (workbook_name, cache_key)
+                for file_format in formats:
+                    for name, df in sheets:
+                        if df is None or df.empty:
+                            continue
+                        extension = 'csv.gz' if file_format == 'csv' else file_format
+                        part_name = f"{gateway}/{file_format}/{name}.{extension}"
+                        part_path = os.path.join(gateway_dir, f"{name}.{extension}")
+                        futures[executor.submit(_write_report_part, df, part_path, file_format, name)] = \
+                            (part_name, None)
+
+            for future in as_completed(futures):
+                part_name, cache_key = futures[future]
+                # همه بخش‌ها در کارگر فشرده شده‌اند (gzip، اکسل و parquet)
+                bundle.write(future.result(), part_name, compress_type=zipfile.ZIP_STORED)
+                parts += 1
+                if cache_key:
+                    self.result_cache.put_report(cache_key, future.result())
+        os.replace(f'{output_path}.tmp', output_path)
+        logging.info(f"Report bundle with {parts} parts saved at {output_path} in {time.perf_counter() - started:.2f}s")
         return True
 
 if __name__ == "__main__":
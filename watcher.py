@@ -0,0 +1,248 @@
+import os
+import re
+import sys
+import json
+import time
+import errno
+import select
+import shutil
+import struct
+import ctypes
+import ctypes.util
+import logging
+import argparse
+from datetime import datetime
+
+from smart_reconciliation_system import SmartReconciliationSystem, _SUPPORTED_FILE_TYPES
+
+# همان فهرست gateway های صفحه اصلی
+DEFAULT_GATEWAYS = ['payman', 'jibitcobank', 'ezpay', 'toman', 'vandar', 'jibit']
+
+# رویدادهای inotify که یعنی فایلی نوشته، بسته یا به پوشه منتقل شده است
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = 0x00000800
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _Inotify:
+    # دسترسی مستقیم به inotify لینوکس با ctypes؛ روی سیستم‌های دیگر OSError می‌دهد تا به حالت polling برگردیم
+    def __init__(self, directory):
+        name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self.libc.inotify_init1(_IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+
+    def read_names(self, timeout):
+        # نام فایل‌هایی که در این بازه رویداد داشته‌اند
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class StatementWatcher:
+    # پوشه ورودی صورتحساب‌ها را می‌پاید؛ هر فایل جدید پس از ثابت ماندن اندازه و زمان تغییر به مدت settle_seconds
+    # با gateway تشخیص داده‌شده از نام یا ستون‌های سرفایل مغایرت‌گیری و گزارشش در output_dir نوشته می‌شود
+    def __init__(self, watch_dir, platform_path, output_dir='watch_reports', gateways=None, settle_seconds=5,
+                 poll_interval=2, use_inotify=True, system=None):
+        self.watch_dir = watch_dir
+        self.platform_path = platform_path
+        self.output_dir = output_dir
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.system = system or SmartReconciliationSystem()
+        # فایل پلتفرم یک بار پارس می‌شود و برای همه صورتحساب‌ها استفاده می‌شود
+        self.system.cache_platform = True
+        names = list(gateways or DEFAULT_GATEWAYS) + list(self.system.gateway_profiles)
+        # نام‌های بلندتر اول بررسی می‌شوند تا مثلاً jibitcobank با jibit اشتباه نشود
+        self.gateways = sorted({name.lower() for name in names}, key=len, reverse=True)
+        self.pending = {}
+        self.state_path = os.path.join(output_dir, 'processed.json')
+        os.makedirs(output_dir, exist_ok=True)
+        self.processed = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding='utf-8') as f:
+                self.processed = json.load(f)
+
+    def _fingerprint(self, path):
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _is_candidate(self, name):
+        path = os.path.join(self.watch_dir, name)
+        file_type = self.system.detect_file_type(name)
+        return (not name.startswith('.') and os.path.isfile(path)
+                and (file_type in _SUPPORTED_FILE_TYPES or file_type == '.zip'))
+
+    def _track(self, names):
+        now = time.monotonic()
+        for name in names:
+            if not self._is_candidate(name):
+                continue
+            try:
+                fingerprint = self._fingerprint(os.path.join(self.watch_dir, name))
+            except FileNotFoundError:
+                self.pending.pop(name, None)
+                continue
+            if self.processed.get(name, {}).get('fingerprint') == fingerprint:
+                continue
+            previous = self.pending.get(name)
+            if previous is None or previous[0] != fingerprint:
+                self.pending[name] = (fingerprint, now)
+
+    def _ready(self):
+        # فایل‌هایی که از آخرین تغییرشان settle_seconds گذشته و در این فاصله تغییری نکرده‌اند
+        now = time.monotonic()
+        ready = []
+        for name, (fingerprint, since) in list(self.pending.items()):
+            try:
+                current = self._fingerprint(os.path.join(self.watch_dir, name))
+            except FileNotFoundError:
+                del self.pending[name]
+                continue
+            if current != fingerprint:
+                self.pending[name] = (current, now)
+            elif now - since >= self.settle_seconds:
+                ready.append(name)
+        return sorted(ready)
+
+    def detect_gateway(self, path):
+        base = os.path.basename(path).lower()
+        for gateway in self.gateways:
+            if re.search(rf'(^|[^a-z]){re.escape(gateway)}([^a-z]|$)', base):
+                return gateway
+        # در غیر این صورت ستون‌های سرفایل با header_fingerprint پروفایل‌ها مقایسه می‌شوند
+        fingerprints = [(name, profile['header_fingerprint']) for name, profile in self.system.gateway_profiles.items()
+                        if profile.get('header_fingerprint')]
+        if not fingerprints:
+            return None
+        for gateway, columns in fingerprints:
+            head = next(self.system.iter_file_chunks(path, nrows=5, gateway_name=gateway), None)
+            if head is not None and set(columns) <= set(map(str, head.columns)):
+                return gateway.lower()
+        return None
+
+    def process(self, name):
+        path = os.path.join(self.watch_dir, name)
+        fingerprint = self._fingerprint(path)
+        record = {'fingerprint': fingerprint, 'processed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        gateway = self.detect_gateway(path)
+        if gateway is None:
+            logging.warning(f"Could not detect the gateway of {name}; skipping")
+            record['status'] = 'unknown_gateway'
+        else:
+            # فایل قبل از پردازش کپی می‌شود تا بازنویسی هم‌زمان در پوشه SFTP روی اجرا اثر نگذارد
+            stem = re.sub(r'[^\w.\-]', '_', name)
+            work_copy = os.path.join(self.output_dir, f".{stem}")
+            shutil.copyfile(path, work_copy)
+            try:
+                started = time.perf_counter()
+                # فقط موتور pandas از پلتفرم کش‌شده (_load_platform) استفاده می‌کند؛ duckdb و polars برای هر
+                # صورتحساب کل فایل پلتفرم را دوباره می‌خوانند، برای همین پایش همیشه با pandas اجرا می‌شود
+                results = self.system.gateway_specific_reconciliation(self.platform_path, work_copy, gateway,
+                                                                      engine='pandas')
+                if results is None:
+                    record.update(status='no_platform_records', gateway=gateway)
+                else:
+                    report_path = os.path.join(self.output_dir, f"{stem}_{gateway}_report.xlsx")
+                    self.system.generate_report(results, report_path)
+                    record.update(status='done', gateway=gateway, report=report_path, summary=results['summary'],
+                                  run_id=results.get('run_id'), seconds=round(time.perf_counter() - started, 2))
+                    logging.info(f"Reconciled {name} for gateway '{gateway}': {results['summary']['matches']} matches")
+            except Exception as e:
+                logging.error(f"Reconciliation of {name} failed: {e}")
+                record.update(status='failed', gateway=gateway, error=str(e))
+            finally:
+                os.remove(work_copy)
+        self.processed[name] = record
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump(self.processed, f, ensure_ascii=False, indent=2, default=str)
+        self.pending.pop(name, None)
+        return record
+
+    def run(self, stop_after=None):
+        # stop_after (ثانیه) برای اجرای محدود، مثلاً در cron؛ None یعنی اجرای دائمی
+        inotify = None
+        if self.use_inotify:
+            try:
+                inotify = _Inotify(self.watch_dir)
+                logging.info(f"Watching {self.watch_dir} with inotify")
+            except OSError as e:
+                logging.info(f"inotify unavailable ({e}); polling {self.watch_dir} every {self.poll_interval}s")
+        else:
+            logging.info(f"Polling {self.watch_dir} every {self.poll_interval}s")
+
+        started = time.monotonic()
+        self._track(os.listdir(self.watch_dir))
+        try:
+            while stop_after is None or time.monotonic() - started < stop_after:
+                timeout = min(self.poll_interval, self.settle_seconds) if self.pending else self.poll_interval
+                if inotify is not None:
+                    self._track(inotify.read_names(timeout))
+                else:
+                    time.sleep(timeout)
+                    self._track(os.listdir(self.watch_dir))
+                for name in self._ready():
+                    self.process(name)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="پایش پوشه صورتحساب‌های ارائه‌دهنده و مغایرت‌گیری خودکار")
+    parser.add_argument('watch_dir')
+    parser.add_argument('--platform', required=True, help="مسیر فایل پلتفرم")
+    parser.add_argument('--output', default='watch_reports')
+    parser.add_argument('--gateways', nargs='*', default=None)
+    parser.add_argument('--settle', type=float, default=5, help="ثانیه‌های ثابت ماندن فایل قبل از پردازش")
+    parser.add_argument('--poll-interval', type=float, default=2)
+    parser.add_argument('--polling', action='store_true', help="استفاده از polling به جای inotify")
+    parser.add_argument('--history-db', default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    system = SmartReconciliationSystem()
+    if args.history_db:
+        from results_store import ReconciliationResultsStore
+        system.results_store = ReconciliationResultsStore(args.history_db)
+    watcher = StatementWatcher(args.watch_dir, args.platform, output_dir=args.output, gateways=args.gateways,
+                               settle_seconds=args.settle, poll_interval=args.poll_interval,
+                               use_inotify=not args.polling, system=system)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())